@@ -1,34 +1,58 @@
-from flask import Flask, jsonify, request, render_template, redirect, url_for, flash, session
+from flask import Flask, Response, jsonify, request, render_template, redirect, url_for, flash, session, g, has_request_context, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, join_room
 from flask_migrate import Migrate
 import os
-from collections import deque
+import logging
 from threading import Lock
 import time
 import re
 import json
 import jwt
+import click
 from datetime import datetime, timedelta, timezone
 import paho.mqtt.client as mqtt
 from functools import wraps
-from sqlalchemy import inspect
+from sqlalchemy import inspect, event
+from sqlalchemy.engine import Engine
+from app.services.log_service import LogAmostrado, configurar_logging
+from app.services.historico_service import HistoricoDispositivos, CargaCompartilhada, METODOS_REDUCAO, reduzir_serie
 
 app = Flask(__name__)
 app.config.from_object('config.Config')
 
+configurar_logging(app.config.get('LOG_LEVEL', 'INFO'))
+# Log do caminho quente da ingestão: estruturado, amostrado por serial e com limite de taxa
+log_ingestao = LogAmostrado(
+    logging.getLogger('hidrometro.ingest'),
+    taxa=app.config.get('LOG_RATE_PER_SEC', 10),
+    amostra=app.config.get('LOG_SAMPLE_EVERY', 100),
+    intervalo_resumo=app.config.get('LOG_SUMMARY_SECONDS', 60),
+)
+
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 
 # SocketIO (usar eventlet ou gevent no run)
-socketio = SocketIO(app, cors_allowed_origins='*')
+socketio = SocketIO(app, cors_allowed_origins='*',
+                    message_queue=app.config.get('SOCKETIO_MESSAGE_QUEUE') or None)
 
 # Import models
-from app.models import cliente_model, dispositivo_model, faturamento_model, usuario_model
+from app.models import cliente_model, dispositivo_model, faturamento_model, usuario_model, agregado_model
 from app.models.dispositivo_model import Dispositivo, Leitura
 from app.models.alerta_model import Alerta
 from app.models.usuario_model import Usuario
 from app.models.cliente_model import Cliente
+from app.services.ingestao_service import escritor_leituras, filtro_recentes, PoolIngestao
+from app.services.deteccao_service import MotorRegras, CheckpointDeteccao, criar_regras
+from app.services.dispositivo_service import cache_dispositivos, serie_leituras_intervalo, ts_ms, garantir_leituras_atuais, recalcular_leituras_atuais
+from app.services.agregacao_service import AgregadorConsumo, GRANULARIDADES, consultar_agregados, recalcular
+from app.services.faturamento_service import gerar_faturamento_mensal
+from app.services.paginacao_service import CursorInvalido
+from app.services.exportacao_service import FORMATOS as FORMATOS_EXPORTACAO, exportar
+from app.services.particao_service import ManutencaoLeituras, particionar_leituras, garantir_particoes, aplicar_retencao, particionada
+from app.services.tempo_real_service import SALA_FROTA, salas_da_conexao, salas_do_dispositivo, AgendadorEmissoes
+from app.services.payload_service import decodificar_payload, is_binario, PayloadInvalido, medidor_decodificacao
 with app.app_context():
     # Se as tabelas não existem, cria todas (apenas para garantir ambiente inicial)
     try:
@@ -38,12 +62,33 @@ with app.app_context():
     except Exception as e:
         print("[INIT] Erro ao criar tabelas:", e)
 
-# Histórico em memória
-_history = deque(maxlen=app.config.get('HISTORY_LIMIT', 1000))
+# Histórico em memória por serial (arrays tipados em anel, LRU sob orçamento de memória)
+_historico = HistoricoDispositivos(
+    capacidade=app.config.get('HISTORY_LIMIT', 1000),
+    orcamento_bytes=app.config.get('HISTORY_MEMORY_MB', 64) * 1024 * 1024,
+)
 _last_data = {}
 _hist_lock = Lock()
-# Estado de detecção de vazamento por serial
-_leak_state = {}
+# Motor de regras de anomalia (vazamento, fluxo noturno, rajada...) com estado incremental por serial
+_motor_regras = MotorRegras(criar_regras(app.config))
+# Estado das regras sobrevive a restarts (e opcionalmente é compartilhado entre processos de ingestão)
+_checkpoint_deteccao = CheckpointDeteccao(
+    _motor_regras,
+    intervalo=app.config['DETECTION_CHECKPOINT_SECONDS'],
+    compartilhado=app.config['DETECTION_SHARED_STATE'],
+)
+# Agregados de consumo por minuto/hora/dia alimentados pelos lotes gravados em Leitura
+_agregador_consumo = AgregadorConsumo(
+    intervalo=app.config['ROLLUP_FLUSH_SECONDS'],
+    offset_horas=app.config['ROLLUP_TZ_OFFSET_HOURS'],
+)
+# Partições mensais de Leitura criadas com antecedência e retenção com arquivamento dos meses antigos
+_manutencao_leituras = ManutencaoLeituras(
+    intervalo_horas=app.config['LEITURA_MAINTENANCE_HOURS'],
+    meses_a_frente=app.config['LEITURA_PARTITION_MONTHS_AHEAD'],
+    meses_retencao=app.config['LEITURA_RETENTION_MONTHS'],
+    diretorio=app.config['LEITURA_ARCHIVE_DIR'],
+)
 
 # Config auth
 _JWT_SECRET = app.config.get('SECRET_KEY', 'dev')
@@ -138,11 +183,28 @@ def logout_page():
 # MQTT Setup
 _mqtt_client = None
 
+# ts abaixo deste valor está em segundos (firmware: getUnixTime()); em ms ele seria uma data de 1973
+_TS_SEGUNDOS_ATE = 10 ** 11
+
+def _normalizar_ts(ts, recebido_ms):
+    """ts do dispositivo em epoch ms (aceita segundos). Fora da janela plausível em torno do recebimento
+    (relógio sem RTC/NTP, unidade errada) retorna None."""
+    try:
+        ts = int(ts)
+    except (TypeError, ValueError):
+        return None
+    if ts < _TS_SEGUNDOS_ATE:
+        ts *= 1000
+    if ts < recebido_ms - app.config['INGEST_TS_MAX_PAST_DAYS'] * 86400000 \
+            or ts > recebido_ms + app.config['INGEST_TS_MAX_FUTURE_SECONDS'] * 1000:
+        return None
+    return ts
+
 def _normalize_payload(obj):
     o = obj or {}
     total = o.get('totalLiters') or o.get('total') or 0
     flow = o.get('flowLmin') or o.get('flowRate') or 0
-    ts = o.get('ts') or int(time.time()*1000)
+    recebido = int(time.time()*1000)
     serial = o.get('numeroSerie') or o.get('serial') or o.get('numero_serie')
     if serial:
         serial = str(serial).strip().upper()
@@ -151,125 +213,209 @@ def _normalize_payload(obj):
         default_serial = app.config.get('DEFAULT_DEVICE_SERIAL')
         if default_serial:
             serial = str(default_serial).strip().upper()
-    return { 'ts': int(ts), 'totalLiters': float(total), 'flowLmin': float(flow), 'numero_serie': serial }
+    ts = _normalizar_ts(o.get('ts'), recebido) if o.get('ts') else recebido
+    if ts is None:
+        # ts implausível: vale o instante de recebimento (não grava leituras em 1970 nem no futuro)
+        log_ingestao.warning('mqtt.ts_invalido', serial, serial=serial, ts=o.get('ts'))
+        ts = recebido
+    return { 'ts': ts, 'totalLiters': float(total), 'flowLmin': float(flow), 'numero_serie': serial }
 
 # MQTT callbacks
-def _on_mqtt_connect(client, userdata, flags, rc):
+def _ingestao_habilitada():
+    """Processos com APP_ROLE=web só servem HTTP/Socket.IO (publicam comandos, não assinam dados)."""
+    return app.config.get('APP_ROLE', 'all') in ('all', 'ingest')
+
+def _on_mqtt_connect(client, userdata, flags, rc, properties=None):
+    # properties só é passado pelo paho quando o protocolo é MQTT v5
+    if not _ingestao_habilitada():
+        print(f"[MQTT] Conectado rc={rc} (APP_ROLE=web: sem assinatura de dados)")
+        return
     # Sempre tenta assinar o tópico configurado e também o padrão esperado pelo firmware
     configured = app.config['MQTT_TOPIC_DADOS']
     default_fw = 'hidrometro/leandro/dados'
-    extra_topics = []
-    try:
-        client.subscribe(configured)
-        if configured != default_fw:
-            extra_topics.append(default_fw)
+    group = app.config.get('MQTT_SHARED_GROUP')
+    # Partições por serial: todas as réplicas recebem tudo e cada uma filtra os seus seriais (PoolIngestao)
+    particionado = app.config.get('INGEST_PARTITIONS', 1) > 1
+    topics = [configured]
+    if configured != default_fw:
+        topics.append(default_fw)
+    # Frames binários sem serial no payload (serial no último segmento do tópico)
+    topico_bin = app.config.get('MQTT_TOPIC_BIN')
+    if topico_bin and topico_bin not in topics:
+        topics.append(topico_bin)
+    if particionado:
+        if group:
+            print('[MQTT] INGEST_PARTITIONS > 1: MQTT_SHARED_GROUP ignorado (assinatura direta, filtro por serial)')
+    elif not group:
         # Fallback wildcard para facilitar debug (pode ser removido em produção)
-        base_wildcard = None
         # Se o tópico tiver ao menos 2 segmentos, usa os dois primeiros como base
         parts = configured.split('/')
         if len(parts) >= 2:
             base_wildcard = f"{parts[0]}/{parts[1]}/#"
-        for t in extra_topics:
+            if base_wildcard not in topics:
+                topics.append(base_wildcard)
+    else:
+        # Shared subscription: o broker entrega cada mensagem a apenas um assinante do grupo,
+        # dividindo a carga entre as réplicas (sem wildcard extra, que receberia tudo em todas)
+        topics = [f"$share/{group}/{t}" for t in topics]
+    try:
+        for t in topics:
             client.subscribe(t)
-        if base_wildcard and base_wildcard not in (configured, default_fw):
-            client.subscribe(base_wildcard)
-        subscribed = [configured] + extra_topics + ([base_wildcard] if base_wildcard else [])
-        print(f"[MQTT] Conectado rc={rc} subscrito: {', '.join(subscribed)}")
+        print(f"[MQTT] Conectado rc={rc} subscrito: {', '.join(topics)}")
     except Exception as e:
         print('[MQTT] Erro subscribe', e)
 
-def _persist_leitura(data):
-    # Garante contexto mesmo se chamado a partir de thread MQTT
-    with app.app_context():
-        dispositivo_id = None
-        serial = data.get('numero_serie')
-        if serial:
-            disp = Dispositivo.query.filter_by(numero_serie=serial).first()
-            if disp:
-                dispositivo_id = disp.id_dispositivo
-        if dispositivo_id is None:
-            # Sem dispositivo correspondente: ignorar persistência para evitar FK inválida
-            return
-        try:
-            leitura = Leitura(
-                dispositivo_id=dispositivo_id,
-                data_hora=datetime.now(timezone.utc),
-                consumo_litros=data['totalLiters'],
-                total_liters=data['totalLiters'],
-                flow_lmin=data['flowLmin']
-            )
-            db.session.add(leitura)
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
 
-def _process_leak_detection(data):
-    """Aplica regra de detecção de vazamento com agregação temporal e emite/persiste alertas.
+def _persist_leituras(leituras):
+    """Resolve o dispositivo de cada leitura e envia todas juntas ao buffer de gravação em lote.
 
-    Mantém estado em _leak_state indexado por serial.
+    Retorna {serial: DispositivoResolvido | None} (reutilizado para direcionar os emits).
+    """
+    linhas = []
+    dispositivos = {}
+    # Garante contexto mesmo se chamado a partir de thread MQTT
+    with app.app_context():
+        for data in leituras:
+            serial = data.get('numero_serie')
+            if serial not in dispositivos:
+                dispositivos[serial] = cache_dispositivos.resolver(serial) if serial else None
+            disp = dispositivos[serial]
+            if disp is None:
+                # Sem dispositivo correspondente: ignorar persistência para evitar FK inválida
+                continue
+            linhas.append({
+                'dispositivo_id': disp.id_dispositivo,
+                # Instante informado pelo dispositivo (chave de idempotência junto com dispositivo_id)
+                'data_hora': _EPOCH + timedelta(milliseconds=data['ts']),
+                'consumo_litros': data['totalLiters'],
+                'total_liters': data['totalLiters'],
+                'flow_lmin': data['flowLmin'],
+                'vazamento_detectado': False,
+            })
+    if linhas:
+        # Gravação assíncrona em lote (write-behind); ver ingestao_service.EscritorLeituras
+        escritor_leituras.enfileirar_lote(linhas)
+    return dispositivos
+
+def _evento_data(leituras):
+    evento = dict(leituras[-1])
+    if len(leituras) > 1:
+        # Frame com várias leituras: evento 'data' traz a última + todos os pontos do frame
+        evento['points'] = [{'ts': d['ts'], 'totalLiters': d['totalLiters'], 'flowLmin': d['flowLmin'],
+                             'numero_serie': d.get('numero_serie')} for d in leituras]
+    return evento
+
+_agendador_tempo_real = AgendadorEmissoes(
+    lambda evento, payload, sala: socketio.emit(evento, payload, to=sala),
+    tick_ms=app.config['REALTIME_TICK_MS'],
+    max_pontos=app.config['REALTIME_MAX_POINTS'],
+) if app.config['REALTIME_TICK_MS'] > 0 else None
+
+def _emitir_leituras(leituras, dispositivos):
+    """Emite 'data' para a sala da frota e, agrupado por serial, para as salas do serial e do cliente.
+
+    Com REALTIME_TICK_MS > 0 as leituras vão para o agendador, que envia um frame por sala a cada tick.
     """
+    por_serial = {}
+    for d in leituras:
+        por_serial.setdefault(d.get('numero_serie'), []).append(d)
+    if _agendador_tempo_real is not None:
+        _agendador_tempo_real.publicar((SALA_FROTA,), leituras)
+        for serial, grupo in por_serial.items():
+            _agendador_tempo_real.publicar(salas_do_dispositivo(serial, dispositivos.get(serial)), grupo)
+        return
+    socketio.emit('data', _evento_data(leituras), to=SALA_FROTA)
+    for serial, grupo in por_serial.items():
+        salas = salas_do_dispositivo(serial, dispositivos.get(serial))
+        if salas:
+            socketio.emit('data', _evento_data(grupo), to=salas)
+
+def _ingerir_leituras(brutos, detectar_vazamento=True):
+    """Normaliza um frame (uma ou várias leituras), grava em lote, atualiza o histórico
+    com uma única aquisição do lock e emite o evento Socket.IO para as salas interessadas."""
+    leituras = [_normalize_payload(o) for o in brutos if isinstance(o, dict)]
+    if not leituras:
+        return leituras
+    # Todas vão ao buffer de gravação: a chave única (dispositivo_id, data_hora) descarta as já gravadas, e a
+    # retransmissão de uma leitura cujo lote falhou ou foi descartado ainda chega ao banco
+    dispositivos = _persist_leituras(leituras)
+    # Retransmissões já vistas (mesmo serial e ts) não repetem histórico, emit e alertas
+    leituras = [d for d in leituras if filtro_recentes.novo(d.get('numero_serie'), d['ts'])]
+    if not leituras:
+        return leituras
+    ultima = leituras[-1]
+    with _hist_lock:
+        _last_data.update(ultima)
+    _historico.adicionar_varios(leituras)
+    _emitir_leituras(leituras, dispositivos)
+    if detectar_vazamento:
+        for d in leituras:
+            _processar_anomalias(d, dispositivos.get(d.get('numero_serie')))
+    return leituras
+
+def _alerta_disparado_por_outro_processo(serial, tipo):
+    """Com estado compartilhado, outro processo pode ter disparado o mesmo alerta antes da sincronização
+    (até um intervalo de checkpoint). Consulta só quando uma regra dispara, nunca por leitura."""
+    if not app.config.get('DETECTION_SHARED_STATE'):
+        return False
+    janela = timedelta(seconds=2 * max(1, app.config.get('DETECTION_CHECKPOINT_SECONDS', 30)))
     try:
-        thr = float(app.config.get('LEAK_FLOW_THRESHOLD', 0.0) or 0.0)
-        if thr <= 0:
-            return
-        min_secs = float(app.config.get('LEAK_MIN_SECONDS', 0) or 0)
-        serial = data.get('numero_serie') or 'UNKNOWN'
-        flow = data.get('flowLmin') or 0.0
-        now_ts = data['ts'] / 1000.0
-        st = _leak_state.get(serial)
-        if flow >= thr:
-            if not st:
-                st = {
-                    'start_ts': now_ts,
-                    'last_ts': now_ts,
-                    'peak_flow': flow,
-                    'total_liters_at_start': data.get('totalLiters'),
-                    'alert_sent': False
-                }
-                _leak_state[serial] = st
-            else:
-                st['last_ts'] = now_ts
-                if flow > st['peak_flow']:
-                    st['peak_flow'] = flow
-            duration = st['last_ts'] - st['start_ts']
-            if duration >= min_secs and not st['alert_sent']:
-                dispositivo_id = None
-                disp = Dispositivo.query.filter_by(numero_serie=serial).first()
-                if disp:
-                    dispositivo_id = disp.id_dispositivo
-                alert = Alerta(
-                    dispositivo_id=dispositivo_id,
-                    serial=serial,
-                    tipo='leak',
-                    message=f"Vazamento: fluxo >= {thr:.2f} L/min por {duration:.1f}s (pico {st['peak_flow']:.2f} L/min)",
-                    threshold=thr,
-                    flow_lmin=flow,
-                    total_liters=data.get('totalLiters'),
-                    duration_seconds=duration
-                )
-                try:
-                    db.session.add(alert)
-                    db.session.commit()
-                except Exception:
-                    db.session.rollback()
-                payload_alert = {
-                    'id': alert.id_alerta if 'alert' in locals() and alert.id_alerta else None,
-                    'type': 'leak',
-                    'message': alert.message if 'alert' in locals() else f"Vazamento detectado (serial {serial})",
-                    'serial': serial,
-                    'flowLmin': flow,
-                    'threshold': thr,
-                    'duration': duration,
-                    'totalLiters': data.get('totalLiters'),
-                    'ts': int(now_ts*1000)
-                }
-                socketio.emit('alert', payload_alert)
-                st['alert_sent'] = True
-        else:
-            if st:  # fluxo caiu abaixo do limiar => reset estado
-                _leak_state.pop(serial, None)
+        return db.session.query(Alerta.id_alerta).filter(
+            Alerta.serial == serial, Alerta.tipo == tipo, Alerta.resolved_at.is_(None),
+            Alerta.detected_at >= datetime.now(timezone.utc) - janela).first() is not None
     except Exception:
-        pass
+        db.session.rollback()
+        return False
+
+def _processar_anomalias(data, disp=None):
+    """
+    Avalia a leitura no motor de regras (estado incremental por serial) e persiste/emite os alertas disparados.
+    Só seriais cadastrados (`disp` resolvido) são avaliados: o estado por serial (e seu checkpoint em
+    EstadoDeteccao) não cresce com o que um publicador qualquer ou o wildcard de debug enviar.
+    """
+    if disp is None:
+        return
+    serial = data['numero_serie']
+    anomalias = _motor_regras.avaliar(serial, data['ts'], data.get('totalLiters') or 0.0, data.get('flowLmin') or 0.0,
+                                      dispositivo=disp)
+    for a in anomalias:
+        if _alerta_disparado_por_outro_processo(serial, a.tipo):
+            continue
+        try:
+            alert = Alerta(
+                dispositivo_id=disp.id_dispositivo,
+                serial=serial,
+                tipo=a.tipo,
+                message=a.mensagem,
+                threshold=a.threshold,
+                flow_lmin=a.flow_lmin,
+                total_liters=a.total_liters,
+                duration_seconds=a.duration_seconds,
+            )
+            alert_id = None
+            try:
+                db.session.add(alert)
+                db.session.flush()
+                alert_id = alert.id_alerta  # lido antes do commit (evita SELECT de refresh)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                alert_id = None
+            payload_alert = {
+                'id': alert_id,
+                'type': a.tipo,
+                'message': a.mensagem,
+                'serial': serial,
+                'flowLmin': a.flow_lmin,
+                'threshold': a.threshold,
+                'duration': a.duration_seconds,
+                'totalLiters': a.total_liters,
+                'ts': data['ts'],
+            }
+            socketio.emit('alert', payload_alert, to=[SALA_FROTA] + salas_do_dispositivo(serial, disp))
+        except Exception as e:
+            print('[ALERTA] Falha ao registrar alerta', a.tipo, serial, e)
 
 # Inicializa MQTT
 def init_mqtt():
@@ -282,7 +428,11 @@ def init_mqtt():
         host = m.group(1)
         if m.group(2):
             port = int(m.group(2))
-    _mqtt_client = mqtt.Client()
+    if app.config.get('MQTT_PROTOCOL') == '5' or app.config.get('MQTT_SHARED_GROUP'):
+        # Shared subscriptions ($share/<grupo>/...) são parte do MQTT v5
+        _mqtt_client = mqtt.Client(protocol=mqtt.MQTTv5)
+    else:
+        _mqtt_client = mqtt.Client()
     _mqtt_client.on_connect = _on_mqtt_connect
     _mqtt_client.on_message = _on_mqtt_message
     try:
@@ -292,67 +442,203 @@ def init_mqtt():
         print('[MQTT] Falha ao conectar', e)
 
 def _on_mqtt_message(client, userdata, msg):
+    # Apenas enfileira: parsing, persistência, emit e detecção rodam nos workers do pool
+    _pool_ingestao.submeter(msg.topic, msg.payload)
+
+def _processar_mensagem_mqtt(topic, payload_bytes):
     # Garante contexto de aplicação para operações ORM
     with app.app_context():
-        # Log bruto (limitando tamanho para evitar flood)
-        try:
-            raw = msg.payload.decode('utf-8', errors='replace')
-        except Exception:
-            raw = '<decode-error>'
-        print(f"[MQTT] RECEBIDO topic={msg.topic} bytes={len(msg.payload)} raw={raw[:200]}")
         try:
-            payload = json.loads(raw)
-        except Exception as e:
-            print('[MQTT] payload inválido (JSON parse falhou):', e)
+            brutos = decodificar_payload(topic, payload_bytes)
+        except PayloadInvalido as e:
+            # Log bruto (limitando tamanho para evitar flood), amostrado por tópico
+            if log_ingestao.logger.isEnabledFor(logging.WARNING):
+                raw = 'bin:' + payload_bytes[:100].hex() if is_binario(payload_bytes) else payload_bytes[:200].decode('utf-8', errors='replace')
+                log_ingestao.warning('mqtt.payload_invalido', topic, topic=topic, bytes=len(payload_bytes), erro=e, raw=repr(raw))
             return
-        data = _normalize_payload(payload)
-        with _hist_lock:
-            _last_data.update(data)
-            _history.append({'ts': data['ts'], 'totalLiters': data['totalLiters'], 'flowLmin': data['flowLmin']})
-        _persist_leitura(data)
-        print(f"[MQTT] NORMALIZADO ts={data['ts']} total={data['totalLiters']} flow={data['flowLmin']} serial={data.get('numero_serie')}")
-        socketio.emit('data', data)
-        _process_leak_detection(data)
+        leituras = _ingerir_leituras(brutos)
+        if leituras:
+            data = leituras[-1]
+            log_ingestao.debug('mqtt.leitura', data.get('numero_serie'), topic=topic, bytes=len(payload_bytes), n=len(leituras),
+                               ts=data['ts'], total=data['totalLiters'], flow=data['flowLmin'], serial=data.get('numero_serie'))
+
+_pool_ingestao = PoolIngestao(
+    _processar_mensagem_mqtt,
+    workers=app.config.get('INGEST_WORKERS', 4),
+    max_queue=app.config.get('INGEST_WORKER_QUEUE', 10000),
+    politica=app.config.get('INGEST_OVERFLOW_POLICY', 'block'),
+    spill_path=app.config.get('INGEST_SPILL_PATH'),
+    particao=app.config.get('INGEST_PARTITION', 0),
+    particoes=app.config.get('INGEST_PARTITIONS', 1),
+)
+
+_carga_historico = CargaCompartilhada()
+
+def _carregar_historico_do_banco(serial=None, limit=200):
+    """Preenche o histórico em memória com as últimas leituras do banco (ex: após restart).
+
+    A consulta roda fora de qualquer lock; conexões/requisições simultâneas pedindo a mesma
+    carga esperam a execução em andamento em vez de repetir a consulta.
+    """
+    _carga_historico.executar((serial, limit), lambda: _consultar_historico_do_banco(serial, limit))
+
+def _consultar_historico_do_banco(serial, limit):
+    try:
+        colunas = (Leitura.data_hora, Leitura.consumo_litros, Leitura.total_liters, Leitura.flow_lmin)
+        if serial:
+            # id resolvido pelo cache: varredura reversa de uq_leitura_dispositivo_data_hora, sem JOIN
+            disp = cache_dispositivos.resolver(serial)
+            if disp is None:
+                return
+            rows = (db.session.query(db.literal(serial).label('numero_serie'), *colunas)
+                    .filter(Leitura.dispositivo_id == disp.id_dispositivo)
+                    .order_by(Leitura.data_hora.desc()).limit(limit).all())
+        else:
+            # frota: as `limit` mais recentes por ix_leitura_data_hora, JOIN só nessas linhas
+            rows = (db.session.query(Dispositivo.numero_serie, *colunas)
+                    .join(Dispositivo, Dispositivo.id_dispositivo == Leitura.dispositivo_id)
+                    .order_by(Leitura.data_hora.desc()).limit(limit).all())
+        # Inserir em ordem cronológica (somente seriais que continuam vazios em memória)
+        _historico.preencher([{
+            'numero_serie': str(r.numero_serie).strip().upper(),
+            'ts': ts_ms(r.data_hora),
+            'totalLiters': float(r.total_liters if r.total_liters is not None else r.consumo_litros or 0),
+            'flowLmin': float(r.flow_lmin) if r.flow_lmin is not None else 0.0,
+        } for r in reversed(rows)])
+    except Exception as e:
+        print('[HISTORY] Falha ao carregar histórico do banco:', e)
+
+def _param_pontos():
+    """Lê `points` (alvo do downsampling) e `method` (lttb | minmax) da query string."""
+    pontos = request.args.get('points', type=int)
+    if pontos is not None:
+        pontos = max(3, min(pontos, app.config['HISTORY_MAX_POINTS']))
+    metodo = (request.args.get('method') or '').lower()
+    return pontos, metodo if metodo in METODOS_REDUCAO else None
 
 @app.route('/api/history')
 def api_history():
+    """
+    Histórico em memória de um serial. Query params: serial (padrão: dispositivo mais recente),
+    since (epoch ms), limit, points (reduz para ~N pontos preservando a forma), method (lttb | minmax).
+    """
     limit = int(request.args.get('limit', 200))
+    since = request.args.get('since', type=int)
+    serial = request.args.get('serial')
+    serial = serial.strip().upper() if serial else None
+    pontos, metodo = _param_pontos()
     # Se histórico em memória estiver vazio (ex: após restart), carrega últimas leituras do banco
-    with _hist_lock:
-        if not _history:
-            try:
-                rows = (Leitura.query.order_by(Leitura.data_hora.desc())
-                        .limit(limit)
-                        .all())
-                # Inserir em ordem cronológica
-                for r in reversed(rows):
-                    try:
-                        ts = int(r.data_hora.timestamp()*1000)
-                    except Exception:
-                        ts = None
-                    _history.append({
-                        'ts': ts,
-                        'totalLiters': float(r.total_liters) if r.total_liters is not None else None,
-                        'flowLmin': float(r.flow_lmin) if r.flow_lmin is not None else None
-                    })
-            except Exception as e:
-                print('[HISTORY] Falha ao carregar histórico do banco:', e)
-        data = list(_history)[-limit:]
-    return jsonify({'history': data})
+    if _historico.vazio(serial):
+        _carregar_historico_do_banco(serial, limit)
+    if pontos is None:
+        data = _historico.consultar(serial, since=since, limit=limit)
+        return jsonify({'history': data, 'serial': serial or _historico.serial_mais_recente()})
+    serial, ts, total, flow = _historico.consultar_colunas(serial, since=since, limit=limit)
+    data = reduzir_serie(ts, total, flow, pontos, metodo or 'lttb')
+    return jsonify({'history': data, 'serial': serial, 'sourcePoints': len(ts)})
+
+@app.route('/api/history/range')
+def api_history_range():
+    """
+    Série de um serial lida do banco (Leitura) em [start, end) (epoch ms), reduzida para ~points pontos.
+    method=minmax (padrão) agrega no banco; method=lttb lê o intervalo e aplica LTTB.
+    """
+    serial = (request.args.get('serial') or '').strip().upper()
+    fim = request.args.get('end', type=int) or int(time.time() * 1000)
+    inicio = request.args.get('start', type=int)
+    if inicio is None:
+        inicio = fim - 24 * 3600 * 1000
+    if not serial or inicio >= fim:
+        return jsonify({'error': 'serial, start < end obrigatórios'}), 400
+    disp = cache_dispositivos.resolver(serial)
+    if disp is None:
+        return jsonify({'error': 'dispositivo não encontrado'}), 404
+    pontos, metodo = _param_pontos()
+    data = serie_leituras_intervalo(
+        disp.id_dispositivo,
+        _EPOCH + timedelta(milliseconds=inicio),
+        _EPOCH + timedelta(milliseconds=fim),
+        pontos or 500,
+        metodo or 'minmax',
+    )
+    return jsonify({'history': data, 'serial': serial, 'start': inicio, 'end': fim})
+
+@app.route('/api/consumption')
+@require_auth
+def api_consumption():
+    """
+    Consumo agregado de um serial em [start, end) (epoch ms), lido de ConsumoMinuto/Hora/Dia.
+    granularity=minute|hour|day (padrão hour); dias são locais (ROLLUP_TZ_OFFSET_HOURS).
+    """
+    serial = (request.args.get('serial') or '').strip().upper()
+    granularidade = request.args.get('granularity', 'hour')
+    fim = request.args.get('end', type=int) or int(time.time() * 1000)
+    inicio = request.args.get('start', type=int)
+    if inicio is None:
+        inicio = fim - 24 * 3600 * 1000
+    if not serial or inicio >= fim or granularidade not in GRANULARIDADES:
+        return jsonify({'error': 'serial, start < end e granularity (minute, hour, day) obrigatórios'}), 400
+    disp = cache_dispositivos.resolver(serial)
+    if disp is None:
+        return jsonify({'error': 'dispositivo não encontrado'}), 404
+    de = datetime.fromtimestamp(inicio / 1000, timezone.utc).replace(tzinfo=None)
+    ate = datetime.fromtimestamp(fim / 1000, timezone.utc).replace(tzinfo=None)
+    if granularidade == 'day':
+        offset = timedelta(hours=app.config['ROLLUP_TZ_OFFSET_HOURS'])
+        de, ate = (de + offset).date(), (ate + offset).date()
+    linhas = consultar_agregados(disp.id_dispositivo, granularidade, de, ate)
+    return jsonify({'serial': serial, 'granularity': granularidade, 'start': inicio, 'end': fim,
+                    'liters': round(sum(float(l.consumo_litros) for l in linhas), 3),
+                    'rows': [l.to_dict() for l in linhas]})
 
 @app.route('/api/current')
 def api_current():
     # Último dado recebido em memória (sem consulta ao banco)
     with _hist_lock:
-        if not _last_data and _history:
-            # fallback: pega último do histórico
-            tail = _history[-1]
-            return jsonify({
-                'ts': tail.get('ts'),
-                'totalLiters': tail.get('totalLiters'),
-                'flowLmin': tail.get('flowLmin')
-            })
-        return jsonify(_last_data or {})
+        if _last_data:
+            return jsonify(_last_data)
+    # fallback: pega último do histórico
+    return jsonify(_historico.ultimo() or {})
+
+@app.route('/api/export/readings')
+@require_auth
+@require_role('admin')
+def api_export_readings():
+    """
+    Exporta leituras em [start, end) (epoch ms; padrão: últimas 24 h) como arquivo em streaming (somente admin:
+    usuários não têm vínculo com clientes, então nenhum escopo é restrito ao próprio cliente).
+    Escopo: serial=ABC (um dispositivo), client_id=N (dispositivos do cliente) ou nenhum (frota).
+    format=csv|ndjson (padrão csv); gzip=1 comprime (arquivo .gz).
+    """
+    formato = (request.args.get('format') or 'csv').lower()
+    fim = request.args.get('end', type=int) or int(time.time() * 1000)
+    inicio = request.args.get('start', type=int)
+    if inicio is None:
+        inicio = fim - 24 * 3600 * 1000
+    if formato not in FORMATOS_EXPORTACAO or inicio >= fim:
+        return jsonify({'error': 'format (csv, ndjson) e start < end obrigatórios'}), 400
+    serial = (request.args.get('serial') or '').strip().upper()
+    cliente_id = request.args.get('client_id', type=int)
+    dispositivo_id = None
+    if serial:
+        disp = cache_dispositivos.resolver(serial)
+        if disp is None:
+            return jsonify({'error': 'dispositivo não encontrado'}), 404
+        dispositivo_id, escopo = disp.id_dispositivo, serial
+    elif cliente_id is not None:
+        if db.session.get(Cliente, cliente_id) is None:
+            return jsonify({'error': 'cliente não encontrado'}), 404
+        escopo = f'cliente{cliente_id}'
+    else:
+        escopo = 'frota'
+    comprimir = request.args.get('gzip') == '1'
+    de = datetime.fromtimestamp(inicio / 1000, timezone.utc).replace(tzinfo=None)
+    ate = datetime.fromtimestamp(fim / 1000, timezone.utc).replace(tzinfo=None)
+    blocos = exportar(formato, de, ate, dispositivo_id=dispositivo_id, cliente_id=cliente_id, gzip=comprimir)
+    nome = f"leituras_{escopo}_{de:%Y%m%d%H%M}_{ate:%Y%m%d%H%M}.{formato}" + ('.gz' if comprimir else '')
+    tipo = 'application/gzip' if comprimir else ('text/csv' if formato == 'csv' else 'application/x-ndjson')
+    return Response(stream_with_context(blocos), mimetype=tipo,
+                    headers={'Content-Disposition': f'attachment; filename="{nome}"'})
 
 @app.route('/api/alerts')
 def api_alerts_list():
@@ -379,22 +665,22 @@ def api_alert_resolve(alert_id):
 
 @app.route('/api/alerts/clear-temporary', methods=['POST'])
 def api_alerts_clear_temp():
-    """Limpa alertas em memória enviados (estado de leak) - não altera registros persistidos."""
-    _leak_state.clear()
+    """Limpa o estado em memória das regras de detecção - não altera registros persistidos."""
+    _motor_regras.limpar()
     return jsonify({'status':'cleared'})
 
 @app.route('/api/data', methods=['POST'])
 @require_auth
 @require_role('admin','user')
 def api_data():
-    payload = request.get_json(silent=True) or {}
-    data = _normalize_payload(payload)
-    with _hist_lock:
-        _last_data.update(data)
-        _history.append({'ts': data['ts'], 'totalLiters': data['totalLiters'], 'flowLmin': data['flowLmin']})
-    _persist_leitura(data)
-    socketio.emit('data', data)
-    return jsonify({'status': 'ok'})
+    # Aceita objeto JSON, lista de objetos, NDJSON ou frame binário
+    corpo = request.get_data()
+    try:
+        brutos = decodificar_payload(None, corpo) if corpo else [{}]
+    except PayloadInvalido:
+        brutos = [{}]
+    leituras = _ingerir_leituras(brutos, detectar_vazamento=False)
+    return jsonify({'status': 'ok', 'count': len(leituras)})
 
 @app.route('/api/cmd', methods=['POST', 'GET'])
 @require_auth
@@ -426,42 +712,210 @@ def api_cmd():
 def healthz():
     return jsonify({'status': 'ok'}), 200
 
+if app.config.get('DEBUG_QUERY_COUNT'):
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def _contar_consulta(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            g.consultas_sql = g.get('consultas_sql', 0) + 1
+
+    @app.after_request
+    def _cabecalho_consultas(resposta):
+        resposta.headers['X-Query-Count'] = str(g.get('consultas_sql', 0))
+        return resposta
+
 @app.route('/api/debug/history-size')
 @require_auth
 @require_role('admin')
 def debug_history_size():
-    with _hist_lock:
-        size = len(_history)
-    return jsonify({'historySize': size, 'limit': _history.maxlen})
+    st = _historico.stats()
+    return jsonify({'historySize': st['readings'], 'limit': st['limitPerDevice'], **st})
+
+@app.route('/api/debug/ingest')
+@require_auth
+@require_role('admin')
+def debug_ingest():
+    """Métricas da ingestão: buffer write-behind, cache de dispositivos, workers MQTT, emissão em tempo real, regras de detecção, agregados e manutenção de Leitura."""
+    return jsonify({**escritor_leituras.stats(), 'deviceCache': cache_dispositivos.stats(),
+                    'workers': _pool_ingestao.stats(), 'decode': medidor_decodificacao.stats(),
+                    'dedup': filtro_recentes.stats(),
+                    'detection': {**_motor_regras.stats(), 'checkpoint': _checkpoint_deteccao.stats()},
+                    'rollup': _agregador_consumo.stats(),
+                    'retention': _manutencao_leituras.stats(),
+                    'realtime': _agendador_tempo_real.stats() if _agendador_tempo_real else None})
 
 @socketio.on('connect')
-def on_connect():
-    with _hist_lock:
-        # Carrega último histórico do banco se memória vazia
-        if not _history:
-            try:
-                rows = (Leitura.query.order_by(Leitura.data_hora.desc())
-                        .limit(200)
-                        .all())
-                for r in reversed(rows):
-                    try:
-                        ts = int(r.data_hora.timestamp()*1000)
-                    except Exception:
-                        ts = None
-                    _history.append({
-                        'ts': ts,
-                        'totalLiters': float(r.total_liters) if r.total_liters is not None else None,
-                        'flowLmin': float(r.flow_lmin) if r.flow_lmin is not None else None
-                    })
-            except Exception as e:
-                print('[HISTORY] Falha ao carregar histórico (socket connect):', e)
-        if _history:
-            socketio.emit('history:init', list(_history)[-200:])
-        if _last_data:
-            socketio.emit('data', _last_data)
+def on_connect(auth=None):
+    """Entra nas salas pedidas e envia o estado inicial somente para o socket que conectou.
+
+    auth.since (epoch ms da última leitura já exibida) limita o history:init às leituras posteriores.
+    """
+    salas = salas_da_conexao(auth)
+    for sala in salas:
+        join_room(sala)
+    auth = auth if isinstance(auth, dict) else {}
+    serials = [s.split(':', 1)[1] for s in salas if s.startswith('serial:')]
+    if SALA_FROTA not in salas and not serials:
+        return  # tela do cliente carrega o estado inicial via REST
+    serial = serials[0] if serials else None
+    try:
+        since = int(auth['since']) + 1 if auth.get('since') else None
+    except (TypeError, ValueError):
+        since = None
+    # Memória vazia (ex: após restart): carga do banco fora de lock, compartilhada entre conexões simultâneas
+    if _historico.vazio(serial):
+        _carregar_historico_do_banco(serial, limit=200)
+    rows = _historico.consultar(serial, since=since, limit=200)
+    if rows:
+        socketio.emit('history:init', rows, to=request.sid)
+    if SALA_FROTA in salas:
+        with _hist_lock:
+            ultima = dict(_last_data)
+        if ultima:
+            socketio.emit('data', ultima, to=request.sid)
 
 from app.controllers import cliente_controller, dispositivo_controller, tipo_dispositivo_controller, faturamento_controller
 
+@app.errorhandler(CursorInvalido)
+def cursor_invalido(e):
+    """Cursor de paginação adulterado ou expirado: volta à primeira página da mesma listagem."""
+    if request.path.startswith('/api/'):
+        return jsonify({'error': str(e)}), 400
+    flash('Link de paginação inválido; exibindo a primeira página.', 'danger')
+    return redirect(url_for(request.endpoint, **(request.view_args or {})))
+
+@app.cli.command('agregados-recalcular')
+@click.option('--inicio', help='Primeiro dia local (YYYY-MM-DD); padrão: ontem')
+@click.option('--fim', help='Dia local final, exclusivo (YYYY-MM-DD); padrão: inicio + 1 dia')
+def cli_agregados_recalcular(inicio, fim):
+    """Refaz os agregados de consumo (minuto/hora/dia) a partir da tabela Leitura."""
+    offset = app.config['ROLLUP_TZ_OFFSET_HOURS']
+    hoje = (datetime.now(timezone.utc) + timedelta(hours=offset)).date()
+    ini = datetime.strptime(inicio, '%Y-%m-%d').date() if inicio else hoje - timedelta(days=1)
+    fim = datetime.strptime(fim, '%Y-%m-%d').date() if fim else ini + timedelta(days=1)
+    t0 = time.perf_counter()
+
+    def progresso(dia, resumo):
+        print(f"[ROLLUP] {dia} ok: {resumo['readings']} leituras, {resumo['rows']} linhas ({time.perf_counter() - t0:.1f}s)")
+
+    resumo = recalcular(ini, fim, offset_horas=offset, progresso=progresso, agregador=_agregador_consumo)
+    print(f"[ROLLUP] {resumo['days']} dia(s) recalculado(s) em {time.perf_counter() - t0:.1f}s")
+
+def _mes_referencia(texto):
+    """'YYYY-MM' -> primeiro dia do mês; vazio = mês anterior (no fuso dos agregados)."""
+    if texto:
+        return datetime.strptime(texto[:7], '%Y-%m').date()
+    hoje = (datetime.now(timezone.utc) + timedelta(hours=app.config['ROLLUP_TZ_OFFSET_HOURS'])).date()
+    return (hoje.replace(day=1) - timedelta(days=1)).replace(day=1)
+
+@app.cli.command('faturamento-gerar')
+@click.option('--mes', help='Mês de referência (YYYY-MM); padrão: mês anterior')
+@click.option('--recalcular-agregados/--sem-recalcular-agregados', default=True,
+              help='Refaz antes os agregados diários do mês a partir de Leitura (padrão: sim)')
+def cli_faturamento_gerar(mes, recalcular_agregados):
+    """Gera o ConsumoMensal de todos os clientes a partir dos agregados de consumo."""
+    def progresso(etapa, info):
+        print(f'[FATURAMENTO] {etapa}: {info}')
+
+    resumo = gerar_faturamento_mensal(_mes_referencia(mes), recalcular_agregados,
+                                      offset_horas=app.config['ROLLUP_TZ_OFFSET_HOURS'], progresso=progresso,
+                                      agregador=_agregador_consumo)
+    print(f"[FATURAMENTO] {resumo['month']}: {resumo['clients']} clientes, {resumo['liters']:.2f} L, "
+          f"R$ {resumo['amount'] if resumo['amount'] is not None else '-'} em {resumo['timingsMs']['total']} ms")
+
+@app.route('/api/billing/run', methods=['POST'])
+@require_auth
+@require_role('admin')
+def api_billing_run():
+    """Gera o ConsumoMensal do mês (JSON: month 'YYYY-MM', padrão mês anterior; rebuildRollups, padrão true)."""
+    data = request.get_json(silent=True) or {}
+    try:
+        mes = _mes_referencia(data.get('month') or request.args.get('month'))
+    except ValueError:
+        return jsonify({'error': 'month deve ser YYYY-MM'}), 400
+    try:
+        resumo = gerar_faturamento_mensal(mes, bool(data.get('rebuildRollups', True)),
+                                          offset_horas=app.config['ROLLUP_TZ_OFFSET_HOURS'],
+                                          agregador=_agregador_consumo)
+    except Exception as e:
+        return jsonify({'error': f'falha no faturamento: {e}'}), 500
+    return jsonify(resumo)
+
+@app.cli.command('leituras-atuais-recalcular')
+def cli_leituras_atuais_recalcular():
+    """Reconstrói LeituraAtual (última leitura por dispositivo) a partir de Leitura."""
+    t0 = time.perf_counter()
+    n = recalcular_leituras_atuais()
+    print(f'[INGEST] LeituraAtual reconstruída: {n} dispositivos ({time.perf_counter() - t0:.1f}s)')
+
+def _data_hora_utc(ctx, param, valor):
+    """Callback de opção: 'YYYY-MM-DD' ou 'YYYY-MM-DDTHH:MM' (UTC) -> datetime naive."""
+    if valor is None:
+        return None
+    try:
+        dt = datetime.fromisoformat(valor)
+    except ValueError:
+        raise click.BadParameter(f'{valor!r} não é uma data (YYYY-MM-DD ou YYYY-MM-DDTHH:MM)')
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+@app.cli.command('leituras-exportar')
+@click.option('--serial', help='Número de série de um dispositivo')
+@click.option('--cliente', type=int, help='Id do cliente (todos os dispositivos dele)')
+@click.option('--inicio', required=True, callback=_data_hora_utc, help='Início, UTC (YYYY-MM-DD ou YYYY-MM-DDTHH:MM)')
+@click.option('--fim', required=True, callback=_data_hora_utc, help='Fim exclusivo, UTC (YYYY-MM-DD ou YYYY-MM-DDTHH:MM)')
+@click.option('--formato', type=click.Choice(FORMATOS_EXPORTACAO), default='csv')
+@click.option('--saida', type=click.Path(dir_okay=False), help='Arquivo de saída (padrão: stdout); .gz comprime')
+@click.option('--gzip', 'comprimir', is_flag=True, help='Comprime em gzip')
+def cli_leituras_exportar(serial, cliente, inicio, fim, formato, saida, comprimir):
+    """Exporta leituras (CSV/NDJSON) de um dispositivo, de um cliente ou da frota, em streaming."""
+    if inicio >= fim:
+        raise click.BadParameter('deve ser posterior a --inicio', param_hint='--fim')
+    dispositivo_id = None
+    if serial:
+        disp = cache_dispositivos.resolver(serial.strip().upper())
+        if disp is None:
+            raise click.ClickException(f'dispositivo {serial} não encontrado')
+        dispositivo_id = disp.id_dispositivo
+    comprimir = comprimir or bool(saida and saida.endswith('.gz'))
+    blocos = exportar(formato, inicio, fim,
+                      dispositivo_id=dispositivo_id, cliente_id=cliente, gzip=comprimir)
+    t0 = time.perf_counter()
+    n = 0
+    destino = click.open_file(saida or '-', 'wb')
+    with destino:
+        for bloco in blocos:
+            dados = bloco if comprimir else bloco.encode('utf-8')
+            destino.write(dados)
+            n += len(dados)
+    click.echo(f'[EXPORT] {n} bytes em {time.perf_counter() - t0:.1f}s', err=True)
+
+@app.cli.command('leituras-particionar')
+@click.option('--meses-a-frente', type=int, default=None, help='Meses futuros com partição criada (padrão: LEITURA_PARTITION_MONTHS_AHEAD)')
+def cli_leituras_particionar(meses_a_frente):
+    """Converte Leitura em tabela particionada por mês (PostgreSQL; rode com a ingestão parada)."""
+    meses = app.config['LEITURA_PARTITION_MONTHS_AHEAD'] if meses_a_frente is None else meses_a_frente
+    t0 = time.perf_counter()
+    if particionada():
+        print(f'[RETENCAO] Leitura já particionada; partições criadas: {garantir_particoes(meses) or "nenhuma"}')
+        return
+    n = particionar_leituras(meses)
+    print(f'[RETENCAO] Leitura particionada em {n} partições mensais ({time.perf_counter() - t0:.1f}s)')
+
+@app.cli.command('leituras-manutencao')
+@click.option('--retencao-meses', type=int, default=None, help='Meses mantidos em Leitura (padrão: LEITURA_RETENTION_MONTHS; 0 = todos)')
+@click.option('--dry-run', is_flag=True, help='Apenas lista os meses que seriam arquivados')
+def cli_leituras_manutencao(retencao_meses, dry_run):
+    """Cria as próximas partições mensais e arquiva/remove os meses fora da retenção."""
+    meses = app.config['LEITURA_RETENTION_MONTHS'] if retencao_meses is None else retencao_meses
+    if particionada() and not dry_run:
+        print(f"[RETENCAO] Partições criadas: {garantir_particoes(app.config['LEITURA_PARTITION_MONTHS_AHEAD']) or 'nenhuma'}")
+    for item in aplicar_retencao(meses, app.config['LEITURA_ARCHIVE_DIR'], simular=dry_run):
+        if dry_run:
+            print(f"[RETENCAO] {item['month']} seria arquivado em {item['file']}")
+        else:
+            print(f"[RETENCAO] {item['month']}: {item['rows']} leituras arquivadas em {item['file']}")
+
 with app.app_context():
     # Protege criação do admin caso tabelas ainda não existam (fase de migração inicial)
     try:
@@ -513,7 +967,44 @@ with app.app_context():
                     print('[INIT] Cliente padrão configurado não encontrado: ID', client_id_cfg)
     except Exception as e:
         print('[INIT] Erro ao garantir vínculo dispositivo padrão:', e)
-    # Inicializa MQTT somente após tentar criar/atualizar dispositivo padrão
+    # Pré-carrega cache numero_serie -> dispositivo usado pela ingestão
+    try:
+        n = cache_dispositivos.aquecer()
+        print(f'[INIT] Cache de dispositivos aquecido ({n} seriais)')
+    except Exception as e:
+        print('[INIT] Falha ao aquecer cache de dispositivos:', e)
+    # A gravação em lote também atualiza LeituraAtual: garante a tabela (e a carga inicial) antes de iniciar
+    try:
+        n = garantir_leituras_atuais()
+        if n is not None:
+            print(f'[INIT] Tabela LeituraAtual criada ({n} dispositivos com leitura)')
+    except Exception as e:
+        print('[INIT] Falha ao preparar LeituraAtual:', e)
+    # Inicializa gravação em lote e MQTT somente após tentar criar/atualizar dispositivo padrão
+    escritor_leituras.iniciar()
+    if _ingestao_habilitada():
+        # Restaura o estado das regras de detecção antes de voltar a receber leituras
+        if app.config['DETECTION_CHECKPOINT_SECONDS'] > 0:
+            try:
+                n = _checkpoint_deteccao.restaurar()
+                print(f'[INIT] Estado de detecção restaurado ({n} seriais)')
+            except Exception as e:
+                print('[INIT] Falha ao restaurar estado de detecção:', e)
+            _checkpoint_deteccao.iniciar()
+        if app.config['ROLLUP_FLUSH_SECONDS'] > 0:
+            try:
+                _agregador_consumo.preparar()
+                print(f"[INIT] Agregados de consumo ativos (gravação a cada {app.config['ROLLUP_FLUSH_SECONDS']}s)")
+                escritor_leituras.apos_gravar.append(_agregador_consumo.registrar)
+                escritor_leituras.trava_gravacao = _agregador_consumo.trava_gravacao
+                _agregador_consumo.iniciar()
+            except Exception as e:
+                print('[INIT] Falha ao iniciar agregados de consumo:', e)
+        _pool_ingestao.iniciar()
+        if app.config['LEITURA_MAINTENANCE_HOURS'] > 0:
+            _manutencao_leituras.iniciar()
+    print(f"[INIT] APP_ROLE={app.config.get('APP_ROLE', 'all')} grupo MQTT compartilhado={app.config.get('MQTT_SHARED_GROUP') or '-'}"
+          f" partição={app.config['INGEST_PARTITION']}/{app.config['INGEST_PARTITIONS']}")
     init_mqtt()
 
 # Endpoint de debug opcional para inspecionar usuários e validar senha padrão
@@ -1,4 +1,4 @@
-from app import app, login_required_view
+from app import app, login_required_view, _motor_regras
 from flask import render_template, request, redirect, url_for, flash
 from app.services import cliente_service
 from app.models.cliente_model import Cliente, Endereco, Telefone  # Importa os modelos Endereco e Telefone
@@ -9,9 +9,9 @@ from app.models.cliente_model import Cliente, Endereco, Telefone  # Importa os m
 @login_required_view
 def listar_clientes():
     """
-    Rota para exibir a lista de clientes.
+    Rota para exibir a lista de clientes (paginada: ?cursor=...&limit=...).
     """
-    clientes = cliente_service.listar_clientes()
+    clientes = cliente_service.listar_clientes(request.args.get('cursor'), request.args.get('limit'))
     return render_template('clientes.html', clientes=clientes)
 
 
@@ -70,7 +70,7 @@ def excluir_cliente(cliente_id):
     """
     Rota para excluir um cliente.
     """
-    if cliente_service.excluir_cliente(cliente_id):
+    if cliente_service.excluir_cliente(cliente_id, motor_regras=_motor_regras):
         flash('Cliente excluído com sucesso!', 'success')
     else:
         flash('Erro ao excluir cliente. Pode haver dispositivos ou leituras associadas.', 'danger')
@@ -2,40 +2,54 @@ from app import app
 from flask import render_template, request, redirect, url_for, flash, jsonify
 from app.services import dispositivo_service, cliente_service # Importa cliente_service para listar clientes
 from app.models.dispositivo_model import Dispositivo # Importa o modelo Dispositivo para uso no template
-from app.models.dispositivo_model import Leitura
-from app import db
+from app import db, require_auth, _motor_regras
+
+def limites_vazamento_do_form(form):
+    """Lê leak_flow_threshold / leak_min_seconds do formulário (vazio = herda; inválido = ValueError)."""
+    limiar = (form.get('leak_flow_threshold') or '').strip().replace(',', '.')
+    segundos = (form.get('leak_min_seconds') or '').strip()
+    return (float(limiar) if limiar else None, int(segundos) if segundos else None)
 
 @app.route('/api/clientes/<int:cliente_id>/dispositivos/current')
 def api_cliente_dispositivos_current(cliente_id):
-    """Retorna para cada dispositivo do cliente a última leitura (se houver)."""
+    """Retorna para cada dispositivo do cliente a última leitura (se houver), via LeituraAtual."""
     cliente = cliente_service.buscar_cliente_por_id(cliente_id) if hasattr(cliente_service, 'buscar_cliente_por_id') else None
     if not cliente:
         return jsonify({'error': 'cliente_not_found'}), 404
-    dispositivos = Dispositivo.query.filter_by(cliente_id=cliente_id).all()
-    result = []
-    for d in dispositivos:
-        leitura = (Leitura.query.filter_by(dispositivo_id=d.id_dispositivo)
-                   .order_by(Leitura.data_hora.desc()).first())
-        result.append({
-            'dispositivo_id': d.id_dispositivo,
-            'numero_serie': d.numero_serie,
-            'modelo': d.modelo,
-            'status': d.status,
-            'ultima_leitura': {
-                'data_hora': leitura.data_hora.isoformat() if leitura else None,
-                'consumo_litros': float(leitura.consumo_litros) if leitura and leitura.consumo_litros is not None else None,
-                'total_liters': float(leitura.total_liters) if leitura and leitura.total_liters is not None else None,
-                'flow_lmin': float(leitura.flow_lmin) if leitura and leitura.flow_lmin is not None else None,
-            } if leitura else None
-        })
-    return jsonify({'cliente_id': cliente_id, 'dispositivos': result})
+    return jsonify({'cliente_id': cliente_id, 'dispositivos': dispositivo_service.leituras_atuais_por_cliente(cliente_id)})
+
+@app.route('/api/dispositivos/current')
+@require_auth
+def api_dispositivos_current():
+    """
+    Última leitura por dispositivo.
+    Com `serials` (separados por vírgula): somente esses dispositivos.
+    Sem `serials`: toda a frota, paginada por `limit` (1 a 1000; acima disso vale 1000) e `after` (id do último
+    dispositivo da página anterior); `next` traz a URL da página seguinte, com o mesmo `limit` efetivo.
+    """
+    serials = request.args.get('serials')
+    if serials is not None:
+        return jsonify({'dispositivos': dispositivo_service.leituras_atuais_por_seriais(serials.split(','))})
+    try:
+        apos = request.args.get('after', type=int)
+        limite = int(request.args.get('limit', 500))
+    except ValueError:
+        return jsonify({'error': 'limit deve ser inteiro'}), 400
+    if limite <= 0:
+        return jsonify({'error': 'limit deve ser positivo'}), 400
+    limite = min(limite, dispositivo_service.LIMITE_PAGINA_ATUAIS)
+    itens, proximo = dispositivo_service.leituras_atuais_frota(apos, limite)
+    return jsonify({
+        'dispositivos': itens,
+        'next': url_for('api_dispositivos_current', after=proximo, limit=limite) if proximo is not None else None,
+    })
 
 @app.route('/dispositivos')
 def listar_dispositivos():
     """
-    Rota para exibir a lista de dispositivos.
+    Rota para exibir a lista de dispositivos (paginada: ?cursor=...&limit=...).
     """
-    dispositivos = dispositivo_service.listar_dispositivos()
+    dispositivos = dispositivo_service.listar_dispositivos(request.args.get('cursor'), request.args.get('limit'))
     return render_template('dispositivos.html', dispositivos=dispositivos)
 
 @app.route('/dispositivo/adicionar', methods=['GET', 'POST'])
@@ -45,7 +59,7 @@ def adicionar_dispositivo():
     GET: Exibe o formulário de adição.
     POST: Processa os dados do formulário e adiciona o dispositivo.
     """
-    clientes = cliente_service.listar_clientes() # Para o dropdown de seleção de cliente
+    clientes = cliente_service.listar_clientes_para_selecao() # Para o dropdown de seleção de cliente
     tipos_dispositivo = dispositivo_service.listar_tipos_dispositivo() # Para o dropdown de seleção de tipo
 
     if request.method == 'POST':
@@ -55,9 +69,15 @@ def adicionar_dispositivo():
         tipo_dispositivo_id = request.form.get('tipo_dispositivo_id')
         data_instalacao = request.form.get('data_instalacao')
         status = request.form.get('status', 'Ativo')
+        try:
+            leak_flow_threshold, leak_min_seconds = limites_vazamento_do_form(request.form)
+        except ValueError:
+            flash('Limites de vazamento inválidos.', 'danger')
+            return render_template('adicionar_dispositivo.html', clientes=clientes, tipos_dispositivo=tipos_dispositivo)
 
         dispositivo = dispositivo_service.inserir_dispositivo(
-            modelo, numero_serie, cliente_id, tipo_dispositivo_id, data_instalacao, status
+            modelo, numero_serie, cliente_id, tipo_dispositivo_id, data_instalacao, status,
+            leak_flow_threshold, leak_min_seconds
         )
         if dispositivo:
             flash('Dispositivo adicionado com sucesso!', 'success')
@@ -78,7 +98,7 @@ def editar_dispositivo(dispositivo_id):
         flash('Dispositivo não encontrado.', 'danger')
         return redirect(url_for('listar_dispositivos'))
 
-    clientes = cliente_service.listar_clientes()
+    clientes = cliente_service.listar_clientes_para_selecao()
     tipos_dispositivo = dispositivo_service.listar_tipos_dispositivo()
 
     if request.method == 'POST':
@@ -88,10 +108,19 @@ def editar_dispositivo(dispositivo_id):
         tipo_dispositivo_id = request.form.get('tipo_dispositivo_id')
         data_instalacao = request.form.get('data_instalacao')
         status = request.form.get('status')
+        try:
+            leak_flow_threshold, leak_min_seconds = limites_vazamento_do_form(request.form)
+        except ValueError:
+            flash('Limites de vazamento inválidos.', 'danger')
+            return render_template('editar_dispositivo.html', dispositivo=dispositivo, clientes=clientes, tipos_dispositivo=tipos_dispositivo)
 
         updated_dispositivo = dispositivo_service.atualizar_dispositivo(
             dispositivo_id, modelo, numero_serie, cliente_id, tipo_dispositivo_id, data_instalacao, status
         )
+        if updated_dispositivo:
+            updated_dispositivo = dispositivo_service.atualizar_limites_dispositivo(
+                dispositivo_id, leak_flow_threshold, leak_min_seconds
+            )
         if updated_dispositivo:
             flash('Dispositivo atualizado com sucesso!', 'success')
             return redirect(url_for('listar_dispositivos'))
@@ -104,7 +133,7 @@ def excluir_dispositivo(dispositivo_id):
     """
     Rota para excluir um dispositivo.
     """
-    if dispositivo_service.excluir_dispositivo(dispositivo_id):
+    if dispositivo_service.excluir_dispositivo(dispositivo_id, motor_regras=_motor_regras):
         flash('Dispositivo excluído com sucesso!', 'success')
     else:
         flash('Erro ao excluir dispositivo. Pode haver leituras ou histórico associados.', 'danger')
@@ -148,6 +177,7 @@ def listar_leituras_dispositivo(dispositivo_id):
         flash('Dispositivo não encontrado.', 'danger')
         return redirect(url_for('listar_dispositivos'))
 
-    leituras = dispositivo_service.listar_leituras_por_dispositivo(dispositivo_id)
+    leituras = dispositivo_service.listar_leituras_por_dispositivo(dispositivo_id, request.args.get('cursor'),
+                                                                   request.args.get('limit'))
     return render_template('leituras_dispositivo.html', dispositivo=dispositivo, leituras=leituras)
 
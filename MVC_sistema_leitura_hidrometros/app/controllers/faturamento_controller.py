@@ -1,6 +1,7 @@
-from app import app
+from app import app, login_required_view, _agregador_consumo
 from flask import render_template, request, redirect, url_for, flash
 from app.services import faturamento_service, cliente_service # Importa cliente_service para dropdown de clientes
+from app.services.tarifa_service import interpretar_faixas, formatar_faixas
 from app.models.faturamento_model import Tarifa, ConsumoMensal # Para uso nos templates
 from datetime import datetime
 
@@ -29,8 +30,13 @@ def adicionar_tarifa():
         if data_fim:
             data_fim = datetime.strptime(data_fim, '%Y-%m-%d').date()
         ativa = 'ativa' in request.form # Checkbox
+        try:
+            faixas = interpretar_faixas(request.form.get('faixas'))
+        except ValueError as e:
+            flash(f'Faixas inválidas: {e}', 'danger')
+            return render_template('adicionar_tarifa.html')
 
-        tarifa = faturamento_service.inserir_tarifa(nome_tarifa, float(valor_m3), data_inicio, data_fim, ativa)
+        tarifa = faturamento_service.inserir_tarifa(nome_tarifa, float(valor_m3), data_inicio, data_fim, ativa, faixas)
         if tarifa:
             flash('Tarifa adicionada com sucesso!', 'success')
             return redirect(url_for('listar_tarifas'))
@@ -60,16 +66,21 @@ def editar_tarifa(tarifa_id):
         else:
             data_fim = None # Se o campo estiver vazio, definir como None
         ativa = 'ativa' in request.form
+        try:
+            faixas = interpretar_faixas(request.form.get('faixas'))
+        except ValueError as e:
+            flash(f'Faixas inválidas: {e}', 'danger')
+            return render_template('editar_tarifa.html', tarifa=tarifa, faixas=request.form.get('faixas'))
 
         updated_tarifa = faturamento_service.atualizar_tarifa(
-            tarifa_id, nome_tarifa, float(valor_m3), data_inicio, data_fim, ativa
+            tarifa_id, nome_tarifa, float(valor_m3), data_inicio, data_fim, ativa, faixas
         )
         if updated_tarifa:
             flash('Tarifa atualizada com sucesso!', 'success')
             return redirect(url_for('listar_tarifas'))
         else:
             flash('Erro ao atualizar tarifa. Verifique os dados.', 'danger')
-    return render_template('editar_tarifa.html', tarifa=tarifa)
+    return render_template('editar_tarifa.html', tarifa=tarifa, faixas=formatar_faixas(tarifa.faixas))
 
 @app.route('/tarifa/excluir/<int:tarifa_id>', methods=['POST'])
 def excluir_tarifa(tarifa_id):
@@ -87,11 +98,33 @@ def excluir_tarifa(tarifa_id):
 @app.route('/consumos_mensais')
 def listar_consumos_mensais():
     """
-    Rota para exibir a lista de consumos mensais.
+    Rota para exibir a lista de consumos mensais (paginada: ?cursor=...&limit=...).
     """
-    consumos = faturamento_service.listar_consumos_mensais()
+    consumos = faturamento_service.listar_consumos_mensais(request.args.get('cursor'), request.args.get('limit'))
     return render_template('consumos_mensais.html', consumos=consumos)
 
+@app.route('/consumos_mensais/gerar', methods=['POST'])
+@login_required_view
+def gerar_consumos_mensais():
+    """
+    Rota para gerar automaticamente o consumo mensal de todos os clientes a partir das leituras
+    (agregados diários) e da tarifa em vigor.
+    """
+    try:
+        mes_referencia = datetime.strptime(request.form['mes_referencia'], '%Y-%m').date()
+    except (KeyError, ValueError):
+        flash('Informe o mês de referência (AAAA-MM).', 'danger')
+        return redirect(url_for('listar_consumos_mensais'))
+    try:
+        resumo = faturamento_service.gerar_faturamento_mensal(
+            mes_referencia, 'recalcular_agregados' in request.form,
+            offset_horas=app.config['ROLLUP_TZ_OFFSET_HOURS'], agregador=_agregador_consumo)
+        flash(f"Faturamento de {mes_referencia.strftime('%m/%Y')} gerado: {resumo['clients']} clientes, "
+              f"{resumo['liters']:.2f} litros ({resumo['timingsMs']['total']:.0f} ms).", 'success')
+    except Exception as e:
+        flash(f'Erro ao gerar faturamento: {e}', 'danger')
+    return redirect(url_for('listar_consumos_mensais'))
+
 @app.route('/consumo_mensal/adicionar', methods=['GET', 'POST'])
 def adicionar_consumo_mensal():
     """
@@ -99,7 +132,7 @@ def adicionar_consumo_mensal():
     GET: Exibe o formulário de adição.
     POST: Processa os dados do formulário e adiciona o consumo.
     """
-    clientes = cliente_service.listar_clientes()
+    clientes = cliente_service.listar_clientes_para_selecao()
     tarifas = faturamento_service.listar_tarifas()
 
     if request.method == 'POST':
@@ -137,7 +170,7 @@ def editar_consumo_mensal(consumo_id):
         flash('Consumo mensal não encontrado.', 'danger')
         return redirect(url_for('listar_consumos_mensais'))
 
-    clientes = cliente_service.listar_clientes()
+    clientes = cliente_service.listar_clientes_para_selecao()
     tarifas = faturamento_service.listar_tarifas()
 
     if request.method == 'POST':
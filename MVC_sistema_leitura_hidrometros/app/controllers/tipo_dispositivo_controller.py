@@ -1,6 +1,7 @@
 from app import app
 from flask import render_template, request, redirect, url_for, flash
 from app.services import dispositivo_service # Reutilizamos o serviço de dispositivo para gerenciar tipos
+from app.controllers.dispositivo_controller import limites_vazamento_do_form
 
 @app.route('/tipos_dispositivo')
 def listar_tipos_dispositivo():
@@ -20,8 +21,13 @@ def adicionar_tipo_dispositivo():
     if request.method == 'POST':
         nome_tipo = request.form['nome_tipo']
         descricao = request.form.get('descricao')
+        try:
+            leak_flow_threshold, leak_min_seconds = limites_vazamento_do_form(request.form)
+        except ValueError:
+            flash('Limites de vazamento inválidos.', 'danger')
+            return render_template('adicionar_tipo_dispositivo.html')
 
-        tipo = dispositivo_service.adicionar_tipo_dispositivo(nome_tipo, descricao)
+        tipo = dispositivo_service.adicionar_tipo_dispositivo(nome_tipo, descricao, leak_flow_threshold, leak_min_seconds)
         if tipo:
             flash('Tipo de dispositivo adicionado com sucesso!', 'success')
             return redirect(url_for('listar_tipos_dispositivo'))
@@ -29,3 +35,30 @@ def adicionar_tipo_dispositivo():
             flash('Erro ao adicionar tipo de dispositivo. Verifique os dados.', 'danger')
     return render_template('adicionar_tipo_dispositivo.html')
 
+@app.route('/tipo_dispositivo/editar/<int:tipo_id>', methods=['GET', 'POST'])
+def editar_tipo_dispositivo(tipo_id):
+    """
+    Rota para editar um tipo de dispositivo (inclui os limites de vazamento do tipo).
+    GET: Exibe o formulário com os dados atuais.
+    POST: Atualiza o tipo; os dispositivos do tipo passam a usar os novos limites imediatamente.
+    """
+    tipo = dispositivo_service.buscar_tipo_dispositivo_por_id(tipo_id)
+    if not tipo:
+        flash('Tipo de dispositivo não encontrado.', 'danger')
+        return redirect(url_for('listar_tipos_dispositivo'))
+
+    if request.method == 'POST':
+        nome_tipo = request.form['nome_tipo']
+        descricao = request.form.get('descricao')
+        try:
+            leak_flow_threshold, leak_min_seconds = limites_vazamento_do_form(request.form)
+        except ValueError:
+            flash('Limites de vazamento inválidos.', 'danger')
+            return render_template('editar_tipo_dispositivo.html', tipo=tipo)
+
+        if dispositivo_service.atualizar_tipo_dispositivo(tipo_id, nome_tipo, descricao, leak_flow_threshold, leak_min_seconds):
+            flash('Tipo de dispositivo atualizado com sucesso!', 'success')
+            return redirect(url_for('listar_tipos_dispositivo'))
+        else:
+            flash('Erro ao atualizar tipo de dispositivo. Verifique os dados.', 'danger')
+    return render_template('editar_tipo_dispositivo.html', tipo=tipo)
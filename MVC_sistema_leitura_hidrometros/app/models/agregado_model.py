@@ -0,0 +1,62 @@
+from app import db
+from sqlalchemy.orm import declared_attr
+
+
+class _ConsumoAgregado:
+    """
+    Colunas comuns dos agregados de consumo por dispositivo e período (mantidos pela ingestão
+    e recalculáveis a partir de Leitura; ver app/services/agregacao_service.py).
+
+    consumo_litros soma o avanço do total acumulado de cada leitura em relação à anterior do
+    mesmo dispositivo, então a soma de períodos consecutivos é o consumo do intervalo inteiro.
+    """
+    @declared_attr
+    def dispositivo_id(cls):
+        return db.Column(db.Integer, db.ForeignKey('Dispositivo.id_dispositivo'), primary_key=True)
+
+    total_min = db.Column(db.Numeric(12, 3), nullable=False)
+    total_max = db.Column(db.Numeric(12, 3), nullable=False)
+    consumo_litros = db.Column(db.Numeric(12, 3), nullable=False, default=0)
+    flow_max = db.Column(db.Numeric(10, 3), nullable=False, default=0)
+    amostras = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        return {
+            'dispositivo_id': self.dispositivo_id,
+            'inicio': self.inicio.isoformat(),
+            'totalMin': float(self.total_min),
+            'totalMax': float(self.total_max),
+            'liters': float(self.consumo_litros),
+            'flowMax': float(self.flow_max),
+            'samples': self.amostras,
+        }
+
+
+class ConsumoMinuto(_ConsumoAgregado, db.Model):
+    """Consumo por dispositivo e minuto (inicio = início do minuto em UTC, como Leitura.data_hora)."""
+    __tablename__ = 'ConsumoMinuto'
+
+    inicio = db.Column(db.DateTime, primary_key=True)
+
+    def __repr__(self):
+        return f'<ConsumoMinuto Dispositivo:{self.dispositivo_id} {self.inicio} Litros:{self.consumo_litros}>'
+
+
+class ConsumoHora(_ConsumoAgregado, db.Model):
+    """Consumo por dispositivo e hora (inicio = início da hora em UTC)."""
+    __tablename__ = 'ConsumoHora'
+
+    inicio = db.Column(db.DateTime, primary_key=True)
+
+    def __repr__(self):
+        return f'<ConsumoHora Dispositivo:{self.dispositivo_id} {self.inicio} Litros:{self.consumo_litros}>'
+
+
+class ConsumoDia(_ConsumoAgregado, db.Model):
+    """Consumo por dispositivo e dia local (ROLLUP_TZ_OFFSET_HOURS), base do faturamento mensal."""
+    __tablename__ = 'ConsumoDia'
+
+    inicio = db.Column(db.Date, primary_key=True)
+
+    def __repr__(self):
+        return f'<ConsumoDia Dispositivo:{self.dispositivo_id} {self.inicio} Litros:{self.consumo_litros}>'
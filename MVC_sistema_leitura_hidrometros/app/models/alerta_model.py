@@ -1,5 +1,6 @@
 from app import db
 from datetime import datetime, timezone
+from sqlalchemy import text
 
 
 class Alerta(db.Model):
@@ -8,6 +9,14 @@ class Alerta(db.Model):
     Mantém registro histórico permitindo auditoria e fechamento (resolved_at).
     """
     __tablename__ = 'Alerta'
+    # Alertas abertos por data (filtro resolved_at IS NULL + ORDER BY detected_at): índice parcial onde o
+    # dialeto suporta; no MySQL, composto (resolved_at, detected_at). Ver migrations/versions.
+    __table_args__ = (
+        db.Index('ix_alerta_abertos_detected_at', 'detected_at',
+                 postgresql_where=text('resolved_at IS NULL'),
+                 sqlite_where=text('resolved_at IS NULL')).ddl_if(dialect=('postgresql', 'sqlite')),
+        db.Index('ix_alerta_resolved_detected_at', 'resolved_at', 'detected_at').ddl_if(dialect=('mysql', 'mariadb')),
+    )
 
     id_alerta = db.Column(db.Integer, primary_key=True)
     dispositivo_id = db.Column(db.Integer, db.ForeignKey('Dispositivo.id_dispositivo'), nullable=True)
@@ -19,7 +28,7 @@ class Alerta(db.Model):
     total_liters = db.Column(db.Float)
     duration_seconds = db.Column(db.Float)
     detected_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), index=True)
-    resolved_at = db.Column(db.DateTime(timezone=True), nullable=True, index=True)
+    resolved_at = db.Column(db.DateTime(timezone=True), nullable=True)
 
     def resolve(self):
         if not self.resolved_at:
@@ -41,3 +50,17 @@ class Alerta(db.Model):
             'detected_at': self.detected_at.isoformat() if self.detected_at else None,
             'resolved_at': self.resolved_at.isoformat() if self.resolved_at else None,
         }
+
+
+class EstadoDeteccao(db.Model):
+    """Checkpoint do estado das regras de detecção por serial (restaurado no startup / compartilhado entre processos).
+
+    `estado` é um JSON compacto {regra: [valores dos slots]}; `ultimo_ts` é o ts (epoch ms) da última
+    leitura avaliada, usado para decidir qual cópia do estado é a mais recente.
+    """
+    __tablename__ = 'EstadoDeteccao'
+
+    serial = db.Column(db.String(100), primary_key=True)
+    estado = db.Column(db.Text, nullable=False)
+    ultimo_ts = db.Column(db.BigInteger, nullable=False)
+    atualizado_em = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
@@ -1,5 +1,6 @@
 from app import db
 from sqlalchemy.dialects.mysql import ENUM # Importa ENUM para MySQL, se necessário
+from sqlalchemy.dialects.mysql import DATETIME as MYSQL_DATETIME
 
 class TipoDispositivo(db.Model):
     """
@@ -11,6 +12,9 @@ class TipoDispositivo(db.Model):
     id_tipo_dispositivo = db.Column(db.Integer, primary_key=True)
     nome_tipo = db.Column(db.String(100), nullable=False, unique=True)
     descricao = db.Column(db.Text)
+    # Limites de vazamento do tipo (nulo = usa LEAK_FLOW_THRESHOLD / LEAK_MIN_SECONDS do config)
+    leak_flow_threshold = db.Column(db.Float)  # L/min
+    leak_min_seconds = db.Column(db.Integer)
 
     # Relacionamento: Um tipo de dispositivo pode ter vários dispositivos
     dispositivos = db.relationship('Dispositivo', backref='tipo_dispositivo', lazy=True)
@@ -35,10 +39,14 @@ class Dispositivo(db.Model):
     # Uma abordagem comum é usar String e validar no código ou usar um tipo customizado.
     # Para compatibilidade, usaremos String e lista de valores permitidos.
     status = db.Column(db.String(50), default='Ativo') # ENUM('Ativo', 'Inativo', 'Manutencao', 'Defeito')
+    # Sobrescreve os limites de vazamento do tipo apenas para este dispositivo (nulo = herda do tipo)
+    leak_flow_threshold = db.Column(db.Float)  # L/min
+    leak_min_seconds = db.Column(db.Integer)
 
     # Relacionamentos:
-    # Um dispositivo pode ter várias leituras
-    leituras = db.relationship('Leitura', backref='dispositivo', lazy=True, cascade="all, delete-orphan")
+    # Um dispositivo pode ter várias leituras (a exclusão do dispositivo as apaga em lote, sem carregá-las:
+    # ver dispositivo_service.excluir_dispositivo)
+    leituras = db.relationship('Leitura', backref='dispositivo', lazy=True, cascade="all, delete-orphan", passive_deletes=True)
     # Um dispositivo pode ter um histórico de status
     historico_status = db.relationship('HistoricoStatusDispositivo', backref='dispositivo', lazy=True, cascade="all, delete-orphan")
 
@@ -51,10 +59,18 @@ class Leitura(db.Model):
     Armazena as leituras de consumo dos dispositivos.
     """
     __tablename__ = "Leitura"
+    # Uma leitura por dispositivo e instante (ts do dispositivo): torna a ingestão idempotente.
+    # A chave única também é o índice das consultas por dispositivo (igualdade + intervalo/ordem em data_hora);
+    # ix_leitura_data_hora atende às consultas da frota inteira por tempo (últimas N, meses da retenção).
+    __table_args__ = (
+        db.UniqueConstraint('dispositivo_id', 'data_hora', name='uq_leitura_dispositivo_data_hora'),
+        db.Index('ix_leitura_data_hora', 'data_hora'),
+    )
 
     id_leitura = db.Column(db.Integer, primary_key=True)
     dispositivo_id = db.Column(db.Integer, db.ForeignKey('Dispositivo.id_dispositivo'), nullable=False)
-    data_hora = db.Column(db.DateTime, nullable=False)
+    # Precisão de milissegundos no MySQL (o padrão DATETIME truncaria o ts do dispositivo em segundos)
+    data_hora = db.Column(db.DateTime().with_variant(MYSQL_DATETIME(fsp=3), 'mysql'), nullable=False)
     consumo_litros = db.Column(db.Numeric(10, 2), nullable=False)
     bateria = db.Column(db.Numeric(5, 2))
     pressao_bar = db.Column(db.Numeric(5, 2))
@@ -65,6 +81,31 @@ class Leitura(db.Model):
     def __repr__(self):
         return f'<Leitura ID: {self.id_leitura} - Dispositivo: {self.dispositivo_id} - Consumo: {self.consumo_litros}>'
 
+class LeituraAtual(db.Model):
+    """
+    Modelo para a tabela 'LeituraAtual'.
+    Última leitura de cada dispositivo (uma linha por dispositivo), atualizada pela ingestão na mesma
+    transação do lote gravado em Leitura; evita buscar a leitura mais recente dispositivo a dispositivo.
+    """
+    __tablename__ = "LeituraAtual"
+
+    dispositivo_id = db.Column(db.Integer, db.ForeignKey('Dispositivo.id_dispositivo'), primary_key=True)
+    data_hora = db.Column(db.DateTime().with_variant(MYSQL_DATETIME(fsp=3), 'mysql'), nullable=False)
+    consumo_litros = db.Column(db.Numeric(10, 2))
+    total_liters = db.Column(db.Numeric(12, 3))
+    flow_lmin = db.Column(db.Numeric(10, 3))
+
+    def to_dict(self):
+        return {
+            'data_hora': self.data_hora.isoformat(),
+            'consumo_litros': float(self.consumo_litros) if self.consumo_litros is not None else None,
+            'total_liters': float(self.total_liters) if self.total_liters is not None else None,
+            'flow_lmin': float(self.flow_lmin) if self.flow_lmin is not None else None,
+        }
+
+    def __repr__(self):
+        return f'<LeituraAtual Dispositivo: {self.dispositivo_id} - {self.data_hora}>'
+
 class HistoricoStatusDispositivo(db.Model):
     """
     Modelo para a tabela 'HistoricoStatusDispositivo'.
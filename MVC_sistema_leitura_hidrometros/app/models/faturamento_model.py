@@ -14,18 +14,42 @@ class Tarifa(db.Model):
     data_fim = db.Column(db.Date)
     ativa = db.Column(db.Boolean, default=True)
 
-    # Não há relacionamento direto 'many-to-one' aqui que precise de backref simples.
+    # Faixas de consumo (tarifa escalonada); sem faixas, vale valor_m3 para todo o consumo
+    faixas = db.relationship('FaixaTarifa', backref='tarifa', lazy=True, cascade="all, delete-orphan",
+                             order_by='FaixaTarifa.ordem')
+
     # A Tarifa é referenciada por ConsumoMensal.
 
     def __repr__(self):
         return f'<Tarifa {self.nome_tarifa} - R${self.valor_m3}/m³>'
 
+class FaixaTarifa(db.Model):
+    """
+    Modelo para a tabela 'FaixaTarifa'.
+    Faixa de consumo de uma tarifa escalonada: os m³ do mês acima do limite da faixa anterior
+    e até `limite_m3` (nulo = sem limite) são cobrados a `valor_m3`.
+    """
+    __tablename__ = "FaixaTarifa"
+
+    id_faixa = db.Column(db.Integer, primary_key=True)
+    tarifa_id = db.Column(db.Integer, db.ForeignKey('Tarifa.id_tarifa'), nullable=False, index=True)
+    ordem = db.Column(db.Integer, nullable=False)
+    limite_m3 = db.Column(db.Numeric(10, 3))
+    valor_m3 = db.Column(db.Numeric(10, 4), nullable=False)
+
+    def __repr__(self):
+        return f'<FaixaTarifa Tarifa:{self.tarifa_id} até {self.limite_m3 or "∞"} m³ - R${self.valor_m3}/m³>'
+
 class ConsumoMensal(db.Model):
     """
     Modelo para a tabela 'ConsumoMensal'.
     Armazena o consumo mensal consolidado por cliente.
     """
     __tablename__ = "ConsumoMensal"
+    # Um registro por cliente e mês: permite que o faturamento automático regrave o mês (upsert)
+    __table_args__ = (
+        db.UniqueConstraint('cliente_id', 'mes_referencia', name='uq_consumo_mensal_cliente_mes'),
+    )
 
     id_consumo = db.Column(db.Integer, primary_key=True)
     cliente_id = db.Column(db.Integer, db.ForeignKey('Cliente.id_cliente'), nullable=False)
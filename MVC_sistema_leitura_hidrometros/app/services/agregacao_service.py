@@ -0,0 +1,341 @@
+"""
+Agregados de consumo por dispositivo (ConsumoMinuto, ConsumoHora, ConsumoDia) mantidos incrementalmente.
+
+- Ingestão: o EscritorLeituras entrega cada lote já gravado em Leitura ao AgregadorConsumo, que acumula
+  em memória (total mínimo/máximo, consumo, vazão máxima, amostras) por período e, a cada `intervalo`
+  segundos, mescla os parciais nas tabelas com um upsert em lote por tabela.
+- Recuperação: `recalcular(inicio, fim)` refaz dias inteiros a partir de Leitura (carga inicial,
+  lacunas, correção após falhas). Com um AgregadorConsumo no mesmo processo, cada dia é refeito com ele
+  pausado (`pausado()`), para que parciais ainda em memória não somem em dobro sobre o dia refeito.
+
+O consumo de uma leitura é o avanço do total acumulado em relação à leitura anterior do mesmo
+dispositivo (quedas do contador contam como zero), atribuído ao período da leitura. Na ingestão, a
+leitura anterior de cada lote é a persistida em LeituraAtual (lida com lock na transação do lote), não
+a última vista pelo processo: com réplicas dividindo as mensagens de um medidor (MQTT_SHARED_GROUP),
+cada avanço do contador é contado uma única vez.
+"""
+import atexit
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import and_, case, func
+from app import app, db
+from app.models.agregado_model import ConsumoMinuto, ConsumoHora, ConsumoDia
+from app.models.dispositivo_model import Dispositivo, Leitura
+from app.services.ingestao_service import upsert
+
+GRANULARIDADES = {'minute': ConsumoMinuto, 'hour': ConsumoHora, 'day': ConsumoDia}
+_MODELOS = (ConsumoMinuto, ConsumoHora, ConsumoDia)
+_COLUNAS = ('total_min', 'total_max', 'consumo_litros', 'flow_max', 'amostras')
+# Como o upsert mescla um parcial com a linha já gravada
+_MESCLAR = {
+    'total_min': lambda atual, novo: case((novo < atual, novo), else_=atual),
+    'total_max': lambda atual, novo: case((novo > atual, novo), else_=atual),
+    'consumo_litros': lambda atual, novo: atual + novo,
+    'flow_max': lambda atual, novo: case((novo > atual, novo), else_=atual),
+    'amostras': lambda atual, novo: atual + novo,
+}
+
+
+def _utc_naive(dh):
+    """data_hora em UTC sem tzinfo (formato gravado em Leitura e nos agregados)."""
+    if dh.tzinfo is not None:
+        dh = dh.astimezone(timezone.utc).replace(tzinfo=None)
+    return dh
+
+
+def _mesclar_parcial(p, q):
+    if q[0] < p[0]:
+        p[0] = q[0]
+    if q[1] > p[1]:
+        p[1] = q[1]
+    p[2] += q[2]
+    if q[3] > p[3]:
+        p[3] = q[3]
+    p[4] += q[4]
+
+
+class Acumulador:
+    """
+    Parciais em memória por (dispositivo_id, período) para minuto, hora e dia local, e o último
+    (data_hora, total) de cada dispositivo, base do consumo da próxima leitura.
+    """
+
+    def __init__(self, offset_horas=0):
+        self.offset = timedelta(hours=offset_horas)
+        self.parciais = ({}, {}, {})  # chave -> [total_min, total_max, consumo, flow_max, amostras]
+        self.ultimos = {}
+
+    def adicionar(self, dispositivo_id, data_hora, total, flow):
+        """Acumula uma leitura; False se ela não é posterior à última do dispositivo (duplicada/fora de ordem)."""
+        ultimo = self.ultimos.get(dispositivo_id)
+        if ultimo is not None and data_hora <= ultimo[0]:
+            return False
+        consumo = max(0.0, total - ultimo[1]) if ultimo is not None else 0.0
+        self.ultimos[dispositivo_id] = (data_hora, total)
+        minuto = data_hora.replace(second=0, microsecond=0)
+        periodos = (minuto, minuto.replace(minute=0), (data_hora + self.offset).date())
+        for parciais, periodo in zip(self.parciais, periodos):
+            p = parciais.get((dispositivo_id, periodo))
+            if p is None:
+                parciais[(dispositivo_id, periodo)] = [total, total, consumo, flow, 1]
+            else:
+                _mesclar_parcial(p, (total, total, consumo, flow, 1))
+        return True
+
+    def extrair(self):
+        """Devolve os parciais acumulados e recomeça do zero."""
+        parciais, self.parciais = self.parciais, ({}, {}, {})
+        return parciais
+
+    def devolver(self, parciais):
+        """Reincorpora parciais que não puderam ser gravados."""
+        for atuais, antigos in zip(self.parciais, parciais):
+            for chave, p in antigos.items():
+                q = atuais.get(chave)
+                if q is None:
+                    atuais[chave] = p
+                else:
+                    _mesclar_parcial(q, p)
+
+
+def _gravar_parciais(parciais):
+    """Mescla os parciais nas tabelas de agregados (um upsert em lote por tabela, sem commit)."""
+    n = 0
+    for modelo, linhas in zip(_MODELOS, parciais):
+        if not linhas:
+            continue
+        db.session.execute(
+            upsert(modelo.__table__, ['dispositivo_id', 'inicio'], _COLUNAS, combinar=_MESCLAR),
+            [{'dispositivo_id': d, 'inicio': periodo, 'total_min': p[0], 'total_max': p[1],
+              'consumo_litros': round(p[2], 3), 'flow_max': p[3], 'amostras': p[4]}
+             for (d, periodo), p in linhas.items()])
+        n += len(linhas)
+    return n
+
+
+def _ultimos_totais(antes_de):
+    """{dispositivo_id: total_max} do último dia agregado antes de `antes_de` (tabela pequena: uma consulta)."""
+    ult = (db.session.query(ConsumoDia.dispositivo_id, func.max(ConsumoDia.inicio).label('inicio'))
+           .filter(ConsumoDia.inicio < antes_de)
+           .group_by(ConsumoDia.dispositivo_id).subquery())
+    linhas = (db.session.query(ConsumoDia.dispositivo_id, ConsumoDia.total_max)
+              .join(ult, and_(ConsumoDia.dispositivo_id == ult.c.dispositivo_id, ConsumoDia.inicio == ult.c.inicio))
+              .all())
+    return {d: float(total) for d, total in linhas}
+
+
+def _ultimos_totais_leituras(antes_de, dias=7):
+    """{dispositivo_id: total} da última leitura nos `dias` anteriores a `antes_de` (UTC), numa consulta."""
+    ult = (db.session.query(Leitura.dispositivo_id, func.max(Leitura.data_hora).label('data_hora'))
+           .filter(Leitura.data_hora >= antes_de - timedelta(days=dias), Leitura.data_hora < antes_de)
+           .group_by(Leitura.dispositivo_id).subquery())
+    linhas = (db.session.query(Leitura.dispositivo_id, func.coalesce(Leitura.total_liters, Leitura.consumo_litros))
+              .join(ult, and_(Leitura.dispositivo_id == ult.c.dispositivo_id, Leitura.data_hora == ult.c.data_hora))
+              .all())
+    return {d: float(total) for d, total in linhas if total is not None}
+
+
+def criar_tabelas():
+    for modelo in _MODELOS:
+        modelo.__table__.create(db.engine, checkfirst=True)
+
+
+class AgregadorConsumo:
+    """
+    Mantém os agregados a partir dos lotes gravados pela ingestão (`registrar`), gravando os parciais
+    a cada `intervalo` segundos. Falhas de gravação devolvem os parciais para o próximo ciclo.
+
+    `trava_gravacao` é compartilhada com o EscritorLeituras, que a mantém do commit de cada lote até
+    `registrar`: quem a detém sabe que todo lote já gravado em Leitura está nos parciais (ver `pausado`).
+    """
+
+    def __init__(self, intervalo=10, offset_horas=0):
+        self.intervalo = float(intervalo)
+        self.offset_horas = offset_horas
+        self._acumulador = Acumulador(offset_horas)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.trava_gravacao = threading.Lock()
+        self._thread = None
+        self._parar = threading.Event()
+        self.registradas = 0
+        self.ignoradas = 0
+        self.gravadas = 0
+        self.flushes = 0
+        self.falhas = 0
+        self.ultimo_flush_ms = 0.0
+
+    def preparar(self):
+        """Cria as tabelas se preciso. Requer app context. A base do consumo não é carregada aqui: cada lote
+        traz a leitura anterior persistida de seus dispositivos (inclusive o primeiro lote após um restart)."""
+        criar_tabelas()
+        db.session.remove()
+
+    def registrar(self, lote, anteriores=None):
+        """
+        Acumula um lote de linhas de Leitura já gravado (chamado pelo EscritorLeituras após o commit).
+        `anteriores` ({dispositivo_id: (data_hora, total)}, de LeituraAtual antes do lote) substitui a base
+        em memória dos dispositivos do lote; sem linha em LeituraAtual o dispositivo não tem leitura anterior.
+        Leituras não posteriores à base (duplicadas, fora de ordem, já contadas por outra réplica) são ignoradas.
+        """
+        with self._lock:
+            if anteriores is not None:
+                ultimos = self._acumulador.ultimos
+                for d in {linha['dispositivo_id'] for linha in lote}:
+                    base = anteriores.get(d)
+                    if base is None or base[1] is None:
+                        ultimos.pop(d, None)
+                    else:
+                        ultimos[d] = (_utc_naive(base[0]), base[1])
+            # ordem cronológica dentro do lote: leituras de um frame fora de ordem não perdem o período
+            for linha in sorted(lote, key=lambda l: _utc_naive(l['data_hora'])):
+                total = linha.get('total_liters')
+                if total is None:
+                    continue
+                if self._acumulador.adicionar(linha['dispositivo_id'], _utc_naive(linha['data_hora']),
+                                              float(total), float(linha.get('flow_lmin') or 0)):
+                    self.registradas += 1
+                else:
+                    self.ignoradas += 1
+
+    def flush(self):
+        """Grava os parciais acumulados desde o último ciclo."""
+        with self._flush_lock:
+            return self._flush()
+
+    @contextmanager
+    def pausado(self):
+        """
+        Suspende a agregação incremental durante o bloco, para refazer dias a partir de Leitura.
+
+        Espera o lote em gravação chegar a `registrar` (trava_gravacao), grava os parciais pendentes e
+        segura novos lotes e flushes até o fim do bloco. Assim nada do que o bloco lê de Leitura fica em
+        memória para ser somado de novo depois; lotes gravados após o bloco entram por cima do dia refeito.
+        Levanta RuntimeError se os parciais pendentes não puderem ser gravados.
+        """
+        with self.trava_gravacao, self._flush_lock:
+            falhas = self.falhas
+            self._flush()
+            if self.falhas != falhas:
+                raise RuntimeError('agregados pendentes não gravados; recálculo adiado')
+            yield
+
+    def _flush(self):
+        with self._lock:
+            parciais = self._acumulador.extrair()
+        if not any(parciais):
+            return 0
+        inicio = time.perf_counter()
+        n = 0
+        with app.app_context():
+            try:
+                n = _gravar_parciais(parciais)
+                db.session.commit()
+                self.gravadas += n
+            except Exception as e:
+                db.session.rollback()
+                self.falhas += 1
+                with self._lock:
+                    self._acumulador.devolver(parciais)
+                print('[ROLLUP] Falha ao gravar agregados de consumo:', e)
+        self.flushes += 1
+        self.ultimo_flush_ms = (time.perf_counter() - inicio) * 1000.0
+        return n
+
+    def iniciar(self):
+        if self._thread is not None or self.intervalo <= 0:
+            return
+        self._thread = threading.Thread(target=self._loop, name='agregados-consumo', daemon=True)
+        self._thread.start()
+        atexit.register(self.parar)
+
+    def _loop(self):
+        while not self._parar.wait(self.intervalo):
+            self.flush()
+
+    def parar(self):
+        if self._thread is None:
+            return
+        self._parar.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            pendentes = sum(len(p) for p in self._acumulador.parciais)
+        return {
+            'intervalSeconds': self.intervalo,
+            'readings': self.registradas,
+            'ignoredOutOfOrder': self.ignoradas,
+            'pendingRows': pendentes,
+            'rowsWritten': self.gravadas,
+            'flushes': self.flushes,
+            'failures': self.falhas,
+            'lastFlushMs': round(self.ultimo_flush_ms, 3),
+        }
+
+
+def recalcular(inicio, fim, offset_horas=0, dispositivos_por_lote=100, progresso=None, agregador=None):
+    """
+    Refaz os agregados dos dias locais [inicio, fim) a partir de Leitura, um dia por transação.
+
+    Cada dia apaga os agregados do período e lê as leituras em streaming, em grupos de dispositivos
+    (consulta pelo índice único (dispositivo_id, data_hora)); o consumo da primeira leitura usa o
+    último total do dia anterior (agregado ou, se não houver, a última leitura dos 7 dias anteriores).
+    Com `agregador` (o AgregadorConsumo da ingestão neste processo), cada dia é refeito com ele pausado:
+    parciais de lotes atrasados ainda em memória são gravados antes e não somam em dobro depois. Lotes
+    gravados por outro processo não são coordenados: evite rodar sobre o dia corrente com a ingestão ativa.
+    Requer app context. Retorna {'days', 'readings', 'rows'}.
+    """
+    criar_tabelas()
+    offset = timedelta(hours=offset_horas)
+    ids = [d for (d,) in db.session.query(Dispositivo.id_dispositivo).order_by(Dispositivo.id_dispositivo)]
+    acumulador = Acumulador(offset_horas)
+    # base do consumo da primeira leitura: dia anterior já agregado ou, na falta dele, a última leitura anterior
+    base = _ultimos_totais_leituras(datetime.combine(inicio, datetime.min.time()) - offset)
+    base.update(_ultimos_totais(inicio))
+    acumulador.ultimos = {d: (datetime.min, total) for d, total in base.items()}
+    total_col = func.coalesce(Leitura.total_liters, Leitura.consumo_litros)
+    resumo = {'days': 0, 'readings': 0, 'rows': 0}
+    dia = inicio
+    while dia < fim:
+        ini_utc = datetime.combine(dia, datetime.min.time()) - offset
+        fim_utc = ini_utc + timedelta(days=1)
+        with agregador.pausado() if agregador is not None else nullcontext():
+            try:
+                for modelo, a, b in ((ConsumoMinuto, ini_utc, fim_utc), (ConsumoHora, ini_utc, fim_utc),
+                                     (ConsumoDia, dia, dia + timedelta(days=1))):
+                    db.session.query(modelo).filter(modelo.inicio >= a, modelo.inicio < b).delete(synchronize_session=False)
+                for i in range(0, len(ids), dispositivos_por_lote):
+                    q = (db.session.query(Leitura.dispositivo_id, Leitura.data_hora, total_col, Leitura.flow_lmin)
+                         .filter(Leitura.dispositivo_id.in_(ids[i:i + dispositivos_por_lote]),
+                                 Leitura.data_hora >= ini_utc, Leitura.data_hora < fim_utc)
+                         .order_by(Leitura.dispositivo_id, Leitura.data_hora)
+                         .execution_options(yield_per=5000))
+                    for d, dh, total, flow in q:
+                        if total is not None and acumulador.adicionar(d, _utc_naive(dh), float(total), float(flow or 0)):
+                            resumo['readings'] += 1
+                    # resultado consumido antes de escrever (cursores do lado do servidor não permitem intercalar)
+                    resumo['rows'] += _gravar_parciais(acumulador.extrair())
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        resumo['days'] += 1
+        if progresso:
+            progresso(dia, resumo)
+        dia += timedelta(days=1)
+    return resumo
+
+
+def consultar_agregados(dispositivo_id, granularidade, inicio, fim, limite=5000):
+    """Linhas de agregado de um dispositivo em [inicio, fim), em ordem cronológica (datas locais para 'day')."""
+    modelo = GRANULARIDADES[granularidade]
+    return (modelo.query
+            .filter(modelo.dispositivo_id == dispositivo_id, modelo.inicio >= inicio, modelo.inicio < fim)
+            .order_by(modelo.inicio)
+            .limit(limite)
+            .all())
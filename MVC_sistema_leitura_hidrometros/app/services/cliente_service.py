@@ -1,12 +1,20 @@
 from app.models.cliente_model import Cliente, Endereco, Telefone
 from app import db
+from app.services.dispositivo_service import cache_dispositivos, apagar_dados_dispositivos
+from app.services.paginacao_service import paginar
+from sqlalchemy.orm import load_only
 
-def listar_clientes():
+def listar_clientes(cursor=None, limite=None):
     """
-    Lista todos os clientes cadastrados.
+    Lista os clientes cadastrados, uma página por vez (ordem de id; ver paginacao_service).
     """
-    clientes = Cliente.query.all()
-    return clientes
+    return paginar(Cliente.query, [Cliente.id_cliente], cursor, limite)
+
+def listar_clientes_para_selecao():
+    """
+    Todos os clientes, somente id e nome (campos de seleção dos formulários), em ordem alfabética.
+    """
+    return Cliente.query.options(load_only(Cliente.id_cliente, Cliente.nome)).order_by(Cliente.nome).all()
 
 def buscar_cliente_por_id(cliente_id):
     """
@@ -50,15 +58,21 @@ def atualizar_cliente(cliente_id, nome=None, cpf_cnpj=None, email=None):
             return None
     return None
 
-def excluir_cliente(cliente_id):
+def excluir_cliente(cliente_id, motor_regras=None):
     """
     Exclui um cliente e seus dados relacionados (endereços, telefones, dispositivos, consumos).
+    Leituras, agregados e estado de detecção dos dispositivos saem em lote antes, na mesma transação,
+    como em dispositivo_service.excluir_dispositivo (Leitura não é carregada pela cascata do ORM).
     """
     cliente = Cliente.query.get(cliente_id)
     if cliente:
         try:
+            # Seriais removidos em cascata precisam sair do cache de resolução da ingestão
+            seriais = apagar_dados_dispositivos(cliente.dispositivos, motor_regras)
             db.session.delete(cliente)
             db.session.commit()
+            if seriais:
+                cache_dispositivos.invalidar(*seriais)
             return True
         except Exception as e:
             db.session.rollback()
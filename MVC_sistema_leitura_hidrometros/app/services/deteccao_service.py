@@ -0,0 +1,447 @@
+"""
+Motor de regras de anomalia avaliado a cada leitura (streaming).
+
+Cada regra mantém, por serial, um pequeno objeto de estado com __slots__ atualizado de forma
+incremental: avaliar uma leitura é O(1) por regra, sem consultar histórico ou banco.
+Uma regra devolve uma Anomalia quando dispara; o chamador decide como persistir/emitir.
+
+Regras disponíveis (nome usado em DETECTION_RULES -> tipo do Alerta):
+    leak             fluxo >= limiar contínuo por min_segundos
+    night_flow       fluxo contínuo dentro da janela noturna (hora local)
+    burst            fluxo instantâneo acima do limiar de rajada (dispara na subida)
+    zero_flow        medidor sem fluxo e sem avanço do total por min_segundos
+    reverse_counter  total acumulado diminuiu além da tolerância
+
+O estado de todas as regras pode ser exportado/importado em JSON compacto; CheckpointDeteccao
+grava periodicamente os seriais alterados na tabela EstadoDeteccao e restaura tudo no startup.
+"""
+import atexit
+import json
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from app import app, db
+from app.models.alerta_model import EstadoDeteccao
+from app.services.ingestao_service import upsert
+
+Anomalia = namedtuple('Anomalia', ['tipo', 'mensagem', 'threshold', 'flow_lmin', 'total_liters', 'duration_seconds'])
+
+
+class EstadoJanela:
+    """Janela contínua de uma condição (início, última leitura, pico, alerta já enviado)."""
+    __slots__ = ('inicio', 'ultimo', 'pico', 'alertado')
+
+    def __init__(self):
+        self.inicio = None
+        self.ultimo = None
+        self.pico = 0.0
+        self.alertado = False
+
+    def abrir_ou_estender(self, ts, flow):
+        if self.inicio is None:
+            self.inicio = ts
+            self.pico = flow
+            self.alertado = False
+        elif flow > self.pico:
+            self.pico = flow
+        self.ultimo = ts
+        return self.ultimo - self.inicio
+
+    def fechar(self):
+        self.inicio = None
+        self.ultimo = None
+        self.pico = 0.0
+        self.alertado = False
+
+
+class EstadoAnterior:
+    """Referência da leitura anterior (ts e total) e se a condição já estava ativa."""
+    __slots__ = ('ts', 'total', 'ativo')
+
+    def __init__(self):
+        self.ts = None
+        self.total = None
+        self.ativo = False
+
+
+class EstadoSerial:
+    """Estados das regras de um serial (um por regra, na ordem do motor) e ts da última leitura avaliada."""
+    __slots__ = ('ts', 'regras')
+
+    def __init__(self, regras):
+        self.ts = 0
+        self.regras = regras
+
+
+class Regra:
+    """Base: `nome` identifica a regra e o tipo do Alerta; `novo_estado` cria o estado por serial."""
+    nome = ''
+    estado = EstadoJanela
+
+    def novo_estado(self):
+        return self.estado()
+
+    def avaliar(self, st, ts, total, flow, disp=None):
+        """ts em segundos (epoch); disp: DispositivoResolvido (limites próprios) ou None. Retorna Anomalia ou None."""
+        raise NotImplementedError
+
+
+class RegraFluxoContinuo(Regra):
+    """Limiar e duração vêm do dispositivo/tipo (cache da ingestão) quando definidos, senão do config."""
+    nome = 'leak'
+
+    def __init__(self, limiar, min_segundos=0):
+        self.limiar = float(limiar)
+        self.min_segundos = float(min_segundos)
+
+    def avaliar(self, st, ts, total, flow, disp=None):
+        limiar, min_segundos = self.limiar, self.min_segundos
+        if disp is not None:
+            if disp.leak_flow_threshold is not None:
+                limiar = disp.leak_flow_threshold
+            if disp.leak_min_seconds is not None:
+                min_segundos = disp.leak_min_seconds
+        if limiar <= 0:
+            return None
+        if flow < limiar:
+            if st.inicio is not None:
+                st.fechar()
+            return None
+        duracao = st.abrir_ou_estender(ts, flow)
+        if duracao >= min_segundos and not st.alertado:
+            st.alertado = True
+            return Anomalia(self.nome,
+                            f"Vazamento: fluxo >= {limiar:.2f} L/min por {duracao:.1f}s (pico {st.pico:.2f} L/min)",
+                            limiar, flow, total, duracao)
+        return None
+
+
+class RegraFluxoNoturno(Regra):
+    """Fluxo ininterrupto durante a madrugada (quando o consumo legítimo costuma ser zero)."""
+    nome = 'night_flow'
+
+    def __init__(self, limiar, min_segundos=3600, hora_inicio=0, hora_fim=5, offset_horas=-3):
+        self.limiar = float(limiar)
+        self.min_segundos = float(min_segundos)
+        self.hora_inicio = int(hora_inicio) % 24
+        self.hora_fim = int(hora_fim) % 24
+        self.offset = int(float(offset_horas) * 3600)
+
+    def _noturno(self, ts):
+        hora = int((ts + self.offset) // 3600) % 24
+        if self.hora_inicio <= self.hora_fim:
+            return self.hora_inicio <= hora < self.hora_fim
+        return hora >= self.hora_inicio or hora < self.hora_fim
+
+    def avaliar(self, st, ts, total, flow, disp=None):
+        if self.limiar <= 0:
+            return None
+        if flow < self.limiar or not self._noturno(ts):
+            if st.inicio is not None:
+                st.fechar()
+            return None
+        duracao = st.abrir_ou_estender(ts, flow)
+        if duracao >= self.min_segundos and not st.alertado:
+            st.alertado = True
+            return Anomalia(self.nome,
+                            f"Fluxo noturno contínuo >= {self.limiar:.2f} L/min por {duracao / 60:.0f} min (pico {st.pico:.2f} L/min)",
+                            self.limiar, flow, total, duracao)
+        return None
+
+
+class RegraRajada(Regra):
+    """Vazão instantânea acima do limiar (ex: rompimento). Dispara uma vez a cada subida."""
+    nome = 'burst'
+    estado = EstadoAnterior
+
+    def __init__(self, limiar):
+        self.limiar = float(limiar)
+
+    def avaliar(self, st, ts, total, flow, disp=None):
+        if self.limiar <= 0:
+            return None
+        acima = flow >= self.limiar
+        subiu = acima and not st.ativo
+        st.ativo = acima
+        if subiu:
+            return Anomalia(self.nome, f"Rajada: fluxo {flow:.2f} L/min >= {self.limiar:.2f} L/min",
+                            self.limiar, flow, total, 0.0)
+        return None
+
+
+class RegraFluxoZero(Regra):
+    """Medidor que já registrou consumo e está parado (fluxo zero e total sem avanço) há min_segundos."""
+    nome = 'zero_flow'
+    estado = EstadoAnterior
+
+    def __init__(self, min_segundos=86400):
+        self.min_segundos = float(min_segundos)
+
+    def avaliar(self, st, ts, total, flow, disp=None):
+        if self.min_segundos <= 0:
+            return None
+        if flow > 0 or (st.total is not None and total > st.total):
+            # consumo registrado: st.ts guarda o último instante com consumo
+            st.ts = ts
+            st.total = total
+            st.ativo = False
+            return None
+        if st.total is None:
+            st.total = total
+        if st.ts is None:
+            return None  # nunca registrou consumo: medidor inativo, não é anomalia
+        duracao = ts - st.ts
+        if duracao >= self.min_segundos and not st.ativo:
+            st.ativo = True
+            return Anomalia(self.nome, f"Medidor sem fluxo há {duracao / 3600:.1f} h (total parado em {total:.2f} L)",
+                            0.0, flow, total, duracao)
+        return None
+
+
+class RegraContadorReverso(Regra):
+    """Total acumulado menor que o anterior (reset, troca ou violação do medidor)."""
+    nome = 'reverse_counter'
+    estado = EstadoAnterior
+
+    def __init__(self, tolerancia=0.5):
+        self.tolerancia = float(tolerancia)
+
+    def avaliar(self, st, ts, total, flow, disp=None):
+        anterior, st.total = st.total, total
+        if anterior is not None and total < anterior - self.tolerancia:
+            return Anomalia(self.nome, f"Contador regrediu de {anterior:.2f} L para {total:.2f} L",
+                            self.tolerancia, flow, total, 0.0)
+        return None
+
+
+class MotorRegras:
+    """
+    Aplica as regras configuradas a cada leitura, com estado por serial (uma lista de estados,
+    um por regra). Mede tempo de avaliação, avaliações e disparos por regra.
+    """
+
+    def __init__(self, regras):
+        self.regras = list(regras)
+        self._estados = {}
+        self._sujos = set()  # seriais alterados desde o último exportar()
+        self._lock = Lock()
+        self._tempo_ns = [0] * len(self.regras)
+        self._disparos = [0] * len(self.regras)
+        self.avaliacoes = 0
+
+    def avaliar(self, serial, ts_ms, total, flow, dispositivo=None):
+        """Avalia uma leitura; retorna a lista de Anomalias disparadas (normalmente vazia).
+
+        `dispositivo` (DispositivoResolvido já em memória) traz os limites próprios do medidor.
+        """
+        ts = ts_ms / 1000.0
+        disparadas = []
+        with self._lock:
+            est = self._estados.get(serial)
+            if est is None:
+                est = self._estados[serial] = EstadoSerial([r.novo_estado() for r in self.regras])
+            if ts_ms > est.ts:
+                est.ts = ts_ms
+            self._sujos.add(serial)
+            estados = est.regras
+            self.avaliacoes += 1
+            for i, regra in enumerate(self.regras):
+                inicio = time.perf_counter_ns()
+                anomalia = regra.avaliar(estados[i], ts, total, flow, dispositivo)
+                self._tempo_ns[i] += time.perf_counter_ns() - inicio
+                if anomalia is not None:
+                    self._disparos[i] += 1
+                    disparadas.append(anomalia)
+        return disparadas
+
+    def limpar(self, serial=None):
+        with self._lock:
+            if serial is None:
+                self._estados.clear()
+                self._sujos.clear()
+            else:
+                self._estados.pop(serial, None)
+                self._sujos.discard(serial)
+
+    def _serializar(self, est):
+        return json.dumps({r.nome: [getattr(st, slot) for slot in st.__slots__]
+                           for r, st in zip(self.regras, est.regras)}, separators=(',', ':'))
+
+    def _desserializar(self, texto):
+        dados = json.loads(texto)
+        estados = []
+        for regra in self.regras:
+            st = regra.novo_estado()
+            valores = dados.get(regra.nome)
+            if isinstance(valores, list) and len(valores) == len(st.__slots__):
+                for slot, valor in zip(st.__slots__, valores):
+                    setattr(st, slot, valor)
+            estados.append(st)
+        return estados
+
+    def exportar(self, tudo=False):
+        """Lista (serial, ultimo_ts, estado_json) dos seriais alterados desde a última exportação (ou todos)."""
+        with self._lock:
+            seriais = list(self._estados) if tudo else list(self._sujos)
+            self._sujos.clear()
+            return [(s, self._estados[s].ts, self._serializar(self._estados[s]))
+                    for s in seriais if s in self._estados]
+
+    def marcar_alterados(self, seriais):
+        with self._lock:
+            self._sujos.update(s for s in seriais if s in self._estados)
+
+    def importar(self, linhas):
+        """
+        Adota estados externos (checkpoint ou outro processo) quando mais recentes que o local.
+        linhas: iterável de (serial, ultimo_ts, estado_json). Retorna quantos seriais foram adotados.
+        """
+        adotados = 0
+        with self._lock:
+            for serial, ultimo_ts, texto in linhas:
+                local = self._estados.get(serial)
+                if local is not None and local.ts >= ultimo_ts:
+                    continue
+                try:
+                    est = EstadoSerial(self._desserializar(texto))
+                except (ValueError, TypeError):
+                    continue
+                est.ts = ultimo_ts
+                self._estados[serial] = est
+                self._sujos.discard(serial)
+                adotados += 1
+        return adotados
+
+    def stats(self):
+        with self._lock:
+            n = self.avaliacoes
+            return {
+                'evaluations': n,
+                'serials': len(self._estados),
+                'rules': {
+                    r.nome: {
+                        'fired': self._disparos[i],
+                        'totalMs': round(self._tempo_ns[i] / 1e6, 3),
+                        'avgUs': round(self._tempo_ns[i] / n / 1000.0, 3) if n else 0,
+                    }
+                    for i, r in enumerate(self.regras)
+                },
+            }
+
+
+def criar_regras(config):
+    """Instancia as regras listadas em DETECTION_RULES (separadas por vírgula) com os parâmetros do Config."""
+    fabricas = {
+        'leak': lambda: RegraFluxoContinuo(config.get('LEAK_FLOW_THRESHOLD', 0.2), config.get('LEAK_MIN_SECONDS', 0)),
+        'night_flow': lambda: RegraFluxoNoturno(
+            config.get('NIGHT_FLOW_THRESHOLD', 0.1), config.get('NIGHT_FLOW_MIN_SECONDS', 3600),
+            config.get('NIGHT_START_HOUR', 0), config.get('NIGHT_END_HOUR', 5),
+            config.get('DETECTION_TZ_OFFSET_HOURS', -3)),
+        'burst': lambda: RegraRajada(config.get('BURST_FLOW_THRESHOLD', 30.0)),
+        'zero_flow': lambda: RegraFluxoZero(config.get('ZERO_FLOW_MIN_SECONDS', 86400)),
+        'reverse_counter': lambda: RegraContadorReverso(config.get('REVERSE_COUNTER_TOLERANCE', 0.5)),
+    }
+    regras = []
+    for nome in str(config.get('DETECTION_RULES', 'leak')).split(','):
+        nome = nome.strip()
+        if not nome:
+            continue
+        if nome not in fabricas:
+            print(f'[DETECCAO] Regra desconhecida ignorada: {nome}')
+            continue
+        regras.append(fabricas[nome]())
+    return regras
+
+
+class CheckpointDeteccao:
+    """
+    Grava a cada `intervalo` segundos, com um upsert em lote, o estado dos seriais alterados
+    (tabela EstadoDeteccao) e restaura todos os estados em uma consulta no startup.
+
+    Com `compartilhado`, cada checkpoint também lê os estados gravados por outros processos desde
+    o anterior e adota os mais recentes (sem ida ao banco por leitura; defasagem de até um intervalo).
+    """
+
+    def __init__(self, motor, intervalo=30, compartilhado=False):
+        self.motor = motor
+        self.intervalo = float(intervalo)
+        self.compartilhado = bool(compartilhado)
+        self._thread = None
+        self._parar = threading.Event()
+        self._ultima_leitura = None
+        self.gravados = 0
+        self.adotados = 0
+        self.checkpoints = 0
+        self.falhas = 0
+        self.ultimo_checkpoint_ms = 0.0
+
+    def restaurar(self):
+        """Carrega todos os estados salvos (uma consulta). Requer app context."""
+        EstadoDeteccao.__table__.create(db.engine, checkfirst=True)
+        self._ultima_leitura = datetime.now(timezone.utc)
+        linhas = db.session.query(EstadoDeteccao.serial, EstadoDeteccao.ultimo_ts, EstadoDeteccao.estado).all()
+        n = self.motor.importar(linhas)
+        db.session.remove()
+        return n
+
+    def checkpoint(self):
+        """Grava os seriais alterados e, se compartilhado, adota estados mais novos de outros processos."""
+        inicio = time.perf_counter()
+        linhas = self.motor.exportar()
+        agora = datetime.now(timezone.utc)
+        with app.app_context():
+            try:
+                if linhas:
+                    db.session.execute(upsert(EstadoDeteccao.__table__, ['serial'], ['estado', 'ultimo_ts', 'atualizado_em']),
+                                       [{'serial': s, 'ultimo_ts': ts, 'estado': e, 'atualizado_em': agora}
+                                        for s, ts, e in linhas])
+                    db.session.commit()
+                    self.gravados += len(linhas)
+                if self.compartilhado:
+                    # margem de um intervalo para relógios/commits concorrentes; importar() ignora o que não é mais novo
+                    desde = (self._ultima_leitura or agora) - timedelta(seconds=self.intervalo)
+                    self._ultima_leitura = agora
+                    novos = (db.session.query(EstadoDeteccao.serial, EstadoDeteccao.ultimo_ts, EstadoDeteccao.estado)
+                             .filter(EstadoDeteccao.atualizado_em >= desde).all())
+                    self.adotados += self.motor.importar(novos)
+            except Exception as e:
+                db.session.rollback()
+                self.falhas += 1
+                # devolve os seriais para o próximo checkpoint
+                self.motor.marcar_alterados(s for s, _, _ in linhas)
+                print('[DETECCAO] Falha no checkpoint de estado:', e)
+        self.checkpoints += 1
+        self.ultimo_checkpoint_ms = (time.perf_counter() - inicio) * 1000.0
+
+    def iniciar(self):
+        if self._thread is not None or self.intervalo <= 0:
+            return
+        self._thread = threading.Thread(target=self._loop, name='deteccao-checkpoint', daemon=True)
+        self._thread.start()
+        atexit.register(self.parar)
+
+    def _loop(self):
+        while not self._parar.wait(self.intervalo):
+            self.checkpoint()
+
+    def parar(self):
+        """Checkpoint final ao encerrar o processo."""
+        if self._thread is None:
+            return
+        self._parar.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+        self.checkpoint()
+
+    def stats(self):
+        return {
+            'intervalSeconds': self.intervalo,
+            'shared': self.compartilhado,
+            'checkpoints': self.checkpoints,
+            'written': self.gravados,
+            'adopted': self.adotados,
+            'failures': self.falhas,
+            'lastCheckpointMs': round(self.ultimo_checkpoint_ms, 3),
+        }
@@ -1,14 +1,154 @@
-from app.models.dispositivo_model import Dispositivo, TipoDispositivo, Leitura, HistoricoStatusDispositivo
+from app.models.dispositivo_model import Dispositivo, TipoDispositivo, Leitura, LeituraAtual, HistoricoStatusDispositivo
 from app.models.cliente_model import Cliente # Para buscar clientes associados
-from app import db
-from datetime import datetime
+from app.models.agregado_model import ConsumoMinuto, ConsumoHora, ConsumoDia
+from app.models.alerta_model import Alerta, EstadoDeteccao
+from app import app, db
+from datetime import datetime, timezone
+from array import array
+from collections import OrderedDict, namedtuple
+from threading import Lock
+import time
+from sqlalchemy import func, inspect
+from sqlalchemy.orm import joinedload
+from app.services.historico_service import reduzir_serie
+from app.services.ingestao_service import atualizar_leituras_atuais
+from app.services.paginacao_service import paginar
 
-def listar_dispositivos():
+# Resultado da resolução numero_serie -> dispositivo (somente colunas usadas na ingestão).
+# leak_*: limites efetivos de vazamento (do dispositivo, senão do tipo; None = limite global do config)
+DispositivoResolvido = namedtuple('DispositivoResolvido', ['id_dispositivo', 'cliente_id', 'status',
+                                                           'leak_flow_threshold', 'leak_min_seconds'])
+
+
+def _consulta_resolucao():
+    """numero_serie + colunas de DispositivoResolvido, com os limites já combinados dispositivo/tipo."""
+    return (db.session.query(
+                Dispositivo.numero_serie, Dispositivo.id_dispositivo, Dispositivo.cliente_id, Dispositivo.status,
+                func.coalesce(Dispositivo.leak_flow_threshold, TipoDispositivo.leak_flow_threshold),
+                func.coalesce(Dispositivo.leak_min_seconds, TipoDispositivo.leak_min_seconds))
+            .outerjoin(TipoDispositivo, TipoDispositivo.id_tipo_dispositivo == Dispositivo.tipo_dispositivo_id))
+
+
+class CacheDispositivos:
     """
-    Lista todos os dispositivos cadastrados.
+    Cache em memória (LRU limitado) de numero_serie -> DispositivoResolvido.
+
+    Evita consultar o banco a cada leitura recebida. Seriais desconhecidos também são
+    cacheados (negativo) por `ttl_negativo` segundos, para que dispositivos não cadastrados
+    publicando no broker não gerem uma consulta por mensagem. Entradas positivas expiram
+    após `ttl` segundos (cobre alterações feitas por outros processos).
     """
-    dispositivos = Dispositivo.query.all()
-    return dispositivos
+
+    def __init__(self, max_itens=10000, ttl=300, ttl_negativo=30):
+        self.max_itens = max(1, int(max_itens))
+        self.ttl = float(ttl)
+        self.ttl_negativo = float(ttl_negativo)
+        self._itens = OrderedDict()  # serial -> (DispositivoResolvido|None, expira_em)
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.hits_negativos = 0
+
+    @staticmethod
+    def _chave(numero_serie):
+        return str(numero_serie).strip().upper() if numero_serie else None
+
+    def _guardar(self, chave, valor, agora):
+        ttl = self.ttl if valor is not None else self.ttl_negativo
+        self._itens[chave] = (valor, agora + ttl)
+        self._itens.move_to_end(chave)
+        while len(self._itens) > self.max_itens:
+            self._itens.popitem(last=False)
+
+    def resolver(self, numero_serie):
+        """Retorna DispositivoResolvido ou None (serial desconhecido). Requer app context em caso de miss."""
+        chave = self._chave(numero_serie)
+        if not chave:
+            return None
+        agora = time.monotonic()
+        with self._lock:
+            item = self._itens.get(chave)
+            if item and item[1] > agora:
+                self._itens.move_to_end(chave)
+                if item[0] is None:
+                    self.hits_negativos += 1
+                else:
+                    self.hits += 1
+                return item[0]
+            self.misses += 1
+        linha = _consulta_resolucao().filter(Dispositivo.numero_serie == chave).first()
+        valor = DispositivoResolvido(*linha[1:]) if linha else None
+        with self._lock:
+            self._guardar(chave, valor, time.monotonic())
+        return valor
+
+    def aquecer(self):
+        """Carrega em uma única consulta até `max_itens` dispositivos. Requer app context."""
+        linhas = _consulta_resolucao().limit(self.max_itens).all()
+        agora = time.monotonic()
+        with self._lock:
+            for linha in linhas:
+                chave = self._chave(linha[0])
+                if chave:
+                    self._guardar(chave, DispositivoResolvido(*linha[1:]), agora)
+        return len(linhas)
+
+    def recarregar(self, *numeros_serie):
+        """
+        Relê do banco (uma consulta) os seriais informados e substitui as entradas, para que
+        alterações (ex: limites de vazamento) valham sem uma consulta no caminho da ingestão.
+        Seriais inexistentes viram entrada negativa. Requer app context.
+        """
+        chaves = {self._chave(s) for s in numeros_serie} - {None}
+        if not chaves:
+            return 0
+        lista = sorted(chaves)
+        encontrados = {}
+        for i in range(0, len(lista), 500):
+            for linha in _consulta_resolucao().filter(Dispositivo.numero_serie.in_(lista[i:i + 500])):
+                encontrados[self._chave(linha[0])] = DispositivoResolvido(*linha[1:])
+        agora = time.monotonic()
+        with self._lock:
+            for chave in chaves:
+                self._itens.pop(chave, None)
+                self._guardar(chave, encontrados.get(chave), agora)
+        return len(encontrados)
+
+    def invalidar(self, *numeros_serie):
+        """Remove os seriais informados do cache (todos, se nenhum for informado)."""
+        with self._lock:
+            if not numeros_serie:
+                self._itens.clear()
+                return
+            for serial in numeros_serie:
+                chave = self._chave(serial)
+                if chave:
+                    self._itens.pop(chave, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._itens),
+                'maxSize': self.max_itens,
+                'hits': self.hits,
+                'negativeHits': self.hits_negativos,
+                'misses': self.misses,
+            }
+
+
+cache_dispositivos = CacheDispositivos(
+    max_itens=app.config.get('DEVICE_CACHE_SIZE', 10000),
+    ttl=app.config.get('DEVICE_CACHE_TTL', 300),
+    ttl_negativo=app.config.get('DEVICE_CACHE_NEGATIVE_TTL', 30),
+)
+
+def listar_dispositivos(cursor=None, limite=None):
+    """
+    Lista os dispositivos cadastrados, uma página por vez (ordem de id; ver paginacao_service).
+    Cliente e tipo vêm na mesma consulta (LEFT JOIN): a página custa uma consulta, não 1 + 2N.
+    """
+    consulta = Dispositivo.query.options(joinedload(Dispositivo.cliente), joinedload(Dispositivo.tipo_dispositivo))
+    return paginar(consulta, [Dispositivo.id_dispositivo], cursor, limite)
 
 def buscar_dispositivo_por_id(dispositivo_id):
     """
@@ -17,9 +157,11 @@ def buscar_dispositivo_por_id(dispositivo_id):
     dispositivo = Dispositivo.query.get(dispositivo_id)
     return dispositivo
 
-def inserir_dispositivo(modelo, numero_serie, cliente_id, tipo_dispositivo_id=None, data_instalacao=None, status='Ativo'):
+def inserir_dispositivo(modelo, numero_serie, cliente_id, tipo_dispositivo_id=None, data_instalacao=None, status='Ativo',
+                        leak_flow_threshold=None, leak_min_seconds=None):
     """
     Insere um novo dispositivo no banco de dados.
+    Limites de vazamento nulos herdam os do tipo de dispositivo.
     """
     try:
         new_dispositivo = Dispositivo(
@@ -28,10 +170,14 @@ def inserir_dispositivo(modelo, numero_serie, cliente_id, tipo_dispositivo_id=No
             cliente_id=cliente_id,
             tipo_dispositivo_id=tipo_dispositivo_id,
             data_instalacao=data_instalacao,
-            status=status
+            status=status,
+            leak_flow_threshold=leak_flow_threshold,
+            leak_min_seconds=leak_min_seconds
         )
         db.session.add(new_dispositivo)
         db.session.commit()
+        # Substitui eventual entrada negativa (serial publicado antes do cadastro)
+        cache_dispositivos.recarregar(numero_serie)
         return new_dispositivo
     except Exception as e:
         db.session.rollback()
@@ -44,6 +190,7 @@ def atualizar_dispositivo(dispositivo_id, modelo=None, numero_serie=None, client
     """
     dispositivo = Dispositivo.query.get(dispositivo_id)
     if dispositivo:
+        serial_anterior = dispositivo.numero_serie
         # Registra o histórico de status se houver mudança
         if status and dispositivo.status != status:
             historico_status = HistoricoStatusDispositivo(
@@ -69,6 +216,8 @@ def atualizar_dispositivo(dispositivo_id, modelo=None, numero_serie=None, client
 
         try:
             db.session.commit()
+            cache_dispositivos.invalidar(serial_anterior)
+            cache_dispositivos.recarregar(dispositivo.numero_serie)
             return dispositivo
         except Exception as e:
             db.session.rollback()
@@ -76,15 +225,40 @@ def atualizar_dispositivo(dispositivo_id, modelo=None, numero_serie=None, client
             return None
     return None
 
-def excluir_dispositivo(dispositivo_id):
+def apagar_dados_dispositivos(dispositivos, motor_regras=None):
+    """
+    Apaga (sem commit) leituras, última leitura, agregados e estado de detecção dos dispositivos e
+    desvincula seus alertas, com DELETE em lote por dispositivo_id (usa o índice (dispositivo_id, data_hora)
+    e, com Leitura particionada, cada partição), sem carregá-los na sessão. Os seriais saem antes de
+    `motor_regras`, para que o próximo checkpoint não regrave o estado. Retorna os seriais (para o cache).
+    """
+    ids = [d.id_dispositivo for d in dispositivos]
+    seriais = [d.numero_serie for d in dispositivos]
+    if not ids:
+        return seriais
+    if motor_regras is not None:
+        for serial in seriais:
+            motor_regras.limpar(serial)
+    for modelo in (Leitura, LeituraAtual, ConsumoMinuto, ConsumoHora, ConsumoDia):
+        db.session.execute(modelo.__table__.delete().where(modelo.dispositivo_id.in_(ids)))
+    if inspect(db.engine).has_table(EstadoDeteccao.__tablename__):
+        db.session.execute(EstadoDeteccao.__table__.delete().where(EstadoDeteccao.serial.in_(seriais)))
+    db.session.execute(Alerta.__table__.update().where(Alerta.dispositivo_id.in_(ids)).values(dispositivo_id=None))
+    return seriais
+
+def excluir_dispositivo(dispositivo_id, motor_regras=None):
     """
-    Exclui um dispositivo e suas leituras e histórico de status relacionados.
+    Exclui um dispositivo e suas leituras, agregados e histórico de status relacionados.
+    Os dados de séries temporais saem em lote (ver apagar_dados_dispositivos), na mesma transação;
+    alertas do dispositivo são mantidos, desvinculados (continuam identificados pelo serial).
     """
     dispositivo = Dispositivo.query.get(dispositivo_id)
     if dispositivo:
         try:
+            seriais = apagar_dados_dispositivos([dispositivo], motor_regras)
             db.session.delete(dispositivo)
             db.session.commit()
+            cache_dispositivos.invalidar(*seriais)
             return True
         except Exception as e:
             db.session.rollback()
@@ -92,12 +266,32 @@ def excluir_dispositivo(dispositivo_id):
             return False
     return False
 
-def adicionar_tipo_dispositivo(nome_tipo, descricao=None):
+def atualizar_limites_dispositivo(dispositivo_id, leak_flow_threshold=None, leak_min_seconds=None):
+    """
+    Define (ou remove, com None) os limites de vazamento próprios de um dispositivo.
+    O cache da ingestão é recarregado em seguida: a detecção não consulta o banco por limites.
+    """
+    dispositivo = Dispositivo.query.get(dispositivo_id)
+    if not dispositivo:
+        return None
+    dispositivo.leak_flow_threshold = leak_flow_threshold
+    dispositivo.leak_min_seconds = leak_min_seconds
+    try:
+        db.session.commit()
+        cache_dispositivos.recarregar(dispositivo.numero_serie)
+        return dispositivo
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro ao atualizar limites do dispositivo: {e}")
+        return None
+
+def adicionar_tipo_dispositivo(nome_tipo, descricao=None, leak_flow_threshold=None, leak_min_seconds=None):
     """
     Adiciona um novo tipo de dispositivo.
     """
     try:
-        new_tipo = TipoDispositivo(nome_tipo=nome_tipo, descricao=descricao)
+        new_tipo = TipoDispositivo(nome_tipo=nome_tipo, descricao=descricao,
+                                   leak_flow_threshold=leak_flow_threshold, leak_min_seconds=leak_min_seconds)
         db.session.add(new_tipo)
         db.session.commit()
         return new_tipo
@@ -106,6 +300,37 @@ def adicionar_tipo_dispositivo(nome_tipo, descricao=None):
         print(f"Erro ao adicionar tipo de dispositivo: {e}")
         return None
 
+def buscar_tipo_dispositivo_por_id(tipo_id):
+    """
+    Busca um tipo de dispositivo pelo seu ID.
+    """
+    return TipoDispositivo.query.get(tipo_id)
+
+def atualizar_tipo_dispositivo(tipo_id, nome_tipo=None, descricao=None, leak_flow_threshold=None, leak_min_seconds=None):
+    """
+    Atualiza um tipo de dispositivo. Os limites de vazamento são sempre gravados (None = limite global)
+    e os dispositivos do tipo têm a entrada do cache da ingestão recarregada.
+    """
+    tipo = TipoDispositivo.query.get(tipo_id)
+    if not tipo:
+        return None
+    if nome_tipo:
+        tipo.nome_tipo = nome_tipo
+    if descricao is not None:
+        tipo.descricao = descricao
+    tipo.leak_flow_threshold = leak_flow_threshold
+    tipo.leak_min_seconds = leak_min_seconds
+    try:
+        db.session.commit()
+        seriais = [s for (s,) in db.session.query(Dispositivo.numero_serie)
+                   .filter(Dispositivo.tipo_dispositivo_id == tipo_id).all()]
+        cache_dispositivos.recarregar(*seriais)
+        return tipo
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro ao atualizar tipo de dispositivo: {e}")
+        return None
+
 def listar_tipos_dispositivo():
     """
     Lista todos os tipos de dispositivo.
@@ -116,19 +341,24 @@ def listar_tipos_dispositivo():
 def registrar_leitura(dispositivo_id, consumo_litros, bateria=None, pressao_bar=None, vazamento_detectado=False):
     """
     Registra uma nova leitura para um dispositivo.
+    Como na ingestão MQTT, data_hora é UTC (naive) e o valor lido é o total acumulado do medidor
+    (consumo_litros = total_liters), para que LeituraAtual e os agregados continuem com a mesma base.
     """
     dispositivo = Dispositivo.query.get(dispositivo_id)
     if dispositivo:
         try:
             new_leitura = Leitura(
                 dispositivo_id=dispositivo_id,
-                data_hora=datetime.now(),
+                data_hora=datetime.now(timezone.utc).replace(tzinfo=None),
                 consumo_litros=consumo_litros,
+                total_liters=consumo_litros,
                 bateria=bateria,
                 pressao_bar=pressao_bar,
                 vazamento_detectado=vazamento_detectado
             )
             db.session.add(new_leitura)
+            atualizar_leituras_atuais([{'dispositivo_id': dispositivo_id, 'data_hora': new_leitura.data_hora,
+                                        'consumo_litros': consumo_litros, 'total_liters': consumo_litros}])
             db.session.commit()
             return new_leitura
         except Exception as e:
@@ -137,10 +367,127 @@ def registrar_leitura(dispositivo_id, consumo_litros, bateria=None, pressao_bar=
             return None
     return None
 
-def listar_leituras_por_dispositivo(dispositivo_id):
+def listar_leituras_por_dispositivo(dispositivo_id, cursor=None, limite=None):
+    """
+    Lista as leituras de um dispositivo, da mais recente para a mais antiga, uma página por vez.
+    data_hora é única por dispositivo: a página é uma faixa de uq_leitura_dispositivo_data_hora.
+    """
+    return paginar(Leitura.query.filter_by(dispositivo_id=dispositivo_id), [Leitura.data_hora],
+                   cursor, limite, decrescente=True)
+
+# Limite de dispositivos por página na consulta de leituras atuais da frota
+LIMITE_PAGINA_ATUAIS = 1000
+
+def _consulta_atuais():
+    """Dispositivos com a última leitura (LEFT JOIN em LeituraAtual: uma linha por dispositivo)."""
+    return (db.session.query(Dispositivo.id_dispositivo, Dispositivo.numero_serie, Dispositivo.modelo,
+                             Dispositivo.status, Dispositivo.cliente_id, LeituraAtual)
+            .outerjoin(LeituraAtual, LeituraAtual.dispositivo_id == Dispositivo.id_dispositivo))
+
+def _leitura_atual_dict(linha):
+    return {
+        'dispositivo_id': linha.id_dispositivo,
+        'numero_serie': linha.numero_serie,
+        'modelo': linha.modelo,
+        'status': linha.status,
+        'cliente_id': linha.cliente_id,
+        'ultima_leitura': linha.LeituraAtual.to_dict() if linha.LeituraAtual else None,
+    }
+
+def leituras_atuais_por_cliente(cliente_id):
+    """Última leitura de cada dispositivo do cliente, numa única consulta."""
+    linhas = _consulta_atuais().filter(Dispositivo.cliente_id == cliente_id).order_by(Dispositivo.id_dispositivo)
+    return [_leitura_atual_dict(l) for l in linhas]
+
+def leituras_atuais_por_seriais(seriais):
+    """Última leitura dos dispositivos com os números de série informados (desconhecidos são omitidos)."""
+    seriais = sorted({str(s).strip().upper() for s in seriais if str(s).strip()})
+    if not seriais:
+        return []
+    linhas = _consulta_atuais().filter(Dispositivo.numero_serie.in_(seriais)).order_by(Dispositivo.id_dispositivo)
+    return [_leitura_atual_dict(l) for l in linhas]
+
+def leituras_atuais_frota(apos_id=None, limite=500):
+    """
+    Página de leituras atuais de toda a frota, por id de dispositivo crescente (paginação por chave:
+    `apos_id` = último id da página anterior). `limite` já validado pelo chamador (1 a LIMITE_PAGINA_ATUAIS).
+    Retorna (itens, próximo apos_id ou None).
+    """
+    consulta = _consulta_atuais()
+    if apos_id is not None:
+        consulta = consulta.filter(Dispositivo.id_dispositivo > apos_id)
+    linhas = consulta.order_by(Dispositivo.id_dispositivo).limit(limite + 1).all()
+    proximo = linhas[limite - 1].id_dispositivo if len(linhas) > limite else None
+    return [_leitura_atual_dict(l) for l in linhas[:limite]], proximo
+
+def garantir_leituras_atuais():
+    """Cria LeituraAtual em bancos existentes e a preenche a partir de Leitura. Retorna as linhas carregadas (ou None)."""
+    if inspect(db.engine).has_table(LeituraAtual.__tablename__):
+        return None
+    LeituraAtual.__table__.create(db.engine)
+    return recalcular_leituras_atuais()
+
+def recalcular_leituras_atuais():
+    """Reconstrói LeituraAtual a partir de Leitura (carga inicial / correção). Retorna as linhas gravadas."""
+    ult = (db.session.query(Leitura.dispositivo_id, func.max(Leitura.data_hora).label('data_hora'))
+           .group_by(Leitura.dispositivo_id).subquery())
+    linhas = (db.session.query(Leitura.dispositivo_id, Leitura.data_hora, Leitura.consumo_litros,
+                               Leitura.total_liters, Leitura.flow_lmin)
+              .join(ult, (Leitura.dispositivo_id == ult.c.dispositivo_id) & (Leitura.data_hora == ult.c.data_hora))
+              .all())
+    try:
+        db.session.execute(LeituraAtual.__table__.delete())
+        atualizar_leituras_atuais([l._asdict() for l in linhas])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(linhas)
+
+
+def ts_ms(dt):
+    """data_hora de Leitura -> epoch ms (gravado em UTC; colunas sem timezone voltam "naive")."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return round(dt.timestamp() * 1000)
+
+
+def serie_leituras_intervalo(dispositivo_id, inicio, fim, pontos, metodo='minmax'):
     """
-    Lista todas as leituras para um dispositivo específico.
+    Série de leituras de um dispositivo em [inicio, fim) reduzida para ~`pontos` pontos.
+
+    - minmax: agregação no banco (ntile sobre data_hora + GROUP BY), um ponto por bucket com
+      vazão média/mín/máx e total no fim do bucket; só `pontos` linhas trafegam do banco.
+    - lttb: lê somente as colunas usadas (yield_per) para arrays tipados e aplica LTTB.
     """
-    leituras = Leitura.query.filter_by(dispositivo_id=dispositivo_id).order_by(Leitura.data_hora.desc()).all()
-    return leituras
+    filtro = (Leitura.dispositivo_id == dispositivo_id, Leitura.data_hora >= inicio, Leitura.data_hora < fim)
+    total_col = func.coalesce(Leitura.total_liters, Leitura.consumo_litros, 0)
+    flow_col = func.coalesce(Leitura.flow_lmin, 0)
+    if metodo == 'lttb':
+        q = (db.session.query(Leitura.data_hora, total_col, flow_col)
+             .filter(*filtro).order_by(Leitura.data_hora)
+             .execution_options(yield_per=5000))
+        ts, total, flow = array('q'), array('d'), array('d')
+        for data_hora, tot, fl in q:
+            ts.append(ts_ms(data_hora))
+            total.append(float(tot))
+            flow.append(float(fl))
+        return reduzir_serie(ts, total, flow, pontos, 'lttb')
 
+    sub = (db.session.query(
+               Leitura.data_hora.label('data_hora'),
+               total_col.label('total'),
+               flow_col.label('flow'),
+               func.ntile(max(1, pontos)).over(order_by=Leitura.data_hora).label('bucket'))
+           .filter(*filtro).subquery())
+    rows = (db.session.query(func.min(sub.c.data_hora), func.max(sub.c.total), func.avg(sub.c.flow),
+                             func.min(sub.c.flow), func.max(sub.c.flow), func.count())
+            .group_by(sub.c.bucket).order_by(sub.c.bucket).all())
+    return [{
+        'ts': ts_ms(dh if isinstance(dh, datetime) else datetime.fromisoformat(str(dh))),
+        'totalLiters': float(tot),
+        'flowLmin': round(float(media), 3),
+        'flowMin': float(fmin),
+        'flowMax': float(fmax),
+        'count': n,
+    } for dh, tot, media, fmin, fmax, n in rows]
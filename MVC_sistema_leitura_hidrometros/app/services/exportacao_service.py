@@ -0,0 +1,108 @@
+"""
+Exportação de leituras (CSV ou NDJSON) de um dispositivo, de um cliente ou da frota num intervalo de tempo.
+
+Tudo é gerado em streaming: os dispositivos são percorridos em grupos e cada grupo é lido com
+`yield_per` (cursor no servidor no PostgreSQL/MySQL) pelo índice (dispositivo_id, data_hora); as linhas
+viram texto em blocos e, opcionalmente, passam por um compressor gzip incremental. A memória usada
+não depende do número de linhas exportadas.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timedelta, timezone
+from app import db
+from app.models.dispositivo_model import Dispositivo, Leitura
+
+FORMATOS = ('csv', 'ndjson')
+COLUNAS = ['numero_serie', 'dispositivo_id', 'ts', 'data_hora', 'consumo_litros', 'total_liters', 'flow_lmin',
+           'bateria', 'pressao_bar', 'vazamento_detectado']
+_NUMERICAS = ('consumo_litros', 'total_liters', 'flow_lmin', 'bateria', 'pressao_bar')
+_EPOCH = datetime(1970, 1, 1)
+_MS = timedelta(milliseconds=1)
+
+
+def dispositivos_do_escopo(dispositivo_id=None, cliente_id=None):
+    """[(id, numero_serie)] a exportar: um dispositivo, os de um cliente ou toda a frota (ordem de id)."""
+    q = db.session.query(Dispositivo.id_dispositivo, Dispositivo.numero_serie)
+    if dispositivo_id is not None:
+        q = q.filter(Dispositivo.id_dispositivo == dispositivo_id)
+    elif cliente_id is not None:
+        q = q.filter(Dispositivo.cliente_id == cliente_id)
+    return q.order_by(Dispositivo.id_dispositivo).all()
+
+
+def linhas_exportacao(dispositivos, inicio, fim, dispositivos_por_consulta=50, yield_per=5000):
+    """
+    Tuplas na ordem de COLUNAS para as leituras em [inicio, fim) (UTC sem tzinfo), por dispositivo e tempo.
+    Uma consulta por grupo de dispositivos, consumida em streaming.
+    """
+    for i in range(0, len(dispositivos), dispositivos_por_consulta):
+        grupo = dispositivos[i:i + dispositivos_por_consulta]
+        seriais = dict(grupo)
+        res = db.session.execute(
+            db.select(Leitura.dispositivo_id, Leitura.data_hora, Leitura.consumo_litros, Leitura.total_liters,
+                      Leitura.flow_lmin, Leitura.bateria, Leitura.pressao_bar, Leitura.vazamento_detectado)
+            .where(Leitura.dispositivo_id.in_(list(seriais)), Leitura.data_hora >= inicio, Leitura.data_hora < fim)
+            .order_by(Leitura.dispositivo_id, Leitura.data_hora)
+            .execution_options(yield_per=yield_per))
+        for disp, dh, consumo, total, flow, bateria, pressao, vazamento in res:
+            if dh.tzinfo is not None:
+                dh = dh.astimezone(timezone.utc).replace(tzinfo=None)
+            yield (seriais[disp], disp, (dh - _EPOCH) // _MS, dh.isoformat() + 'Z', consumo, total, flow,
+                   bateria, pressao, bool(vazamento))
+
+
+def _numero(valor):
+    return float(valor) if valor is not None else None
+
+
+def gerar_csv(linhas, bloco=1000):
+    """Blocos de texto CSV (cabeçalho + linhas), cada um com até `bloco` linhas."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, lineterminator='\n')
+    escritor.writerow(COLUNAS)
+    n = 0
+    for linha in linhas:
+        escritor.writerow(linha)
+        n += 1
+        if n % bloco == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def gerar_ndjson(linhas, bloco=1000):
+    """Blocos de texto NDJSON (um objeto por linha, números como float)."""
+    indices = [COLUNAS.index(c) for c in _NUMERICAS]
+    partes = []
+    for linha in linhas:
+        valores = list(linha)
+        for k in indices:
+            valores[k] = _numero(valores[k])
+        partes.append(json.dumps(dict(zip(COLUNAS, valores)), separators=(',', ':')))
+        if len(partes) >= bloco:
+            yield '\n'.join(partes) + '\n'
+            partes = []
+    if partes:
+        yield '\n'.join(partes) + '\n'
+
+
+def comprimir_gzip(blocos):
+    """Comprime em gzip, de forma incremental, uma sequência de blocos de texto (gera bytes)."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = cabeçalho/rodapé gzip
+    for bloco in blocos:
+        dados = compressor.compress(bloco.encode('utf-8'))
+        if dados:
+            yield dados
+    yield compressor.flush()
+
+
+def exportar(formato, inicio, fim, dispositivo_id=None, cliente_id=None, gzip=False):
+    """Gerador de blocos (str, ou bytes com gzip) da exportação. Requer app context durante a iteração."""
+    if formato not in FORMATOS:
+        raise ValueError(f'formato deve ser um de {", ".join(FORMATOS)}')
+    linhas = linhas_exportacao(dispositivos_do_escopo(dispositivo_id, cliente_id), inicio, fim)
+    blocos = gerar_csv(linhas) if formato == 'csv' else gerar_ndjson(linhas)
+    return comprimir_gzip(blocos) if gzip else blocos
@@ -1,15 +1,23 @@
-from app.models.faturamento_model import Tarifa, ConsumoMensal
+from app.models.faturamento_model import Tarifa, FaixaTarifa, ConsumoMensal
 from app.models.cliente_model import Cliente # Para relacionamentos e busca de clientes
+from app.models.dispositivo_model import Dispositivo
+from app.models.agregado_model import ConsumoDia
+from app.services.agregacao_service import recalcular
+from app.services.ingestao_service import upsert
+from app.services.tarifa_service import IndiceTarifas, TabelaPrecos, precificar_lote, CENTAVOS
+from app.services.paginacao_service import paginar
 from app import db
-from datetime import datetime
-from sqlalchemy import func
-from decimal import Decimal # Importar o tipo Decimal
+from datetime import datetime, timedelta, timezone
+import time
+from sqlalchemy import func, and_
+from sqlalchemy.orm import selectinload, joinedload
+from decimal import Decimal, ROUND_HALF_UP # Importar o tipo Decimal
 
 def listar_tarifas():
     """
     Lista todas as tarifas cadastradas.
     """
-    tarifas = Tarifa.query.all()
+    tarifas = Tarifa.query.options(selectinload(Tarifa.faixas)).all()
     return tarifas
 
 def buscar_tarifa_por_id(tarifa_id):
@@ -19,9 +27,14 @@ def buscar_tarifa_por_id(tarifa_id):
     tarifa = Tarifa.query.get(tarifa_id)
     return tarifa
 
-def inserir_tarifa(nome_tarifa, valor_m3, data_inicio, data_fim=None, ativa=True):
+def _faixas_modelo(faixas):
+    """[(limite_m3 | None, valor_m3)] -> lista de FaixaTarifa na ordem informada."""
+    return [FaixaTarifa(ordem=i, limite_m3=limite, valor_m3=valor) for i, (limite, valor) in enumerate(faixas)]
+
+def inserir_tarifa(nome_tarifa, valor_m3, data_inicio, data_fim=None, ativa=True, faixas=None):
     """
     Insere uma nova tarifa no banco de dados.
+    `faixas` ([(limite_m3 | None, valor_m3)]) torna a tarifa escalonada.
     """
     try:
         new_tarifa = Tarifa(
@@ -29,7 +42,8 @@ def inserir_tarifa(nome_tarifa, valor_m3, data_inicio, data_fim=None, ativa=True
             valor_m3=valor_m3,
             data_inicio=data_inicio,
             data_fim=data_fim,
-            ativa=ativa
+            ativa=ativa,
+            faixas=_faixas_modelo(faixas or [])
         )
         db.session.add(new_tarifa)
         db.session.commit()
@@ -39,9 +53,10 @@ def inserir_tarifa(nome_tarifa, valor_m3, data_inicio, data_fim=None, ativa=True
         print(f"Erro ao inserir tarifa: {e}")
         return None
 
-def atualizar_tarifa(tarifa_id, nome_tarifa=None, valor_m3=None, data_inicio=None, data_fim=None, ativa=None):
+def atualizar_tarifa(tarifa_id, nome_tarifa=None, valor_m3=None, data_inicio=None, data_fim=None, ativa=None, faixas=None):
     """
     Atualiza as informações de uma tarifa existente.
+    `faixas` (lista, mesmo vazia) substitui as faixas atuais; None mantém.
     """
     tarifa = Tarifa.query.get(tarifa_id)
     if tarifa:
@@ -55,6 +70,8 @@ def atualizar_tarifa(tarifa_id, nome_tarifa=None, valor_m3=None, data_inicio=Non
             tarifa.data_fim = data_fim
         if ativa is not None:
             tarifa.ativa = ativa
+        if faixas is not None:
+            tarifa.faixas = _faixas_modelo(faixas)
         try:
             db.session.commit()
             return tarifa
@@ -80,12 +97,13 @@ def excluir_tarifa(tarifa_id):
             return False
     return False
 
-def listar_consumos_mensais():
+def listar_consumos_mensais(cursor=None, limite=None):
     """
-    Lista todos os registros de consumo mensal.
+    Lista os registros de consumo mensal, dos mais recentes para os mais antigos, uma página por vez.
+    Cliente e tarifa aplicada vêm na mesma consulta (LEFT JOIN): a página custa uma consulta, não 1 + 2N.
     """
-    consumos = ConsumoMensal.query.all()
-    return consumos
+    consulta = ConsumoMensal.query.options(joinedload(ConsumoMensal.cliente), joinedload(ConsumoMensal.tarifa_aplicada))
+    return paginar(consulta, [ConsumoMensal.id_consumo], cursor, limite, decrescente=True)
 
 def buscar_consumo_mensal_por_id(consumo_id):
     """
@@ -158,9 +176,90 @@ def calcular_valor_estimado(litros_consumidos, tarifa_id):
     """
     tarifa = Tarifa.query.get(tarifa_id)
     if tarifa and tarifa.ativa:
-        # Converte litros_consumidos para Decimal antes da operação
+        # Converte litros_consumidos para Decimal antes da operação; aplica as faixas da tarifa, se houver
         consumo_m3 = Decimal(str(litros_consumidos)) / Decimal('1000.0')
-        valor_estimado = consumo_m3 * tarifa.valor_m3
-        return round(valor_estimado, 2)
+        valor_estimado = TabelaPrecos.de_tarifa(tarifa).preco(consumo_m3)
+        return valor_estimado.quantize(CENTAVOS, rounding=ROUND_HALF_UP)
     return None
 
+
+
+# ------------------ Faturamento mensal automático ------------------
+
+def periodo_mes(mes_referencia):
+    """Primeiro dia do mês e primeiro dia do mês seguinte."""
+    inicio = mes_referencia.replace(day=1)
+    fim = (inicio + timedelta(days=32)).replace(day=1)
+    return inicio, fim
+
+def consumo_por_cliente(inicio, fim):
+    """
+    Litros consumidos por cliente nos dias locais [inicio, fim), somando os agregados diários
+    (ConsumoDia) numa única consulta agregada. Clientes com dispositivo e sem consumo vêm com 0.
+    """
+    litros = func.coalesce(func.sum(ConsumoDia.consumo_litros), 0)
+    return (db.session.query(Dispositivo.cliente_id, litros)
+            .outerjoin(ConsumoDia, and_(ConsumoDia.dispositivo_id == Dispositivo.id_dispositivo,
+                                        ConsumoDia.inicio >= inicio, ConsumoDia.inicio < fim))
+            .group_by(Dispositivo.cliente_id)
+            .all())
+
+def gerar_faturamento_mensal(mes_referencia, recalcular_agregados=True, offset_horas=0, lote=1000, progresso=None,
+                             agregador=None):
+    """
+    Gera (ou regrava) o ConsumoMensal de todos os clientes no mês de `mes_referencia`.
+
+    Uma consulta agregada obtém os litros por cliente; as tarifas (com faixas) são carregadas uma vez
+    num IndiceTarifas e todos os clientes são precificados num único passo (pro rata se a tarifa muda
+    no mês); as linhas são gravadas com upsert em lote (por cliente e mês) numa única transação.
+    `recalcular_agregados` (padrão) refaz antes, a partir de Leitura, os agregados diários dos dias já
+    encerrados do mês: a fatura não depende dos parciais gravados pela ingestão (dia corrente fica com eles).
+    `agregador` (AgregadorConsumo da ingestão neste processo) é pausado a cada dia refeito, para que parciais
+    de lotes atrasados ainda em memória não somem em dobro sobre ele (ver agregacao_service.recalcular).
+    `progresso(etapa, info)` recebe o andamento. Retorna um resumo com contagens e tempos (ms).
+    """
+    inicio, fim = periodo_mes(mes_referencia)
+    resumo = {'month': inicio.isoformat(), 'clients': 0, 'liters': 0.0, 'amount': None, 'tariffId': None}
+    t0 = time.perf_counter()
+    # o dia local corrente segue com a agregação incremental (recalcular somaria em dobro os parciais pendentes)
+    hoje = (datetime.now(timezone.utc) + timedelta(hours=offset_horas)).date()
+    if recalcular_agregados and inicio < min(fim, hoje):
+        recalcular(inicio, min(fim, hoje), offset_horas=offset_horas, agregador=agregador,
+                   progresso=(lambda dia, r: progresso('agregados', {'day': dia.isoformat(), **r})) if progresso else None)
+    t1 = time.perf_counter()
+    linhas = consumo_por_cliente(inicio, fim)
+    segmentos = IndiceTarifas.carregar().segmentos(inicio, fim)
+    # tarifa registrada no ConsumoMensal: a vigente no fim do mês
+    tarifa_id = segmentos[-1][0].tarifa_id if segmentos else None
+    t2 = time.perf_counter()
+    if progresso:
+        progresso('consulta', {'clients': len(linhas),
+                               'tariffs': [{'name': t.nome, 'days': dias} for t, dias in segmentos]})
+    litros = [Decimal(str(l)).quantize(CENTAVOS, rounding=ROUND_HALF_UP) for _, l in linhas]
+    valores = precificar_lote(litros, segmentos)
+    registros = [{'cliente_id': cliente_id, 'mes_referencia': inicio, 'litros_consumidos': l,
+                  'valor_estimado': v, 'tarifa_aplicada_id': tarifa_id}
+                 for (cliente_id, _), l, v in zip(linhas, litros, valores)]
+    t_preco = time.perf_counter()
+    try:
+        stmt = upsert(ConsumoMensal.__table__, ['cliente_id', 'mes_referencia'],
+                      ['litros_consumidos', 'valor_estimado', 'tarifa_aplicada_id'])
+        for i in range(0, len(registros), lote):
+            db.session.execute(stmt, registros[i:i + lote])
+            if progresso:
+                progresso('gravacao', {'written': min(i + lote, len(registros)), 'total': len(registros)})
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    t3 = time.perf_counter()
+    resumo.update({
+        'clients': len(registros),
+        'liters': float(sum(r['litros_consumidos'] for r in registros)),
+        'amount': float(sum(valores)) if segmentos else None,
+        'tariffId': tarifa_id,
+        'timingsMs': {'rollups': round((t1 - t0) * 1000, 1), 'query': round((t2 - t1) * 1000, 1),
+                      'pricing': round((t_preco - t2) * 1000, 1), 'write': round((t3 - t_preco) * 1000, 1),
+                      'total': round((t3 - t0) * 1000, 1)},
+    })
+    return resumo
@@ -0,0 +1,322 @@
+from array import array
+from collections import OrderedDict
+from threading import Event, Lock
+
+
+class BufferCircular:
+    """
+    Histórico de um dispositivo em arrays tipados (ts int64, total/flow float64) usados como anel.
+
+    Cada leitura ocupa 24 bytes. Inserção O(1); consultas devolvem memoryviews
+    (sem cópia) de até dois segmentos contíguos, em ordem cronológica. O ts é sempre crescente
+    (a busca por `since` é binária): leituras não posteriores à última são descartadas.
+    """
+    __slots__ = ('capacidade', 'ts', 'total', 'flow', 'inicio', 'n')
+
+    BYTES_POR_LEITURA = 24
+
+    def __init__(self, capacidade):
+        self.capacidade = max(1, int(capacidade))
+        self.ts = array('q', bytes(8 * self.capacidade))
+        self.total = array('d', bytes(8 * self.capacidade))
+        self.flow = array('d', bytes(8 * self.capacidade))
+        self.inicio = 0
+        self.n = 0
+
+    def __len__(self):
+        return self.n
+
+    def nbytes(self):
+        return self.capacidade * self.BYTES_POR_LEITURA
+
+    def adicionar(self, ts, total, flow):
+        """Acrescenta a leitura; False (descartada) se ela não é posterior à última (replay do spill, relógio fora de ordem)."""
+        if self.n and ts <= self.ts[(self.inicio + self.n - 1) % self.capacidade]:
+            return False
+        if self.n < self.capacidade:
+            i = (self.inicio + self.n) % self.capacidade
+            self.n += 1
+        else:
+            i = self.inicio
+            self.inicio = (self.inicio + 1) % self.capacidade
+        self.ts[i] = int(ts)
+        self.total[i] = float(total)
+        self.flow[i] = float(flow)
+        return True
+
+    def _ts_logico(self, k):
+        return self.ts[(self.inicio + k) % self.capacidade]
+
+    def _primeiro_desde(self, since):
+        """Índice lógico da primeira leitura com ts >= since (busca binária; ts crescente por serial)."""
+        lo, hi = 0, self.n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._ts_logico(mid) < since:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def segmentos(self, since=None, limit=None):
+        """Lista de (ts, total, flow) como memoryviews contíguas, cobrindo o intervalo pedido."""
+        ini = self._primeiro_desde(since) if since is not None else 0
+        fim = self.n
+        if limit is not None and fim - ini > limit:
+            ini = fim - limit
+        if ini >= fim:
+            return []
+        a = (self.inicio + ini) % self.capacidade
+        qtd = fim - ini
+        partes = [(a, min(a + qtd, self.capacidade))]
+        resto = qtd - (partes[0][1] - a)
+        if resto > 0:
+            partes.append((0, resto))
+        mv_ts, mv_total, mv_flow = memoryview(self.ts), memoryview(self.total), memoryview(self.flow)
+        return [(mv_ts[x:y], mv_total[x:y], mv_flow[x:y]) for x, y in partes]
+
+    def ultimo(self):
+        if not self.n:
+            return None
+        i = (self.inicio + self.n - 1) % self.capacidade
+        return self.ts[i], self.total[i], self.flow[i]
+
+
+class HistoricoDispositivos:
+    """
+    Histórico em memória por serial (um BufferCircular de `capacidade` leituras por dispositivo).
+
+    O total alocado é limitado por `orcamento_bytes`: ao criar um buffer novo acima do
+    orçamento, os dispositivos há mais tempo sem leitura/consulta (LRU) são descartados.
+    """
+
+    def __init__(self, capacidade=1000, orcamento_bytes=64 * 1024 * 1024):
+        self.capacidade = max(1, int(capacidade))
+        self.orcamento_bytes = int(orcamento_bytes)
+        self._buffers = OrderedDict()
+        self._lock = Lock()
+        self._bytes = 0
+        self._ultimo_serial = None
+        self.despejados = 0
+        self.fora_de_ordem = 0
+
+    def _buffer(self, serial, criar=False):
+        buf = self._buffers.get(serial)
+        if buf is not None:
+            self._buffers.move_to_end(serial)
+            return buf
+        if not criar:
+            return None
+        buf = BufferCircular(self.capacidade)
+        while self._buffers and self._bytes + buf.nbytes() > self.orcamento_bytes:
+            _, antigo = self._buffers.popitem(last=False)
+            self._bytes -= antigo.nbytes()
+            self.despejados += 1
+        self._buffers[serial] = buf
+        self._bytes += buf.nbytes()
+        return buf
+
+    def adicionar_varios(self, leituras):
+        """Adiciona leituras normalizadas (ts, totalLiters, flowLmin, numero_serie) com uma única aquisição do lock."""
+        with self._lock:
+            for d in leituras:
+                serial = d.get('numero_serie') or ''
+                if self._buffer(serial, criar=True).adicionar(d['ts'], d['totalLiters'], d['flowLmin']):
+                    self._ultimo_serial = serial
+                else:
+                    self.fora_de_ordem += 1
+
+    def adicionar(self, leitura):
+        self.adicionar_varios((leitura,))
+
+    def preencher(self, leituras):
+        """Como `adicionar_varios`, mas só para seriais ainda sem leituras em memória (carga do banco
+        concorrente com a ingestão não intercala leituras antigas depois das novas)."""
+        with self._lock:
+            ocupados = {s for s, b in self._buffers.items() if len(b)}
+            ultimo = None
+            for d in leituras:
+                serial = d.get('numero_serie') or ''
+                if serial in ocupados:
+                    continue
+                self._buffer(serial, criar=True).adicionar(d['ts'], d['totalLiters'], d['flowLmin'])
+                ultimo = serial
+            if self._ultimo_serial is None and ultimo is not None:
+                self._ultimo_serial = ultimo
+
+    def _serial_padrao(self):
+        # Dispositivo que recebeu a última leitura (se ainda estiver em memória)
+        if self._ultimo_serial in self._buffers:
+            return self._ultimo_serial
+        return next(reversed(self._buffers), None)
+
+    def serial_mais_recente(self):
+        with self._lock:
+            return self._serial_padrao()
+
+    def consultar(self, serial=None, since=None, limit=200):
+        """
+        Leituras de um serial (ou do dispositivo mais recente se omitido) como lista de dicts,
+        em ordem cronológica, opcionalmente a partir de `since` (epoch ms).
+        """
+        with self._lock:
+            if serial is None:
+                serial = self._serial_padrao()
+            buf = self._buffer(serial) if serial is not None else None
+            if buf is None:
+                return []
+            segmentos = buf.segmentos(since=since, limit=limit)
+            return [{'ts': t, 'totalLiters': tot, 'flowLmin': fl}
+                    for mv_ts, mv_tot, mv_fl in segmentos
+                    for t, tot, fl in zip(mv_ts, mv_tot, mv_fl)]
+
+    def consultar_colunas(self, serial=None, since=None, limit=None):
+        """Como `consultar`, mas devolve (serial, ts, total, flow) em arrays tipados (para redução de pontos)."""
+        ts, total, flow = array('q'), array('d'), array('d')
+        with self._lock:
+            if serial is None:
+                serial = self._serial_padrao()
+            buf = self._buffer(serial) if serial is not None else None
+            if buf is not None:
+                for mv_ts, mv_tot, mv_fl in buf.segmentos(since=since, limit=limit):
+                    ts.frombytes(mv_ts.cast('B'))
+                    total.frombytes(mv_tot.cast('B'))
+                    flow.frombytes(mv_fl.cast('B'))
+        return serial, ts, total, flow
+
+    def ultimo(self, serial=None):
+        with self._lock:
+            if serial is None:
+                serial = self._serial_padrao()
+            buf = self._buffers.get(serial) if serial is not None else None
+            u = buf.ultimo() if buf is not None else None
+        if u is None:
+            return None
+        return {'ts': u[0], 'totalLiters': u[1], 'flowLmin': u[2], 'numero_serie': serial or None}
+
+    def vazio(self, serial=None):
+        with self._lock:
+            if serial is None:
+                return not any(len(b) for b in self._buffers.values())
+            buf = self._buffers.get(serial)
+            return buf is None or not len(buf)
+
+    def limpar(self):
+        with self._lock:
+            self._buffers.clear()
+            self._bytes = 0
+            self._ultimo_serial = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'devices': len(self._buffers),
+                'readings': sum(len(b) for b in self._buffers.values()),
+                'limitPerDevice': self.capacidade,
+                'allocatedBytes': self._bytes,
+                'budgetBytes': self.orcamento_bytes,
+                'evictedDevices': self.despejados,
+                'outOfOrderDropped': self.fora_de_ordem,
+            }
+
+
+class CargaCompartilhada:
+    """
+    Garante uma única execução simultânea por chave: quem chega enquanto a carga está em
+    andamento espera o resultado da execução em curso em vez de repetir a consulta.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._em_andamento = {}
+        self.execucoes = 0
+        self.compartilhadas = 0
+
+    def executar(self, chave, funcao, timeout=30.0):
+        with self._lock:
+            pendente = self._em_andamento.get(chave)
+            if pendente is None:
+                pendente = self._em_andamento[chave] = [Event(), None]
+                dono = True
+                self.execucoes += 1
+            else:
+                dono = False
+                self.compartilhadas += 1
+        if not dono:
+            pendente[0].wait(timeout)
+            return pendente[1]
+        try:
+            pendente[1] = funcao()
+            return pendente[1]
+        finally:
+            with self._lock:
+                self._em_andamento.pop(chave, None)
+            pendente[0].set()
+
+
+# ------------------ Redução de pontos (downsampling) para gráficos ------------------
+
+METODOS_REDUCAO = ('lttb', 'minmax')
+
+
+def indices_lttb(xs, ys, alvo):
+    """
+    Largest-Triangle-Three-Buckets: escolhe `alvo` índices preservando a forma da série (xs crescente).
+    O(n), em Python puro: as médias do próximo bucket usam sum() sobre fatias, mas a área de cada ponto
+    candidato é calculada numa list comprehension, ponto a ponto. Custo medido (scripts/bench_historico.py):
+    ~0,8 ms para 1000 leituras -> 100 pontos, ~3 ms para 10000 leituras.
+    """
+    n = len(xs)
+    if alvo >= n or alvo < 3:
+        return list(range(n))
+    passo = (n - 2) / (alvo - 2)
+    indices = [0]
+    a = 0
+    for i in range(alvo - 2):
+        ini_prox = int((i + 1) * passo) + 1
+        fim_prox = min(int((i + 2) * passo) + 1, n)
+        qtd = fim_prox - ini_prox
+        media_x = sum(xs[ini_prox:fim_prox]) / qtd
+        media_y = sum(ys[ini_prox:fim_prox]) / qtd
+        ini, fim = int(i * passo) + 1, int((i + 1) * passo) + 1
+        ax, ay = xs[a], ys[a]
+        dx, dy = ax - media_x, media_y - ay
+        # área (x2) do triângulo (a, j, média do próximo bucket) para cada j do bucket atual
+        areas = [abs(dx * (y - ay) + (x - ax) * dy) for x, y in zip(xs[ini:fim], ys[ini:fim])]
+        a = ini + areas.index(max(areas))
+        indices.append(a)
+    indices.append(n - 1)
+    return indices
+
+
+def indices_minmax(ys, alvo):
+    """
+    Divide a série em alvo/2 buckets e mantém o mínimo e o máximo de cada um (em ordem cronológica).
+    O(n): laço Python por bucket; min/max/index percorrem a fatia (builtins), convertendo cada elemento
+    do array em float. ~0,2 ms para 1000 leituras -> 100 pontos (cerca de 3,5x mais barato que LTTB).
+    """
+    n = len(ys)
+    if alvo >= n or alvo < 2:
+        return list(range(n))
+    buckets = alvo // 2
+    indices = []
+    for b in range(buckets):
+        ini, fim = b * n // buckets, (b + 1) * n // buckets
+        if ini >= fim:
+            continue
+        fatia = ys[ini:fim]
+        i_min = ini + fatia.index(min(fatia))
+        i_max = ini + fatia.index(max(fatia))
+        indices.extend(sorted({i_min, i_max}))
+    return indices
+
+
+def reduzir_serie(ts, total, flow, alvo, metodo='lttb'):
+    """Reduz a série (arrays paralelos) para ~`alvo` pontos usando a vazão como sinal de forma."""
+    if not alvo or alvo >= len(ts):
+        idx = range(len(ts))
+    elif metodo == 'minmax':
+        idx = indices_minmax(flow, alvo)
+    else:
+        idx = indices_lttb(ts, flow, alvo)
+    return [{'ts': ts[i], 'totalLiters': total[i], 'flowLmin': flow[i]} for i in idx]
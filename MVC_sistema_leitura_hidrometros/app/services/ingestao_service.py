@@ -0,0 +1,540 @@
+import threading
+import time
+import atexit
+import base64
+import hashlib
+import json
+import os
+import queue
+import re
+import zlib
+from collections import deque, OrderedDict
+from contextlib import nullcontext
+from sqlalchemy import case
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from app import app, db
+from app.models.dispositivo_model import Leitura, LeituraAtual
+from app.services.payload_service import is_binario, serial_do_frame
+
+
+def insert_ignorando_duplicatas(tabela):
+    """INSERT que ignora linhas que violam a chave única (dispositivo_id, data_hora) no dialeto atual."""
+    dialeto = db.engine.dialect.name
+    if dialeto == 'sqlite':
+        return sqlite.insert(tabela).on_conflict_do_nothing()
+    if dialeto == 'postgresql':
+        return postgresql.insert(tabela).on_conflict_do_nothing()
+    if dialeto in ('mysql', 'mariadb'):
+        return mysql.insert(tabela).prefix_with('IGNORE')
+    return tabela.insert()
+
+
+def upsert(tabela, chaves, colunas, combinar=None, se_mais_novo=None):
+    """INSERT ... ON CONFLICT (chaves) DO UPDATE colunas = valores novos, no dialeto atual (executemany).
+
+    `combinar` ({coluna: f(atual, novo)}) troca a substituição por uma expressão que mescla o valor
+    gravado com o novo (ex: soma, mínimo), para agregados incrementais.
+    `se_mais_novo` (nome de coluna) só atualiza a linha quando o valor novo dessa coluna é >= ao gravado
+    (ex: data_hora, para lotes que chegam fora de ordem não sobrescreverem um valor mais recente).
+    """
+    combinar = combinar or {}
+    dialeto = db.engine.dialect.name
+
+    def valor(c, novo):
+        return combinar[c](tabela.c[c], novo) if c in combinar else novo
+
+    if dialeto in ('sqlite', 'postgresql'):
+        stmt = (sqlite if dialeto == 'sqlite' else postgresql).insert(tabela)
+        onde = tabela.c[se_mais_novo] <= stmt.excluded[se_mais_novo] if se_mais_novo else None
+        return stmt.on_conflict_do_update(index_elements=list(chaves), where=onde,
+                                          set_={c: valor(c, stmt.excluded[c]) for c in colunas})
+    if dialeto in ('mysql', 'mariadb'):
+        stmt = mysql.insert(tabela)
+        atribuicoes = [(c, valor(c, stmt.inserted[c])) for c in colunas]
+        if se_mais_novo:
+            # MySQL aplica as atribuições da esquerda para a direita: a coluna da condição vai por último
+            cond = stmt.inserted[se_mais_novo] >= tabela.c[se_mais_novo]
+            atribuicoes = sorted(((c, case((cond, v), else_=tabela.c[c])) for c, v in atribuicoes),
+                                 key=lambda item: item[0] == se_mais_novo)
+        return stmt.on_duplicate_key_update(atribuicoes)
+    raise NotImplementedError(f'upsert não suportado no dialeto {dialeto}')
+
+
+_COLUNAS_ATUAL = ['data_hora', 'consumo_litros', 'total_liters', 'flow_lmin']
+
+
+def ultimas_por_dispositivo(lote):
+    """Linha de LeituraAtual (a de maior data_hora) para cada dispositivo presente no lote."""
+    ultimas = {}
+    for linha in lote:
+        atual = ultimas.get(linha['dispositivo_id'])
+        if atual is None or linha['data_hora'] >= atual['data_hora']:
+            ultimas[linha['dispositivo_id']] = linha
+    return [{'dispositivo_id': d, **{c: linha.get(c) for c in _COLUNAS_ATUAL}} for d, linha in ultimas.items()]
+
+
+def travar_leituras_atuais(ids):
+    """
+    {dispositivo_id: (data_hora, total_liters)} gravados em LeituraAtual para os dispositivos, com as linhas
+    travadas (FOR UPDATE, em ordem de id) até o commit: réplicas gravando lotes do mesmo medidor se
+    serializam e cada uma lê a última leitura já persistida pela outra. No SQLite o lock é do banco todo.
+    """
+    if not ids:
+        return {}
+    t = LeituraAtual.__table__
+    linhas = db.session.execute(
+        db.select(t.c.dispositivo_id, t.c.data_hora, t.c.total_liters)
+        .where(t.c.dispositivo_id.in_(sorted(ids)))
+        .order_by(t.c.dispositivo_id)
+        .with_for_update())
+    return {d: (dh, float(total) if total is not None else None) for d, dh, total in linhas}
+
+
+def atualizar_leituras_atuais(lote):
+    """Upsert em LeituraAtual das últimas leituras do lote (sem commit; mantém a mais recente já gravada)."""
+    linhas = ultimas_por_dispositivo(lote)
+    if linhas:
+        db.session.execute(upsert(LeituraAtual.__table__, ['dispositivo_id'], _COLUNAS_ATUAL,
+                                  se_mais_novo='data_hora'), linhas)
+    return len(linhas)
+
+
+class FiltroRecentes:
+    """
+    Conjunto limitado (FIFO) das chaves (serial, ts) vistas recentemente.
+
+    Evita que retransmissões óbvias (QoS 1, reconexões) repitam histórico, emit e alertas. Não filtra a
+    gravação: a deduplicação no banco fica com a chave única de Leitura, para que a retransmissão de uma
+    leitura cujo lote falhou não seja descartada.
+    """
+
+    def __init__(self, capacidade=100000):
+        self.capacidade = max(1, int(capacidade))
+        self._chaves = OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicadas = 0
+
+    def novo(self, serial, ts):
+        """Registra a chave e retorna True se ela ainda não tinha sido vista."""
+        chave = (serial, ts)
+        with self._lock:
+            if chave in self._chaves:
+                self.duplicadas += 1
+                return False
+            self._chaves[chave] = None
+            if len(self._chaves) > self.capacidade:
+                self._chaves.popitem(last=False)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._chaves), 'capacity': self.capacidade, 'duplicatesRejected': self.duplicadas}
+
+
+class EscritorLeituras:
+    """
+    Buffer write-behind para as leituras recebidas (MQTT / API).
+
+    As leituras são enfileiradas em memória e gravadas em lote (bulk insert) por uma
+    thread própria a cada `batch_size` linhas ou `flush_ms` milissegundos, o que vier primeiro.
+    Quando a fila atinge `max_queue` novas leituras são descartadas (e contabilizadas).
+    Um lote cuja gravação falha volta para o início da fila e é tentado de novo após uma espera
+    exponencial (`retry_backoff_ms`, dobrando até `_ESPERA_MAX_S`); só depois de `retry_max` falhas
+    seguidas ele é descartado e contado em `falhas` (erro persistente, como um lote inválido).
+    Na mesma transação do lote, LeituraAtual recebe a última leitura de cada dispositivo.
+    Funções em `apos_gravar` recebem, depois do commit, o lote e a leitura atual de cada dispositivo
+    antes dele ({dispositivo_id: (data_hora, total_liters)}, lida com lock na mesma transação), base
+    do consumo incremental mesmo com várias réplicas gravando o mesmo medidor (ex: agregados de consumo).
+    `trava_gravacao` (opcional) é mantida da abertura da transação até o fim de `apos_gravar`.
+    """
+
+    _ESPERA_MAX_S = 30.0
+
+    def __init__(self, batch_size=500, flush_ms=1000, max_queue=50000, retry_max=5, retry_backoff_ms=500):
+        self.batch_size = max(1, int(batch_size))
+        self.flush_ms = max(1, int(flush_ms))
+        self.max_queue = max(self.batch_size, int(max_queue))
+        self.retry_max = max(0, int(retry_max))
+        self.retry_backoff_ms = max(1, int(retry_backoff_ms))
+        self._tentativas = 0  # falhas seguidas do lote no início da fila
+        self._fila = deque()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._rodando = False
+        self._primeira_em = None  # instante (monotonic) da leitura mais antiga pendente
+        self.apos_gravar = []
+        self.trava_gravacao = nullcontext()
+        # Métricas
+        self.enfileiradas = 0
+        self.gravadas = 0
+        self.descartadas = 0
+        self.duplicadas = 0
+        self.falhas = 0
+        self.retentativas = 0
+        self.lotes = 0
+        self.ultimo_lote = 0
+        self.ultimo_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    def iniciar(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._rodando = True
+        self._thread = threading.Thread(target=self._loop, name='escritor-leituras', daemon=True)
+        self._thread.start()
+        atexit.register(self.parar)
+
+    def parar(self):
+        """Interrompe a thread e grava o que ainda estiver pendente."""
+        with self._cond:
+            self._rodando = False
+            self._cond.notify_all()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def enfileirar(self, linha):
+        """Adiciona uma leitura (dict com as colunas de Leitura). Retorna False se a fila estiver cheia."""
+        with self._cond:
+            if len(self._fila) >= self.max_queue:
+                self.descartadas += 1
+                self._cond.notify()
+                return False
+            vazia = not self._fila
+            if vazia:
+                self._primeira_em = time.monotonic()
+            self._fila.append(linha)
+            self.enfileiradas += 1
+            # Acorda a thread ao iniciar um novo lote (arma o prazo) ou ao completar o lote
+            if vazia or len(self._fila) >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    def enfileirar_lote(self, linhas):
+        """Adiciona várias leituras numa única operação (ficam contíguas na fila). Retorna quantas foram aceitas."""
+        with self._cond:
+            livres = max(0, self.max_queue - len(self._fila))
+            aceitas = linhas[:livres]
+            self.descartadas += len(linhas) - len(aceitas)
+            if not aceitas:
+                self._cond.notify()
+                return 0
+            vazia = not self._fila
+            if vazia:
+                self._primeira_em = time.monotonic()
+            self._fila.extend(aceitas)
+            self.enfileiradas += len(aceitas)
+            if vazia or len(self._fila) >= self.batch_size:
+                self._cond.notify()
+        return len(aceitas)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while self._rodando and not self._fila:
+                    self._cond.wait()
+                while self._rodando and self._fila and len(self._fila) < self.batch_size:
+                    restante = self._primeira_em + self.flush_ms / 1000.0 - time.monotonic()
+                    if restante <= 0:
+                        break
+                    self._cond.wait(restante)
+                rodando = self._rodando
+            if not self.flush() and rodando:
+                self._aguardar(min(self._ESPERA_MAX_S, self.retry_backoff_ms / 1000.0 * 2 ** (self._tentativas - 1)))
+            if not rodando:
+                break
+
+    def _aguardar(self, segundos):
+        """Espera antes de tentar de novo um lote que falhou (interrompida por parar())."""
+        ate = time.monotonic() + segundos
+        with self._cond:
+            while self._rodando:
+                restante = ate - time.monotonic()
+                if restante <= 0:
+                    break
+                self._cond.wait(restante)
+
+    def flush(self):
+        """
+        Grava todas as leituras pendentes em lotes de até `batch_size` linhas.
+        Retorna False se um lote falhou: ele volta para o início da fila e o flush para ali.
+        """
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    if not self._fila:
+                        self._primeira_em = None
+                        return True
+                    n = min(len(self._fila), self.batch_size)
+                    lote = [self._fila.popleft() for _ in range(n)]
+                    self._primeira_em = time.monotonic() if self._fila else None
+                if self._gravar(lote):
+                    self._tentativas = 0
+                    continue
+                self._tentativas += 1
+                if self._tentativas > self.retry_max:
+                    self._tentativas = 0
+                    self.falhas += len(lote)
+                    print(f'[INGEST] Lote de {len(lote)} leituras descartado após {self.retry_max + 1} tentativas')
+                    continue
+                self.retentativas += 1
+                with self._cond:
+                    # volta na frente (mesma ordem), mesmo acima de max_queue: são leituras já aceitas
+                    self._fila.extendleft(reversed(lote))
+                    self._primeira_em = time.monotonic()
+                return False
+
+    def _gravar(self, lote):
+        """Grava o lote numa transação. Retorna False se ela falhou (o lote não foi gravado)."""
+        inicio = time.perf_counter()
+        gravado = False
+        with self.trava_gravacao, app.app_context():
+            try:
+                anteriores = travar_leituras_atuais({l['dispositivo_id'] for l in lote})
+                res = db.session.execute(insert_ignorando_duplicatas(Leitura.__table__), lote)
+                atualizar_leituras_atuais(lote)
+                db.session.commit()
+                gravadas = res.rowcount if res.rowcount is not None and res.rowcount >= 0 else len(lote)
+                self.gravadas += gravadas
+                self.duplicadas += len(lote) - gravadas
+                gravado = True
+            except Exception as e:
+                db.session.rollback()
+                print(f'[INGEST] Falha ao gravar lote de {len(lote)} leituras (tentativa {self._tentativas + 1}):', e)
+            for funcao in self.apos_gravar if gravado else ():
+                try:
+                    funcao(lote, anteriores)
+                except Exception as e:
+                    print('[INGEST] Falha no pós-gravação do lote:', e)
+        dur = (time.perf_counter() - inicio) * 1000.0
+        self.lotes += 1
+        self.ultimo_lote = len(lote)
+        self.ultimo_flush_ms = dur
+        if dur > self.max_flush_ms:
+            self.max_flush_ms = dur
+        return gravado
+
+    def tamanho_fila(self):
+        with self._cond:
+            return len(self._fila)
+
+    def stats(self):
+        return {
+            'queueDepth': self.tamanho_fila(),
+            'maxQueue': self.max_queue,
+            'batchSize': self.batch_size,
+            'flushMs': self.flush_ms,
+            'enqueued': self.enfileiradas,
+            'written': self.gravadas,
+            'dropped': self.descartadas,
+            'duplicatesIgnoredByDb': self.duplicadas,
+            'failed': self.falhas,
+            'retries': self.retentativas,
+            'batches': self.lotes,
+            'lastBatchSize': self.ultimo_lote,
+            'lastFlushLatencyMs': round(self.ultimo_flush_ms, 3),
+            'maxFlushLatencyMs': round(self.max_flush_ms, 3),
+        }
+
+
+filtro_recentes = FiltroRecentes(app.config.get('DEDUP_RECENT_KEYS', 100000))
+
+escritor_leituras = EscritorLeituras(
+    batch_size=app.config.get('INGEST_BATCH_SIZE', 500),
+    flush_ms=app.config.get('INGEST_FLUSH_MS', 1000),
+    max_queue=app.config.get('INGEST_MAX_QUEUE', 50000),
+    retry_max=app.config.get('INGEST_RETRY_MAX', 5),
+    retry_backoff_ms=app.config.get('INGEST_RETRY_BACKOFF_MS', 500),
+)
+
+
+# Extrai o serial direto dos bytes do payload JSON (sem decodificar) para rotear a mensagem
+_RE_SERIAL = re.compile(rb'"(?:numeroSerie|serial|numero_serie)"\s*:\s*"?([^",}\s]+)')
+
+POLITICAS_OVERFLOW = ('block', 'drop-oldest', 'spill')
+
+
+def particao_do_serial(chave, particoes):
+    """Partição (0..particoes-1) de uma chave de roteamento; estável entre processos e independente do
+    hash usado para escolher o worker (crc32), para que cada réplica use todos os seus workers."""
+    return int.from_bytes(hashlib.blake2b(chave, digest_size=4).digest(), 'big') % particoes
+
+
+def chave_roteamento(topic, payload):
+    """Chave usada para escolher o worker: serial do payload, ou o tópico se não houver serial."""
+    if is_binario(payload):
+        # Frame sem serial: o serial é o último segmento do tópico
+        serial = serial_do_frame(payload) or (topic or '').rstrip('/').rsplit('/', 1)[-1].encode('utf-8', errors='replace')
+    else:
+        m = _RE_SERIAL.search(payload[:512]) if payload else None
+        serial = m.group(1) if m else None
+    if serial:
+        return serial.upper()
+    return topic.encode('utf-8', errors='replace') if isinstance(topic, str) else (topic or b'')
+
+
+class PoolIngestao:
+    """
+    Desacopla o callback MQTT (thread de rede do paho) do processamento das mensagens.
+
+    O callback apenas chama `submeter(topic, payload)`; cada mensagem vai para a fila limitada
+    de um worker escolhido pelo hash do serial, preservando a ordem por serial.
+    Política de overflow quando a fila do worker está cheia:
+      - block: o callback aguarda espaço (contrapressão ao broker);
+      - drop-oldest: descarta a mensagem mais antiga da fila;
+      - spill: grava a mensagem em arquivo NDJSON, reprocessado quando as filas esvaziam
+        (mensagens reprocessadas perdem a garantia de ordem).
+    Com `particoes` > 1 a réplica recebe todas as mensagens e só aceita as dos seriais da sua `particao`
+    (particao_do_serial): cada serial é processado sempre pela mesma réplica.
+    """
+
+    def __init__(self, processar, workers=4, max_queue=10000, politica='block', spill_path=None,
+                 particao=0, particoes=1):
+        if politica not in POLITICAS_OVERFLOW:
+            raise ValueError(f'politica de overflow inválida: {politica}')
+        self.particoes = max(1, int(particoes))
+        self.particao = int(particao)
+        if not 0 <= self.particao < self.particoes:
+            raise ValueError(f'partição {particao} fora de [0, {self.particoes})')
+        self.processar = processar
+        self.n_workers = max(1, int(workers))
+        self.max_queue = max(self.n_workers, int(max_queue))
+        self.politica = politica
+        self.spill_path = spill_path
+        por_fila = max(1, self.max_queue // self.n_workers)
+        self._filas = [queue.Queue(maxsize=por_fila) for _ in range(self.n_workers)]
+        self._threads = []
+        self._spill_lock = threading.Lock()
+        self._rodando = False
+        # Métricas
+        self.recebidas = 0
+        self.outras_particoes = 0
+        self.processadas = 0
+        self.erros = 0
+        self.descartadas = 0
+        self.spilled = 0
+        self.reprocessadas = 0
+        self.ultimo_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+
+    def iniciar(self):
+        if self._rodando:
+            return
+        self._rodando = True
+        for i, fila in enumerate(self._filas):
+            t = threading.Thread(target=self._loop, args=(fila,), name=f'ingest-worker-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+        if self.politica == 'spill' and self.spill_path:
+            t = threading.Thread(target=self._loop_spill, name='ingest-spill', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submeter(self, topic, payload):
+        """Enfileira a mensagem bruta. Chamado na thread do paho: não faz parsing nem I/O de banco."""
+        chave = chave_roteamento(topic, payload)
+        if self.particoes > 1 and particao_do_serial(chave, self.particoes) != self.particao:
+            self.outras_particoes += 1
+            return
+        self.recebidas += 1
+        fila = self._filas[zlib.crc32(chave) % self.n_workers]
+        item = (topic, payload, time.monotonic())
+        if self.politica == 'block':
+            fila.put(item)
+            return
+        try:
+            fila.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+        if self.politica == 'spill' and self.spill_path:
+            self._spill(item)
+            return
+        # drop-oldest (ou spill sem caminho configurado)
+        while True:
+            try:
+                fila.get_nowait()
+                fila.task_done()
+                self.descartadas += 1
+            except queue.Empty:
+                pass
+            try:
+                fila.put_nowait(item)
+                return
+            except queue.Full:
+                continue
+
+    def _loop(self, fila):
+        while True:
+            topic, payload, enq = fila.get()
+            lag = (time.monotonic() - enq) * 1000.0
+            self.ultimo_lag_ms = lag
+            if lag > self.max_lag_ms:
+                self.max_lag_ms = lag
+            try:
+                self.processar(topic, payload)
+                self.processadas += 1
+            except Exception as e:
+                self.erros += 1
+                print('[INGEST] Erro ao processar mensagem:', e)
+            finally:
+                fila.task_done()
+
+    def _spill(self, item):
+        topic, payload, _ = item
+        linha = json.dumps({'t': topic, 'p': base64.b64encode(payload).decode('ascii')})
+        with self._spill_lock:
+            with open(self.spill_path, 'a', encoding='utf-8') as f:
+                f.write(linha + '\n')
+            self.spilled += 1
+
+    def _loop_spill(self):
+        # Reprocessa o arquivo de spill quando as filas estiverem abaixo da metade
+        while True:
+            time.sleep(1.0)
+            if self.profundidade() > self.max_queue // 2:
+                continue
+            with self._spill_lock:
+                if not os.path.exists(self.spill_path):
+                    continue
+                drenando = self.spill_path + '.draining'
+                os.replace(self.spill_path, drenando)
+            with open(drenando, 'r', encoding='utf-8') as f:
+                for linha in f:
+                    try:
+                        j = json.loads(linha)
+                        topic, payload = j['t'], base64.b64decode(j['p'])
+                    except Exception:
+                        continue
+                    fila = self._filas[zlib.crc32(chave_roteamento(topic, payload)) % self.n_workers]
+                    fila.put((topic, payload, time.monotonic()))
+                    self.reprocessadas += 1
+            os.remove(drenando)
+
+    def profundidade(self):
+        return sum(f.qsize() for f in self._filas)
+
+    def aguardar(self):
+        """Bloqueia até que todas as mensagens enfileiradas tenham sido processadas."""
+        for f in self._filas:
+            f.join()
+
+    def stats(self):
+        return {
+            'workers': self.n_workers,
+            'overflowPolicy': self.politica,
+            'queueDepth': self.profundidade(),
+            'queueDepthPerWorker': [f.qsize() for f in self._filas],
+            'maxQueue': self.max_queue,
+            'partition': f'{self.particao}/{self.particoes}' if self.particoes > 1 else None,
+            'otherPartitions': self.outras_particoes,
+            'received': self.recebidas,
+            'processed': self.processadas,
+            'errors': self.erros,
+            'dropped': self.descartadas,
+            'spilled': self.spilled,
+            'replayed': self.reprocessadas,
+            'lastLagMs': round(self.ultimo_lag_ms, 3),
+            'maxLagMs': round(self.max_lag_ms, 3),
+        }
@@ -0,0 +1,95 @@
+import logging
+import threading
+import time
+
+
+def _formatar(evento, campos):
+    return evento + ''.join(f' {k}={v}' for k, v in campos.items())
+
+
+class LogAmostrado:
+    """
+    Log estruturado (evento + pares chave=valor) para o caminho quente da ingestão.
+
+    - Nada é formatado se o nível não estiver habilitado no logger.
+    - Amostragem por chave (ex: serial): registra 1 a cada `amostra` mensagens da mesma chave.
+    - Limite global de taxa (token bucket de `taxa` linhas/s com `rajada` de folga).
+    Linhas suprimidas são contadas por evento e resumidas a cada `intervalo_resumo` segundos.
+    """
+
+    def __init__(self, logger, taxa=10.0, rajada=20, amostra=100, intervalo_resumo=60.0, max_chaves=10000):
+        self.logger = logger
+        self.taxa = float(taxa)
+        self.rajada = float(max(1, rajada))
+        self.amostra = max(1, int(amostra))
+        self.intervalo_resumo = float(intervalo_resumo)
+        self.max_chaves = max_chaves
+        self._tokens = self.rajada
+        self._ultimo = time.monotonic()
+        self._por_chave = {}
+        self._suprimidas = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _permitir(self, evento, chave):
+        with self._lock:
+            if chave is not None:
+                n = self._por_chave.get(chave, 0)
+                if len(self._por_chave) >= self.max_chaves and n == 0:
+                    self._por_chave.clear()
+                self._por_chave[chave] = n + 1
+                if n % self.amostra:
+                    self._suprimidas[evento] = self._suprimidas.get(evento, 0) + 1
+                    return False
+            agora = time.monotonic()
+            self._tokens = min(self.rajada, self._tokens + (agora - self._ultimo) * self.taxa)
+            self._ultimo = agora
+            if self._tokens < 1.0:
+                self._suprimidas[evento] = self._suprimidas.get(evento, 0) + 1
+                return False
+            self._tokens -= 1.0
+            return True
+
+    def log(self, nivel, evento, chave=None, **campos):
+        if not self.logger.isEnabledFor(nivel):
+            return
+        if self._thread is None:
+            self._iniciar_resumo()
+        if self._permitir(evento, chave):
+            self.logger.log(nivel, _formatar(evento, campos))
+
+    def debug(self, evento, chave=None, **campos):
+        self.log(logging.DEBUG, evento, chave, **campos)
+
+    def info(self, evento, chave=None, **campos):
+        self.log(logging.INFO, evento, chave, **campos)
+
+    def warning(self, evento, chave=None, **campos):
+        self.log(logging.WARNING, evento, chave, **campos)
+
+    def _iniciar_resumo(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop_resumo, name='log-resumo', daemon=True)
+            self._thread.start()
+
+    def _loop_resumo(self):
+        while True:
+            time.sleep(self.intervalo_resumo)
+            self.flush_resumo()
+
+    def flush_resumo(self):
+        """Registra (INFO) e zera os contadores de linhas suprimidas."""
+        with self._lock:
+            suprimidas, self._suprimidas = self._suprimidas, {}
+        if suprimidas:
+            self.logger.info(_formatar('log.suprimidas', suprimidas))
+        return suprimidas
+
+
+def configurar_logging(nivel):
+    logging.basicConfig(
+        level=getattr(logging, str(nivel).upper(), logging.INFO),
+        format='%(asctime)s %(levelname)s %(name)s %(message)s',
+    )
@@ -0,0 +1,91 @@
+"""
+Paginação por chave (keyset) para as listagens.
+
+Cada página é `WHERE chave > cursor ORDER BY chave LIMIT n + 1`: o banco desce direto pelo índice da
+chave até o cursor, então o custo de uma página não depende de quantas linhas existem nem de quantas
+páginas vieram antes (diferente de OFFSET). O cursor é opaco para o cliente: base64 (URL) de um JSON
+com os valores da chave da última linha da página.
+"""
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from sqlalchemy import tuple_
+from app import app
+
+
+class CursorInvalido(ValueError):
+    """Cursor de paginação malformado ou de outra listagem."""
+
+
+class Pagina:
+    """Itens de uma página e o cursor da próxima (None na última). Iterável como a lista de itens."""
+    __slots__ = ('itens', 'proximo', 'limite')
+
+    def __init__(self, itens, proximo, limite):
+        self.itens = itens
+        self.proximo = proximo
+        self.limite = limite
+
+    def __iter__(self):
+        return iter(self.itens)
+
+    def __len__(self):
+        return len(self.itens)
+
+
+def limite_pagina(valor=None):
+    """Tamanho de página pedido, limitado a [1, PAGE_SIZE_MAX] (vazio/inválido = PAGE_SIZE_DEFAULT)."""
+    try:
+        limite = int(valor) if valor not in (None, '') else app.config['PAGE_SIZE_DEFAULT']
+    except (TypeError, ValueError):
+        limite = app.config['PAGE_SIZE_DEFAULT']
+    return max(1, min(limite, app.config['PAGE_SIZE_MAX']))
+
+
+def codificar_cursor(valores):
+    texto = json.dumps([v.isoformat() if isinstance(v, (date, datetime)) else v for v in valores],
+                       separators=(',', ':'))
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor, colunas):
+    """Valores da chave no cursor, convertidos para o tipo de cada coluna."""
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(valores, list) or len(valores) != len(colunas):
+            raise ValueError('quantidade de valores diferente da chave')
+        convertidos = []
+        for valor, coluna in zip(valores, colunas):
+            tipo = coluna.type.python_type
+            if tipo in (datetime, date):
+                convertidos.append(tipo.fromisoformat(valor))
+            else:
+                convertidos.append(tipo(valor))
+        return convertidos
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as e:
+        raise CursorInvalido('cursor de paginação inválido') from e
+
+
+def paginar(consulta, chave, cursor=None, limite=None, decrescente=False):
+    """
+    Página de `consulta` ordenada por `chave` (colunas que identificam a linha de forma única, cobertas
+    por um índice). Retorna Pagina com os itens e o cursor da página seguinte.
+    """
+    chave = list(chave)
+    limite = limite_pagina(limite)
+    if cursor:
+        valores = decodificar_cursor(cursor, chave)
+        if len(chave) == 1:
+            esquerda, direita = chave[0], valores[0]
+        else:
+            esquerda, direita = tuple_(*chave), tuple_(*valores)
+        consulta = consulta.filter(esquerda < direita if decrescente else esquerda > direita)
+    ordem = [c.desc() for c in chave] if decrescente else chave
+    linhas = consulta.order_by(*ordem).limit(limite + 1).all()
+    proximo = None
+    if len(linhas) > limite:
+        linhas = linhas[:limite]
+        ultima = linhas[-1]
+        proximo = codificar_cursor([getattr(ultima, c.key) for c in chave])
+    return Pagina(linhas, proximo, limite)
@@ -0,0 +1,306 @@
+"""
+Particionamento mensal e retenção da tabela Leitura.
+
+- PostgreSQL: `particionar_leituras()` converte (uma vez) Leitura numa tabela particionada por
+  RANGE (data_hora), com uma partição por mês UTC ("Leitura_pAAAA_MM") e uma partição default para
+  instantes fora das criadas. `garantir_particoes()` cria os meses seguintes com antecedência e
+  a retenção arquiva cada mês antigo (COPY -> CSV gzip) e então desanexa e remove a partição inteira.
+- SQLite/MySQL (ou Postgres ainda não particionado): a retenção grava o mês em CSV gzip em streaming
+  e apaga as linhas em lotes por dispositivo, sempre por intervalo no índice único (dispositivo_id, data_hora).
+
+Os agregados de consumo (ConsumoMinuto/Hora/Dia) não são afetados: relatórios e faturamento de meses
+arquivados continuam disponíveis.
+"""
+import csv
+import gzip
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import text
+from app import app, db
+from app.models.dispositivo_model import Dispositivo, Leitura
+
+TABELA = 'Leitura'
+PARTICAO_DEFAULT = 'Leitura_pdefault'
+# chave do pg_advisory_lock que impede duas réplicas de rodarem a manutenção ao mesmo tempo
+_CHAVE_LOCK = 804202
+
+
+def _mes(dia):
+    return date(dia.year, dia.month, 1)
+
+
+def _somar_meses(mes, n):
+    total = mes.year * 12 + mes.month - 1 + n
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def nome_particao(mes):
+    return f'{TABELA}_p{mes.year:04d}_{mes.month:02d}'
+
+
+def _mes_da_particao(nome):
+    try:
+        ano, mes = nome.rsplit('_p', 1)[1].split('_')
+        return date(int(ano), int(mes), 1)
+    except (IndexError, ValueError):
+        return None
+
+
+def _postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def particionada():
+    """True se Leitura já é uma tabela particionada no Postgres."""
+    if not _postgres():
+        return False
+    return db.session.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:t))"
+    ), {'t': f'"{TABELA}"'}).scalar()
+
+
+def listar_particoes():
+    """[(nome, mês)] das partições mensais anexadas a Leitura, em ordem cronológica (sem a default)."""
+    nomes = db.session.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:t)"
+    ), {'t': f'"{TABELA}"'}).scalars()
+    return sorted((n, m) for n, m in ((n, _mes_da_particao(n)) for n in nomes) if m is not None)
+
+
+def _criar_particao(mes):
+    """Cria a partição do mês (se não existir), movendo para ela linhas que tenham caído na default."""
+    nome = nome_particao(mes)
+    existe = db.session.execute(text('SELECT to_regclass(:n) IS NOT NULL'), {'n': f'"{nome}"'}).scalar()
+    if existe:
+        return False
+    inicio, fim = mes.isoformat(), _somar_meses(mes, 1).isoformat()
+    # A partição não pode ser criada se a default já tem linhas do intervalo: elas são movidas junto
+    db.session.execute(text(
+        f'CREATE TEMP TABLE _leituras_mover ON COMMIT DROP AS SELECT * FROM "{PARTICAO_DEFAULT}" '
+        f"WHERE data_hora >= '{inicio}' AND data_hora < '{fim}'"))
+    db.session.execute(text(
+        f"DELETE FROM \"{PARTICAO_DEFAULT}\" WHERE data_hora >= '{inicio}' AND data_hora < '{fim}'"))
+    db.session.execute(text(
+        f'CREATE TABLE "{nome}" PARTITION OF "{TABELA}" FOR VALUES FROM (\'{inicio}\') TO (\'{fim}\')'))
+    db.session.execute(text(f'INSERT INTO "{TABELA}" SELECT * FROM _leituras_mover'))
+    db.session.execute(text('DROP TABLE _leituras_mover'))
+    return True
+
+
+def garantir_particoes(meses_a_frente=3, hoje=None):
+    """Cria as partições do mês corrente até `meses_a_frente` meses adiante. Retorna as criadas."""
+    mes = _mes(hoje or datetime.now(timezone.utc).date())
+    criadas = []
+    for i in range(meses_a_frente + 1):
+        alvo = _somar_meses(mes, i)
+        if _criar_particao(alvo):
+            criadas.append(nome_particao(alvo))
+    db.session.commit()
+    return criadas
+
+
+def particionar_leituras(meses_a_frente=3):
+    """
+    Converte Leitura numa tabela particionada por mês (somente Postgres; rodar com a ingestão parada).
+
+    A tabela atual vira "Leitura_legado", a nova é criada com a mesma estrutura (chave primária
+    (id_leitura, data_hora), pois o Postgres exige a chave de partição em toda chave única), as
+    partições cobrem do mês mais antigo até `meses_a_frente` adiante e os dados são copiados com um
+    INSERT ... SELECT (cada linha vai para a partição do seu mês), tudo numa única transação. Retorna o número de partições criadas.
+    """
+    if not _postgres():
+        raise RuntimeError('particionamento nativo só é suportado no PostgreSQL (ver README para SQLite/MySQL)')
+    if particionada():
+        return 0
+    s = db.session
+    seq = s.execute(text("SELECT pg_get_serial_sequence(:t, 'id_leitura')"), {'t': f'"{TABELA}"'}).scalar()
+    s.execute(text(f'ALTER TABLE "{TABELA}" RENAME TO "{TABELA}_legado"'))
+    # nomes de constraint/índice são globais no schema: libera os nomes originais para a tabela nova
+    for (conname,) in s.execute(text(
+            "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:t) AND contype IN ('p', 'u', 'f')"),
+            {'t': f'"{TABELA}_legado"'}):
+        s.execute(text(f'ALTER TABLE "{TABELA}_legado" RENAME CONSTRAINT "{conname}" TO "{conname}_legado"'))
+    s.execute(text(
+        f'CREATE TABLE "{TABELA}" (LIKE "{TABELA}_legado" INCLUDING DEFAULTS) PARTITION BY RANGE (data_hora)'))
+    s.execute(text(f'ALTER TABLE "{TABELA}" ADD PRIMARY KEY (id_leitura, data_hora)'))
+    s.execute(text(f'ALTER TABLE "{TABELA}" ADD CONSTRAINT uq_leitura_dispositivo_data_hora '
+                   f'UNIQUE (dispositivo_id, data_hora)'))
+    s.execute(text(f'ALTER TABLE "{TABELA}" ADD FOREIGN KEY (dispositivo_id) '
+                   f'REFERENCES "Dispositivo" (id_dispositivo)'))
+    if seq:
+        # a sequência pertencia à coluna da tabela antiga e seria removida junto com ela
+        s.execute(text(f'ALTER SEQUENCE {seq} OWNED BY "{TABELA}".id_leitura'))
+    s.execute(text(f'CREATE TABLE "{PARTICAO_DEFAULT}" PARTITION OF "{TABELA}" DEFAULT'))
+    menor = s.execute(text(f'SELECT min(data_hora) FROM "{TABELA}_legado"')).scalar()
+    mes = _mes(menor.date()) if menor else _mes(datetime.now(timezone.utc).date())
+    ultimo = _somar_meses(_mes(datetime.now(timezone.utc).date()), meses_a_frente)
+    criadas = 0
+    while mes <= ultimo:
+        criadas += _criar_particao(mes)
+        mes = _somar_meses(mes, 1)
+    s.execute(text(f'INSERT INTO "{TABELA}" SELECT * FROM "{TABELA}_legado"'))
+    s.execute(text(f'DROP TABLE "{TABELA}_legado"'))
+    s.commit()
+    return criadas
+
+
+def _escrever_csv(caminho, colunas, linhas):
+    """Grava as linhas em CSV gzip (arquivo temporário renomeado no fim). Retorna a quantidade gravada."""
+    os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+    temporario = caminho + '.parcial'
+    n = 0
+    with gzip.open(temporario, 'wt', encoding='utf-8', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(colunas)
+        for linha in linhas:
+            w.writerow(linha)
+            n += 1
+    os.replace(temporario, caminho)
+    return n
+
+
+def _arquivar_particao(nome, caminho):
+    """COPY da partição para CSV gzip (psycopg2) ou leitura em streaming; confere a contagem."""
+    esperado = db.session.execute(text(f'SELECT count(*) FROM "{nome}"')).scalar()
+    cursor = db.session.connection().connection.cursor()
+    if hasattr(cursor, 'copy_expert'):
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        with gzip.open(caminho + '.parcial', 'wt', encoding='utf-8', newline='') as f:
+            cursor.copy_expert(f'COPY "{nome}" TO STDOUT WITH (FORMAT csv, HEADER true)', f)
+        os.replace(caminho + '.parcial', caminho)
+        gravadas = esperado
+    else:
+        res = db.session.execute(text(f'SELECT * FROM "{nome}"').execution_options(yield_per=5000))
+        gravadas = _escrever_csv(caminho, list(res.keys()), res)
+    if gravadas != esperado:
+        raise RuntimeError(f'arquivo {caminho} com {gravadas} linhas, partição com {esperado}')
+    return gravadas
+
+
+def _arquivar_e_apagar_mes(mes, caminho, dispositivos_por_lote=50):
+    """Fallback sem partições: exporta o mês em streaming e apaga por intervalo, em lotes de dispositivos."""
+    inicio = datetime.combine(mes, datetime.min.time())
+    fim = datetime.combine(_somar_meses(mes, 1), datetime.min.time())
+    colunas = [c.name for c in Leitura.__table__.columns]
+    consulta = (db.session.query(*Leitura.__table__.columns)
+                .filter(Leitura.data_hora >= inicio, Leitura.data_hora < fim)
+                .order_by(Leitura.dispositivo_id, Leitura.data_hora)
+                .execution_options(yield_per=5000))
+    gravadas = _escrever_csv(caminho, colunas, consulta)
+    ids = [d for (d,) in db.session.query(Dispositivo.id_dispositivo).order_by(Dispositivo.id_dispositivo)]
+    apagadas = 0
+    for i in range(0, len(ids), dispositivos_por_lote):
+        res = db.session.execute(
+            Leitura.__table__.delete().where(Leitura.dispositivo_id.in_(ids[i:i + dispositivos_por_lote]),
+                                             Leitura.data_hora >= inicio, Leitura.data_hora < fim))
+        db.session.commit()
+        apagadas += res.rowcount or 0
+    return gravadas, apagadas
+
+
+def aplicar_retencao(meses_retencao, diretorio, hoje=None, simular=False):
+    """
+    Arquiva (CSV gzip em `diretorio`, um arquivo por mês) e remove as leituras de meses inteiros
+    anteriores aos últimos `meses_retencao` meses. Com `simular`, só lista os meses afetados.
+    Retorna [{'month', 'file', 'rows'}].
+    """
+    if meses_retencao <= 0:
+        return []
+    limite = _somar_meses(_mes(hoje or datetime.now(timezone.utc).date()), -meses_retencao)
+    resultado = []
+    if particionada():
+        for nome, mes in listar_particoes():
+            if mes >= limite:
+                continue
+            caminho = os.path.join(diretorio, f'{nome.lower()}.csv.gz')
+            item = {'month': mes.isoformat()[:7], 'file': caminho, 'rows': None}
+            if not simular:
+                item['rows'] = _arquivar_particao(nome, caminho)
+                db.session.execute(text(f'ALTER TABLE "{TABELA}" DETACH PARTITION "{nome}"'))
+                db.session.execute(text(f'DROP TABLE "{nome}"'))
+                db.session.commit()
+            resultado.append(item)
+        return resultado
+    menor = db.session.query(db.func.min(Leitura.data_hora)).scalar()
+    mes = _mes(menor.date()) if menor else limite
+    while mes < limite:
+        caminho = os.path.join(diretorio, f'{nome_particao(mes).lower()}.csv.gz')
+        item = {'month': mes.isoformat()[:7], 'file': caminho, 'rows': None}
+        if not simular:
+            gravadas, apagadas = _arquivar_e_apagar_mes(mes, caminho)
+            if apagadas != gravadas:
+                print(f'[RETENCAO] {mes:%Y-%m}: {gravadas} linhas arquivadas e {apagadas} apagadas')
+            item['rows'] = gravadas
+        resultado.append(item)
+        mes = _somar_meses(mes, 1)
+    return resultado
+
+
+class ManutencaoLeituras:
+    """
+    Executa periodicamente (a cada `intervalo_horas`) a criação antecipada de partições e a retenção.
+    No Postgres um advisory lock garante uma única réplica por ciclo.
+    """
+
+    def __init__(self, intervalo_horas=24, meses_a_frente=3, meses_retencao=0, diretorio='arquivo'):
+        self.intervalo = float(intervalo_horas) * 3600
+        self.meses_a_frente = int(meses_a_frente)
+        self.meses_retencao = int(meses_retencao)
+        self.diretorio = diretorio
+        self._thread = None
+        self.execucoes = 0
+        self.falhas = 0
+        self.ultima = None
+
+    def executar(self):
+        inicio = time.perf_counter()
+        resumo = {'partitionsCreated': [], 'archived': [], 'skipped': False}
+        with app.app_context():
+            # o advisory lock pertence à conexão: fica numa conexão própria enquanto a sessão faz commits
+            trava = db.engine.connect() if _postgres() else None
+            try:
+                if trava is not None and not trava.execute(
+                        text('SELECT pg_try_advisory_lock(:k)'), {'k': _CHAVE_LOCK}).scalar():
+                    resumo['skipped'] = True
+                else:
+                    if particionada():
+                        resumo['partitionsCreated'] = garantir_particoes(self.meses_a_frente)
+                    resumo['archived'] = aplicar_retencao(self.meses_retencao, self.diretorio)
+            except Exception as e:
+                db.session.rollback()
+                self.falhas += 1
+                resumo['error'] = str(e)
+                print('[RETENCAO] Falha na manutenção de leituras:', e)
+            finally:
+                if trava is not None:
+                    # close() só devolve a conexão ao pool: o lock precisa ser liberado explicitamente
+                    trava.execute(text('SELECT pg_advisory_unlock_all()'))
+                    trava.close()
+        self.execucoes += 1
+        resumo['ms'] = round((time.perf_counter() - inicio) * 1000.0, 1)
+        self.ultima = resumo
+        return resumo
+
+    def iniciar(self):
+        if self._thread is not None or self.intervalo <= 0:
+            return
+        self._thread = threading.Thread(target=self._loop, name='manutencao-leituras', daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            self.executar()
+            time.sleep(self.intervalo)
+
+    def stats(self):
+        return {
+            'intervalHours': self.intervalo / 3600,
+            'monthsAhead': self.meses_a_frente,
+            'retentionMonths': self.meses_retencao,
+            'runs': self.execucoes,
+            'failures': self.falhas,
+            'last': self.ultima,
+        }
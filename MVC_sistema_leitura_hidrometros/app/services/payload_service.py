@@ -0,0 +1,153 @@
+"""
+Decodificação dos payloads de telemetria (JSON ou frame binário compacto).
+
+Frame binário v1 (little-endian), detectado pelo primeiro byte (MAGIC):
+    B  magic (0xB7)
+    B  flags (bit0: serial presente no frame; bit1: lote)
+    [B len + len bytes ASCII]  serial, somente se flags & 0x01
+    [H n]  quantidade de leituras, somente se flags & 0x02 (senão 1)
+    n x (q ts epoch ms, d totalLiters, f flowLmin)
+Sem serial no frame (22 bytes) o serial é o último segmento do tópico,
+ex: hidrometro/<cliente>/bin/<serial>.
+
+Payloads JSON podem trazer um objeto, uma lista de objetos ou NDJSON (um objeto por linha).
+Todas as funções de decodificação devolvem uma lista de leituras brutas.
+"""
+import json
+import struct
+import time
+from threading import Lock
+
+MAGIC = 0xB7
+FLAG_SERIAL = 0x01
+FLAG_LOTE = 0x02
+
+_CABECALHO = struct.Struct('<BB')
+_LEITURA = struct.Struct('<qdf')
+_QTD = struct.Struct('<H')
+
+
+class PayloadInvalido(ValueError):
+    pass
+
+
+def is_binario(payload):
+    return bool(payload) and payload[0] == MAGIC
+
+
+def codificar_binario(ts, total_liters, flow_lmin, serial=None):
+    """Gera um frame binário v1 com uma leitura (usado por simuladores/testes)."""
+    return codificar_binario_lote([(ts, total_liters, flow_lmin)], serial)
+
+
+def codificar_binario_lote(leituras, serial=None):
+    """Gera um frame binário v1 com várias leituras [(ts, total, flow), ...] de um mesmo serial."""
+    flags = FLAG_LOTE if len(leituras) != 1 else 0
+    partes = []
+    if serial:
+        s = str(serial).encode('ascii')
+        if len(s) > 255:
+            raise PayloadInvalido('serial muito longo')
+        flags |= FLAG_SERIAL
+        partes.append(bytes((len(s),)) + s)
+    if flags & FLAG_LOTE:
+        partes.append(_QTD.pack(len(leituras)))
+    partes.extend(_LEITURA.pack(int(ts), float(total), float(flow)) for ts, total, flow in leituras)
+    return _CABECALHO.pack(MAGIC, flags) + b''.join(partes)
+
+
+def serial_do_frame(payload):
+    """Serial embutido no frame binário (bytes) ou None. Não valida o restante do frame."""
+    if len(payload) > 3 and payload[1] & FLAG_SERIAL:
+        return payload[3:3 + payload[2]]
+    return None
+
+
+def _serial_do_topico(topic):
+    if not topic:
+        return None
+    ultimo = topic.rstrip('/').rsplit('/', 1)[-1]
+    return ultimo or None
+
+
+def decodificar_binario(payload, topic=None):
+    try:
+        _, flags = _CABECALHO.unpack_from(payload, 0)
+        pos = _CABECALHO.size
+        serial = None
+        if flags & FLAG_SERIAL:
+            n = payload[pos]
+            serial = payload[pos + 1:pos + 1 + n].decode('ascii')
+            pos += 1 + n
+        qtd = 1
+        if flags & FLAG_LOTE:
+            qtd, = _QTD.unpack_from(payload, pos)
+            pos += _QTD.size
+        if len(payload) < pos + qtd * _LEITURA.size:
+            raise PayloadInvalido(f'frame binário truncado ({len(payload)} bytes para {qtd} leituras)')
+        registros = [_LEITURA.unpack_from(payload, pos + i * _LEITURA.size) for i in range(qtd)]
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise PayloadInvalido(f'frame binário inválido: {e}')
+    serial = serial or _serial_do_topico(topic)
+    # flow trafega como float32: arredonda para a escala da coluna (3 casas) e evita ruído de precisão
+    return [{'ts': ts, 'totalLiters': total, 'flowLmin': round(flow, 3), 'numeroSerie': serial}
+            for ts, total, flow in registros]
+
+
+def decodificar_json(payload):
+    try:
+        obj = json.loads(payload)
+    except (ValueError, UnicodeDecodeError) as e:
+        if b'\n' not in payload:
+            raise PayloadInvalido(f'JSON parse falhou: {e}')
+        # NDJSON: um objeto por linha
+        try:
+            return [json.loads(linha) for linha in payload.splitlines() if linha.strip()]
+        except (ValueError, UnicodeDecodeError) as e2:
+            raise PayloadInvalido(f'NDJSON parse falhou: {e2}')
+    return obj if isinstance(obj, list) else [obj]
+
+
+class MedidorDecodificacao:
+    """Acumula quantidade de mensagens/leituras, bytes e tempo de decodificação por formato (json / bin)."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._dados = {}
+
+    def registrar(self, formato, n_bytes, n_leituras, dur_ns):
+        with self._lock:
+            d = self._dados.setdefault(formato, [0, 0, 0, 0])
+            d[0] += 1
+            d[1] += n_bytes
+            d[2] += n_leituras
+            d[3] += dur_ns
+
+    def stats(self):
+        with self._lock:
+            return {
+                fmt: {
+                    'messages': n,
+                    'readings': r,
+                    'avgBytes': round(b / n, 1) if n else 0,
+                    'avgDecodeUs': round(ns / n / 1000.0, 3) if n else 0,
+                    'avgDecodeUsPerReading': round(ns / r / 1000.0, 3) if r else 0,
+                }
+                for fmt, (n, b, r, ns) in self._dados.items()
+            }
+
+
+medidor_decodificacao = MedidorDecodificacao()
+
+
+def decodificar_payload(topic, payload):
+    """Detecta o formato pelo primeiro byte e devolve a lista de leituras brutas (aliases ainda não normalizados)."""
+    inicio = time.perf_counter_ns()
+    if is_binario(payload):
+        formato = 'bin'
+        leituras = decodificar_binario(payload, topic)
+    else:
+        formato = 'json'
+        leituras = decodificar_json(payload)
+    medidor_decodificacao.registrar(formato, len(payload), len(leituras), time.perf_counter_ns() - inicio)
+    return leituras
@@ -0,0 +1,155 @@
+"""
+Motor de tarifação: tarifas escalonadas por faixa de consumo, com vigência por data.
+
+- TabelaPrecos pré-calcula, para uma tarifa, o início de cada faixa (m³) e o custo acumulado até ele;
+  o preço de um consumo é uma busca binária e uma multiplicação, em Decimal exato.
+- IndiceTarifas carrega as tarifas ativas (com as faixas) uma única vez por execução do faturamento e
+  resolve data -> tarifa vigente por busca binária nos intervalos de vigência.
+- Se a tarifa muda dentro do mês, o valor é proporcional aos dias de cada vigência (pro rata die):
+  o consumo do mês é precificado em cada tarifa e ponderado pelos dias em que ela vigorou.
+"""
+from bisect import bisect_right
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from datetime import timedelta
+from sqlalchemy.orm import selectinload
+from app.models.faturamento_model import Tarifa
+
+CENTAVOS = Decimal('0.01')
+_MIL = Decimal('1000')
+
+
+def _decimal(texto):
+    try:
+        return Decimal(texto.strip().replace(',', '.'))
+    except InvalidOperation:
+        raise ValueError(f'número inválido: {texto!r}')
+
+
+def interpretar_faixas(texto):
+    """
+    Converte '10:4,50; 20:6,80; :12,00' (limite em m³ : valor por m³; limite vazio = sem limite)
+    em [(Decimal('10'), Decimal('4.50')), ..., (None, Decimal('12.00'))]. ValueError se inválido.
+    """
+    faixas = []
+    for parte in (texto or '').replace('\n', ';').split(';'):
+        parte = parte.strip()
+        if not parte:
+            continue
+        limite, sep, valor = parte.partition(':')
+        if not sep:
+            raise ValueError(f'faixa sem ":" ({parte})')
+        limite = _decimal(limite) if limite.strip() else None
+        valor = _decimal(valor)
+        if valor < 0 or (limite is not None and limite <= 0):
+            raise ValueError(f'faixa inválida ({parte})')
+        if faixas and (faixas[-1][0] is None or (limite is not None and limite <= faixas[-1][0])):
+            raise ValueError('os limites das faixas devem ser crescentes e só a última pode ser sem limite')
+        faixas.append((limite, valor))
+    return faixas
+
+
+def formatar_faixas(faixas):
+    """Inverso de `interpretar_faixas` (para preencher o formulário de edição)."""
+    def numero(valor):
+        return '' if valor is None else f'{Decimal(valor).normalize():f}'.replace('.', ',')
+    return '; '.join(f'{numero(f.limite_m3)}:{numero(f.valor_m3)}' for f in faixas)
+
+
+class TabelaPrecos:
+    """Faixas de uma tarifa prontas para precificação (consumo acima da última faixa usa o valor dela)."""
+    __slots__ = ('tarifa_id', 'nome', 'inicios', 'acumulados', 'valores')
+
+    def __init__(self, tarifa_id, nome, faixas):
+        self.tarifa_id = tarifa_id
+        self.nome = nome
+        self.inicios, self.acumulados, self.valores = [], [], []
+        inicio = acumulado = Decimal('0')
+        for limite, valor in faixas:
+            self.inicios.append(inicio)
+            self.acumulados.append(acumulado)
+            self.valores.append(Decimal(valor))
+            if limite is None:
+                break
+            acumulado += (Decimal(limite) - inicio) * Decimal(valor)
+            inicio = Decimal(limite)
+
+    @classmethod
+    def de_tarifa(cls, tarifa):
+        faixas = [(f.limite_m3, f.valor_m3) for f in tarifa.faixas] or [(None, tarifa.valor_m3)]
+        return cls(tarifa.id_tarifa, tarifa.nome_tarifa, faixas)
+
+    def preco(self, m3):
+        """Valor (Decimal, sem arredondar) de `m3` metros cúbicos."""
+        k = max(0, bisect_right(self.inicios, m3) - 1)
+        return self.acumulados[k] + (m3 - self.inicios[k]) * self.valores[k]
+
+
+class IndiceTarifas:
+    """Intervalos de vigência das tarifas ativas, ordenados pelo início, para resolver data -> tarifa."""
+
+    def __init__(self, tarifas):
+        itens = sorted(((t.data_inicio, t.data_fim, TabelaPrecos.de_tarifa(t)) for t in tarifas),
+                       key=lambda item: (item[0], item[2].tarifa_id))
+        self._itens = itens
+        self._inicios = [inicio for inicio, _, _ in itens]
+
+    @classmethod
+    def carregar(cls):
+        """Uma consulta para as tarifas ativas e outra para todas as faixas (requer app context)."""
+        return cls(Tarifa.query.options(selectinload(Tarifa.faixas)).filter(Tarifa.ativa.is_(True)).all())
+
+    def __len__(self):
+        return len(self._itens)
+
+    def vigente(self, dia):
+        """TabelaPrecos em vigor no dia (a de início mais recente, se houver sobreposição) ou None."""
+        k = bisect_right(self._inicios, dia)
+        while k > 0:
+            k -= 1
+            _, fim, tabela = self._itens[k]
+            if fim is None or fim >= dia:
+                return tabela
+        return None
+
+    def segmentos(self, inicio, fim):
+        """[(TabelaPrecos, dias)] cobrindo [inicio, fim), com dias consecutivos da mesma tarifa juntos."""
+        cortes = {inicio, fim}
+        for ini, f, _ in self._itens:
+            for d in (ini, f + timedelta(days=1) if f else None):
+                if d is not None and inicio < d < fim:
+                    cortes.add(d)
+        cortes = sorted(cortes)
+        segmentos = []
+        for a, b in zip(cortes, cortes[1:]):
+            tabela = self.vigente(a)
+            if tabela is None:
+                continue
+            if segmentos and segmentos[-1][0] is tabela:
+                segmentos[-1][1] += (b - a).days
+            else:
+                segmentos.append([tabela, (b - a).days])
+        return [(tabela, dias) for tabela, dias in segmentos]
+
+
+def precificar_lote(litros, segmentos):
+    """
+    Valores (Decimal, 2 casas) para uma sequência de consumos em litros no período dos `segmentos`.
+    Vários segmentos: média dos preços de cada tarifa ponderada pelos dias de vigência. Sem tarifa: None.
+    """
+    if not segmentos:
+        return [None] * len(litros)
+    dias_total = sum(dias for _, dias in segmentos)
+    cache = {}
+    valores = []
+    for l in litros:
+        valor = cache.get(l)
+        if valor is None:
+            m3 = Decimal(str(l)) / _MIL
+            if len(segmentos) == 1:
+                bruto = segmentos[0][0].preco(m3)
+            else:
+                # uma única divisão no fim: soma(preço x dias) / dias do período
+                bruto = sum(tabela.preco(m3) * dias for tabela, dias in segmentos) / dias_total
+            valor = cache[l] = bruto.quantize(CENTAVOS, rounding=ROUND_HALF_UP)
+        valores.append(valor)
+    return valores
@@ -0,0 +1,166 @@
+"""
+Salas (rooms) Socket.IO usadas para direcionar os eventos de tempo real.
+
+- frota: visão geral (dashboard / controle), recebe todas as leituras e alertas;
+- cliente:<id>: dispositivos de um cliente (tela Tempo Real do cliente);
+- serial:<NUMERO_SERIE>: um dispositivo específico.
+
+Cada conexão entra nas salas pedidas no handshake (`auth` do socket.io-client):
+{cliente_id: 3} e/ou {serials: ['ABC', 'DEF']}. Sem filtro, entra em `frota`.
+
+As leituras não são emitidas uma a uma: o AgendadorEmissoes junta as atualizações de cada
+sala durante um tick e envia um único frame 'data' por sala.
+"""
+import threading
+import time
+
+SALA_FROTA = 'frota'
+
+
+def sala_cliente(cliente_id):
+    return f'cliente:{int(cliente_id)}'
+
+
+def sala_serial(numero_serie):
+    return f'serial:{str(numero_serie).strip().upper()}'
+
+
+def salas_da_conexao(auth):
+    """Salas pedidas no handshake; dados inválidos são ignorados (cai em `frota`)."""
+    salas = []
+    if isinstance(auth, dict):
+        cliente_id = auth.get('cliente_id')
+        if cliente_id is not None:
+            try:
+                salas.append(sala_cliente(cliente_id))
+            except (TypeError, ValueError):
+                pass
+        serials = auth.get('serials') or auth.get('serial') or []
+        if isinstance(serials, str):
+            serials = serials.split(',')
+        if isinstance(serials, list):
+            salas.extend(sala_serial(s) for s in serials[:100] if isinstance(s, str) and s.strip())
+    return salas or [SALA_FROTA]
+
+
+def salas_do_dispositivo(numero_serie, dispositivo=None):
+    """Salas interessadas num serial: a do serial e, se o dispositivo é conhecido, a do cliente."""
+    salas = []
+    if numero_serie:
+        salas.append(sala_serial(numero_serie))
+    if dispositivo is not None and dispositivo.cliente_id is not None:
+        salas.append(sala_cliente(dispositivo.cliente_id))
+    return salas
+
+
+class AgendadorEmissoes:
+    """
+    Agrupa as leituras destinadas a cada sala e emite um frame por sala a cada `tick_ms`.
+
+    Por sala guarda só a última leitura de cada serial e os `max_pontos` pontos mais recentes
+    por serial (0 = nenhum); atualizações intermediárias que não cabem são descartadas e contadas.
+    O frame 'data' mantém o formato de um evento de leitura (campos da última leitura no topo),
+    com `devices` (última leitura de cada serial) e, opcionalmente, `points`.
+    `emitir(evento, payload, sala)` faz o envio efetivo (ex: socketio.emit).
+    """
+
+    def __init__(self, emitir, tick_ms=250, max_pontos=20):
+        self.emitir = emitir
+        self.tick = max(10, int(tick_ms)) / 1000.0
+        self.max_pontos = max(0, int(max_pontos))
+        self._pendentes = {}  # sala -> {serial: [ultima, pontos]}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._inicio = None
+        self.recebidas = 0
+        self.descartadas = 0
+        self.frames = 0
+        self.ticks = 0
+        self.falhas = 0
+        self.ultimo_tick_ms = 0.0
+
+    def publicar(self, salas, leituras):
+        """Acumula leituras normalizadas para as salas indicadas (não bloqueia no envio)."""
+        if self._thread is None:
+            self.iniciar()
+        with self._lock:
+            for sala in salas:
+                por_serial = self._pendentes.setdefault(sala, {})
+                for d in leituras:
+                    self.recebidas += 1
+                    serial = d.get('numero_serie') or ''
+                    item = por_serial.get(serial)
+                    if item is None:
+                        por_serial[serial] = [d, [d] if self.max_pontos else None]
+                        continue
+                    item[0] = d
+                    if self.max_pontos:
+                        item[1].append(d)
+                        if len(item[1]) <= self.max_pontos:
+                            continue
+                        del item[1][0]
+                    self.descartadas += 1
+
+    def iniciar(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._inicio = time.monotonic()
+            self._thread = threading.Thread(target=self._loop, name='tempo-real-emissor', daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.tick)
+            try:
+                self.despachar()
+            except Exception as e:
+                self.falhas += 1
+                print('[REALTIME] Falha no tick:', e)
+
+    def _frame(self, por_serial):
+        itens = list(por_serial.values())
+        frame = dict(itens[-1][0])
+        if len(itens) > 1:
+            frame['devices'] = [ultima for ultima, _ in itens]
+        if self.max_pontos:
+            pontos = [{'ts': p['ts'], 'totalLiters': p['totalLiters'], 'flowLmin': p['flowLmin'],
+                       'numero_serie': p.get('numero_serie')} for _, lista in itens for p in lista]
+            if len(pontos) > 1:
+                pontos.sort(key=lambda p: p['ts'])
+                frame['points'] = pontos
+        return frame
+
+    def despachar(self):
+        """Emite um frame por sala com o que foi acumulado desde o último tick."""
+        with self._lock:
+            pendentes, self._pendentes = self._pendentes, {}
+        if not pendentes:
+            return 0
+        inicio = time.perf_counter()
+        for sala, por_serial in pendentes.items():
+            try:
+                self.emitir('data', self._frame(por_serial), sala)
+                self.frames += 1
+            except Exception:
+                self.falhas += 1
+        self.ticks += 1
+        self.ultimo_tick_ms = (time.perf_counter() - inicio) * 1000.0
+        return len(pendentes)
+
+    def stats(self):
+        decorrido = time.monotonic() - self._inicio if self._inicio else 0
+        with self._lock:
+            pendentes = len(self._pendentes)
+        return {
+            'tickMs': int(self.tick * 1000),
+            'maxPointsPerSerial': self.max_pontos,
+            'updates': self.recebidas,
+            'droppedIntermediate': self.descartadas,
+            'frames': self.frames,
+            'framesPerSecond': round(self.frames / decorrido, 2) if decorrido else 0,
+            'ticks': self.ticks,
+            'lastTickMs': round(self.ultimo_tick_ms, 3),
+            'pendingRooms': pendentes,
+            'failures': self.falhas,
+        }
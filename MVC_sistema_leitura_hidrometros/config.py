@@ -49,13 +49,109 @@ class Config:
     MQTT_URL = os.environ.get('MQTT_URL', 'mqtt://broker.hivemq.com:1883')
     MQTT_TOPIC_DADOS = os.environ.get('MQTT_TOPIC_DADOS', 'hidrometro/leandro/dados')
     MQTT_TOPIC_CMD = os.environ.get('MQTT_TOPIC_CMD', 'hidrometro/leandro/cmd')
+    # Frames binários publicados em <base>/bin/<serial> (<base> = dois primeiros segmentos de MQTT_TOPIC_DADOS);
+    # assinado também com shared subscription. Vazio desativa
+    MQTT_TOPIC_BIN = os.environ.get('MQTT_TOPIC_BIN', '/'.join(MQTT_TOPIC_DADOS.split('/')[:2]) + '/bin/+')
+    # Escala horizontal: grupo de shared subscription MQTT v5 ($share/<grupo>/<tópico>).
+    # Com grupo definido cada mensagem é entregue a uma única réplica do grupo, sem afinidade por serial:
+    # detecção (janelas de vazamento), histórico em memória e deduplicação recente são por processo e
+    # cada réplica vê só parte das leituras de um medidor. Para consistência por serial use INGEST_PARTITIONS.
+    MQTT_SHARED_GROUP = os.environ.get('MQTT_SHARED_GROUP', '')
+    # Escala por partição de serial: INGEST_PARTITIONS réplicas, cada uma com INGEST_PARTITION = 0..N-1.
+    # Todas assinam os tópicos diretamente e cada uma processa só os seriais da sua partição (prevalece
+    # sobre MQTT_SHARED_GROUP). Cada réplica recebe todo o tráfego MQTT.
+    INGEST_PARTITIONS = int(os.environ.get('INGEST_PARTITIONS', '1'))
+    INGEST_PARTITION = int(os.environ.get('INGEST_PARTITION', '0'))
+    MQTT_PROTOCOL = os.environ.get('MQTT_PROTOCOL', '3.1.1')  # 3.1.1 ou 5
+    # Papel do processo: all (HTTP + ingestão), ingest (assina dados MQTT) ou web (só HTTP/Socket.IO)
+    APP_ROLE = os.environ.get('APP_ROLE', 'all')
+    # Fila compartilhada do Socket.IO (ex: redis://redis:6379/0) para que emits feitos pelas
+    # réplicas de ingestão cheguem aos navegadores conectados nas réplicas web
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE', '')
+    # Emissão em tempo real agrupada: um frame por sala a cada REALTIME_TICK_MS (0 = emite cada leitura na hora)
+    # com a última leitura de cada serial e até REALTIME_MAX_POINTS pontos intermediários por serial
+    REALTIME_TICK_MS = int(os.environ.get('REALTIME_TICK_MS', '250'))
+    REALTIME_MAX_POINTS = int(os.environ.get('REALTIME_MAX_POINTS', '20'))
     # Serial padrão opcional (usado se payload MQTT não trouxer numeroSerie)
     DEFAULT_DEVICE_SERIAL = os.environ.get('DEFAULT_DEVICE_SERIAL')
     DEFAULT_DEVICE_CLIENT_ID = os.environ.get('DEFAULT_DEVICE_CLIENT_ID')
     # Vazamento: fluxo acima do limiar por leitura já aciona (simples)
     LEAK_FLOW_THRESHOLD = float(os.environ.get('LEAK_FLOW_THRESHOLD', '0.2'))  # L/min
-    # Futuro: poderíamos exigir duração mínima (não usado ainda)
+    # Duração mínima (s) do fluxo acima do limiar para abrir o alerta de vazamento
     LEAK_MIN_SECONDS = int(os.environ.get('LEAK_MIN_SECONDS', '0'))
+    # Regras de anomalia avaliadas a cada leitura (ver app/services/deteccao_service.py). Padrão: só vazamento;
+    # as demais (night_flow, burst, zero_flow, reverse_counter) são ativadas listando-as aqui
+    DETECTION_RULES = os.environ.get('DETECTION_RULES', 'leak')
+    # Fluxo noturno: fluxo >= limiar sem interrupção por NIGHT_FLOW_MIN_SECONDS entre as horas locais indicadas
+    NIGHT_FLOW_THRESHOLD = float(os.environ.get('NIGHT_FLOW_THRESHOLD', '0.1'))
+    NIGHT_FLOW_MIN_SECONDS = int(os.environ.get('NIGHT_FLOW_MIN_SECONDS', '3600'))
+    NIGHT_START_HOUR = int(os.environ.get('NIGHT_START_HOUR', '0'))
+    NIGHT_END_HOUR = int(os.environ.get('NIGHT_END_HOUR', '5'))
+    DETECTION_TZ_OFFSET_HOURS = float(os.environ.get('DETECTION_TZ_OFFSET_HOURS', '-3'))
+    # Rajada: vazão instantânea (L/min) que indica rompimento
+    BURST_FLOW_THRESHOLD = float(os.environ.get('BURST_FLOW_THRESHOLD', '30'))
+    # Medidor parado: sem fluxo nem avanço do total por este tempo (s) após já ter registrado consumo
+    ZERO_FLOW_MIN_SECONDS = int(os.environ.get('ZERO_FLOW_MIN_SECONDS', '86400'))
+    # Contador reverso: queda do total acumulado acima desta tolerância (L)
+    REVERSE_COUNTER_TOLERANCE = float(os.environ.get('REVERSE_COUNTER_TOLERANCE', '0.5'))
+    # Checkpoint do estado das regras na tabela EstadoDeteccao a cada N segundos (0 = somente em memória).
+    # DETECTION_SHARED_STATE=1: cada checkpoint também adota estados mais novos gravados por outros processos
+    DETECTION_CHECKPOINT_SECONDS = int(os.environ.get('DETECTION_CHECKPOINT_SECONDS', '30'))
+    DETECTION_SHARED_STATE = os.environ.get('DETECTION_SHARED_STATE', '0') == '1'
+    # Agregados de consumo (ConsumoMinuto/Hora/Dia): parciais da ingestão gravados a cada N segundos (0 = desativa)
+    # Dias locais dos agregados diários usam ROLLUP_TZ_OFFSET_HOURS (padrão: mesmo fuso da detecção)
+    ROLLUP_FLUSH_SECONDS = int(os.environ.get('ROLLUP_FLUSH_SECONDS', '10'))
+    ROLLUP_TZ_OFFSET_HOURS = float(os.environ.get('ROLLUP_TZ_OFFSET_HOURS', os.environ.get('DETECTION_TZ_OFFSET_HOURS', '-3')))
+    # Manutenção da tabela Leitura a cada N horas (0 = só pela CLI): partições mensais criadas com
+    # LEITURA_PARTITION_MONTHS_AHEAD meses de antecedência (Postgres particionado) e retenção de
+    # LEITURA_RETENTION_MONTHS meses (0 = mantém tudo); meses mais antigos vão para CSV gzip em LEITURA_ARCHIVE_DIR
+    LEITURA_MAINTENANCE_HOURS = float(os.environ.get('LEITURA_MAINTENANCE_HOURS', '24'))
+    LEITURA_PARTITION_MONTHS_AHEAD = int(os.environ.get('LEITURA_PARTITION_MONTHS_AHEAD', '3'))
+    LEITURA_RETENTION_MONTHS = int(os.environ.get('LEITURA_RETENTION_MONTHS', '0'))
+    LEITURA_ARCHIVE_DIR = os.environ.get('LEITURA_ARCHIVE_DIR', str(Path(__file__).parent / 'instance' / 'arquivo_leituras'))
 
-    # Limite de histórico em memória
+    # DEBUG_QUERY_COUNT=1: cada resposta HTTP traz X-Query-Count (consultas SQL da requisição), para achar N+1
+    DEBUG_QUERY_COUNT = os.environ.get('DEBUG_QUERY_COUNT', '0') == '1'
+    # Paginação das listagens (clientes, dispositivos, leituras, consumos mensais): itens por página
+    PAGE_SIZE_DEFAULT = int(os.environ.get('PAGE_SIZE_DEFAULT', '50'))
+    PAGE_SIZE_MAX = int(os.environ.get('PAGE_SIZE_MAX', '500'))
+
+    # Limite de histórico em memória (leituras por dispositivo) e orçamento total em MB
     HISTORY_LIMIT = int(os.environ.get('HISTORY_LIMIT', '1000'))
+    HISTORY_MEMORY_MB = int(os.environ.get('HISTORY_MEMORY_MB', '64'))
+    # Máximo de pontos devolvidos por /api/history e /api/history/range quando `points` é usado (downsampling)
+    HISTORY_MAX_POINTS = int(os.environ.get('HISTORY_MAX_POINTS', '2000'))
+
+    # Ingestão write-behind: leituras são agrupadas e gravadas em lote
+    # a cada INGEST_BATCH_SIZE linhas ou INGEST_FLUSH_MS milissegundos (o que vier primeiro)
+    INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', '500'))
+    INGEST_FLUSH_MS = int(os.environ.get('INGEST_FLUSH_MS', '1000'))
+    INGEST_MAX_QUEUE = int(os.environ.get('INGEST_MAX_QUEUE', '50000'))
+    # Lote com gravação falha volta à fila e é retentado com espera exponencial a partir de INGEST_RETRY_BACKOFF_MS;
+    # após INGEST_RETRY_MAX retentativas seguidas é descartado (contado em failed)
+    INGEST_RETRY_MAX = int(os.environ.get('INGEST_RETRY_MAX', '5'))
+    INGEST_RETRY_BACKOFF_MS = int(os.environ.get('INGEST_RETRY_BACKOFF_MS', '500'))
+    # Quantidade de chaves (serial, ts) recentes lembradas para descartar leituras duplicadas
+    DEDUP_RECENT_KEYS = int(os.environ.get('DEDUP_RECENT_KEYS', '100000'))
+    # ts das leituras (epoch ms ou s) fora de [agora - INGEST_TS_MAX_PAST_DAYS, agora + INGEST_TS_MAX_FUTURE_SECONDS]
+    # é trocado pelo instante de recebimento (relógio do dispositivo não sincronizado)
+    INGEST_TS_MAX_PAST_DAYS = float(os.environ.get('INGEST_TS_MAX_PAST_DAYS', '30'))
+    INGEST_TS_MAX_FUTURE_SECONDS = float(os.environ.get('INGEST_TS_MAX_FUTURE_SECONDS', '3600'))
+
+    # Cache numero_serie -> dispositivo na ingestão (TTL em segundos; negativo = serial desconhecido)
+    DEVICE_CACHE_SIZE = int(os.environ.get('DEVICE_CACHE_SIZE', '10000'))
+    DEVICE_CACHE_TTL = int(os.environ.get('DEVICE_CACHE_TTL', '300'))
+    DEVICE_CACHE_NEGATIVE_TTL = int(os.environ.get('DEVICE_CACHE_NEGATIVE_TTL', '30'))
+
+    # Pool de workers que processa as mensagens MQTT fora da thread do paho
+    # Política de overflow da fila: block, drop-oldest ou spill (grava em INGEST_SPILL_PATH)
+    INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', '4'))
+    INGEST_WORKER_QUEUE = int(os.environ.get('INGEST_WORKER_QUEUE', '10000'))
+    INGEST_OVERFLOW_POLICY = os.environ.get('INGEST_OVERFLOW_POLICY', 'block')
+    INGEST_SPILL_PATH = os.environ.get('INGEST_SPILL_PATH', str(Path(__file__).parent / 'instance' / 'ingest_spill.ndjson'))
+
+    # Logging (DEBUG inclui as leituras recebidas, amostradas 1 a cada LOG_SAMPLE_EVERY por serial)
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_SAMPLE_EVERY = int(os.environ.get('LOG_SAMPLE_EVERY', '100'))
+    LOG_RATE_PER_SEC = float(os.environ.get('LOG_RATE_PER_SEC', '10'))
+    LOG_SUMMARY_SECONDS = float(os.environ.get('LOG_SUMMARY_SECONDS', '60'))
@@ -0,0 +1,60 @@
+"""
+Fixtures dos testes: a aplicação real sobre um SQLite temporário, sem ingestão nem broker.
+
+config.py lê o ambiente no import do pacote `app`, então as variáveis são definidas antes dele.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+from contextlib import contextmanager
+from sqlalchemy import event
+
+_DIR_TESTES = tempfile.mkdtemp(prefix='hidrometros-testes-')
+os.environ['DB_ENGINE'] = 'sqlite'
+os.environ['SQLITE_PATH'] = str(Path(_DIR_TESTES) / 'app.db')
+os.environ['APP_ROLE'] = 'web'                      # sem gravação em lote, detecção e agregados
+os.environ['MQTT_URL'] = 'mqtt://127.0.0.1:1'       # broker inexistente: a conexão falha em segundo plano
+os.environ['LEITURA_MAINTENANCE_HOURS'] = '0'
+os.environ.pop('DEBUG_QUERY_COUNT', None)
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app import app as flask_app, db  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    """Aplicação com o banco vazio a cada teste (tabelas recriadas)."""
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def contar_consultas(app):
+    """Conta as instruções SQL emitidas dentro do bloco: `with contar_consultas() as n: ...; n[0]`."""
+    @contextmanager
+    def contador():
+        n = [0]
+
+        def _contar(conn, cursor, statement, parameters, context, executemany):
+            n[0] += 1
+
+        event.listen(db.engine, 'before_cursor_execute', _contar)
+        try:
+            yield n
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', _contar)
+    return contador
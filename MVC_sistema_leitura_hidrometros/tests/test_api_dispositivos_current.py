@@ -0,0 +1,42 @@
+"""
+GET /api/dispositivos/current paginado: `limit` é validado e limitado uma vez, e a URL `next` usa o
+mesmo valor da consulta.
+"""
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from app import db, create_token
+from app.models.cliente_model import Cliente
+from app.models.dispositivo_model import Dispositivo
+from app.services.dispositivo_service import LIMITE_PAGINA_ATUAIS
+
+_N = LIMITE_PAGINA_ATUAIS + 5
+
+
+@pytest.fixture
+def autenticado(client):
+    cliente = Cliente(nome='Cliente')
+    db.session.add(cliente)
+    db.session.flush()
+    db.session.add_all([Dispositivo(modelo='HX', numero_serie=f'SERIE{i:05d}', cliente_id=cliente.id_cliente)
+                        for i in range(_N)])
+    db.session.commit()
+    cabecalhos = {'Authorization': f"Bearer {create_token('teste', 'admin')}"}
+    return lambda url: client.get(url, headers=cabecalhos)
+
+
+def test_limit_acima_do_maximo_e_limitado_na_pagina_e_no_next(autenticado):
+    resposta = autenticado(f'/api/dispositivos/current?limit={LIMITE_PAGINA_ATUAIS * 10}')
+    assert resposta.status_code == 200
+    corpo = resposta.get_json()
+    assert len(corpo['dispositivos']) == LIMITE_PAGINA_ATUAIS
+    assert parse_qs(urlsplit(corpo['next']).query)['limit'] == [str(LIMITE_PAGINA_ATUAIS)]
+    seguinte = autenticado(corpo['next']).get_json()
+    assert len(seguinte['dispositivos']) == _N - LIMITE_PAGINA_ATUAIS
+    assert seguinte['next'] is None
+
+
+@pytest.mark.parametrize('limite', ['0', '-3', 'abc'])
+def test_limit_invalido_retorna_400(autenticado, limite):
+    assert autenticado(f'/api/dispositivos/current?limit={limite}').status_code == 400
@@ -0,0 +1,55 @@
+"""
+Listagens sem N+1: o número de consultas de uma página não depende de quantas linhas ela tem.
+
+dispositivos.html acessa cliente e tipo_dispositivo de cada dispositivo; consumos_mensais.html acessa
+cliente e tarifa_aplicada de cada consumo. Os serviços de listagem carregam essas relações junto.
+"""
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from app import db
+from app.models.cliente_model import Cliente
+from app.models.dispositivo_model import Dispositivo, TipoDispositivo
+from app.models.faturamento_model import Tarifa, ConsumoMensal
+
+
+def _popular(n, inicio=0):
+    """n clientes, cada um com um dispositivo (tipos e tarifas distintos) e um consumo mensal."""
+    for i in range(inicio, inicio + n):
+        cliente = Cliente(nome=f'Cliente {i}')
+        tipo = TipoDispositivo(nome_tipo=f'Tipo {i}')
+        tarifa = Tarifa(nome_tarifa=f'Tarifa {i}', valor_m3=Decimal('5.00'), data_inicio=date(2025, 1, 1))
+        db.session.add_all([cliente, tipo, tarifa])
+        db.session.flush()
+        db.session.add(Dispositivo(modelo='HX', numero_serie=f'SERIE{i:04d}', cliente_id=cliente.id_cliente,
+                                   tipo_dispositivo_id=tipo.id_tipo_dispositivo))
+        db.session.add(ConsumoMensal(cliente_id=cliente.id_cliente, mes_referencia=date(2025, 1, 1),
+                                     litros_consumidos=Decimal('1000.00'), valor_estimado=Decimal('5.00'),
+                                     tarifa_aplicada_id=tarifa.id_tarifa))
+    db.session.commit()
+    db.session.remove()  # nada em cache na sessão: a página carrega tudo do banco
+
+
+def _consultas_da_pagina(client, contar_consultas, url):
+    with contar_consultas() as n:
+        resposta = client.get(url)
+    assert resposta.status_code == 200
+    return n[0], resposta.get_data(as_text=True)
+
+
+@pytest.mark.parametrize('url, marcador', [
+    ('/dispositivos', 'SERIE00'),
+    ('/consumos_mensais', 'Cliente '),
+])
+def test_consultas_constantes_por_pagina(app, client, contar_consultas, url, marcador):
+    _popular(5)
+    poucas, html = _consultas_da_pagina(client, contar_consultas, url)
+    assert html.count(marcador) >= 5
+
+    _popular(35, inicio=5)  # 40 linhas, ainda dentro de uma página (PAGE_SIZE_DEFAULT)
+    muitas, html = _consultas_da_pagina(client, contar_consultas, url)
+    assert html.count(marcador) >= 40
+
+    assert muitas == poucas
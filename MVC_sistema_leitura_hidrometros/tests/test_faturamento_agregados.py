@@ -0,0 +1,57 @@
+"""
+Faturamento com recálculo dos agregados: parciais de um lote atrasado ainda em memória no
+AgregadorConsumo não podem somar em dobro sobre o dia refeito a partir de Leitura.
+"""
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import func
+
+from app import db
+from app.models.agregado_model import ConsumoDia
+from app.models.cliente_model import Cliente
+from app.models.dispositivo_model import Dispositivo, Leitura
+from app.models.faturamento_model import ConsumoMensal
+from app.services.agregacao_service import AgregadorConsumo
+from app.services.faturamento_service import gerar_faturamento_mensal
+
+
+def _gravar_lote(dispositivo_id, leituras):
+    """Grava as leituras (data_hora, total) em Leitura como o EscritorLeituras faria."""
+    lote = [{'dispositivo_id': dispositivo_id, 'data_hora': dh, 'consumo_litros': Decimal(total),
+             'total_liters': Decimal(total), 'flow_lmin': Decimal('1.0')} for dh, total in leituras]
+    db.session.execute(Leitura.__table__.insert(), lote)
+    db.session.commit()
+    return lote
+
+
+def _consumo_dia(dispositivo_id):
+    return float(db.session.query(func.coalesce(func.sum(ConsumoDia.consumo_litros), 0))
+                 .filter(ConsumoDia.dispositivo_id == dispositivo_id).scalar())
+
+
+def test_parciais_pendentes_nao_somam_em_dobro_no_recalculo(app):
+    cliente = Cliente(nome='Cliente')
+    db.session.add(cliente)
+    db.session.flush()
+    disp = Dispositivo(modelo='HX', numero_serie='SERIE0001', cliente_id=cliente.id_cliente)
+    db.session.add(disp)
+    db.session.commit()
+    d = disp.id_dispositivo
+    agregador = AgregadorConsumo(intervalo=0)
+    # dia fechado já agregado: 100 -> 110
+    t1, t2, t3 = (datetime(2025, 1, 15, 12, m) for m in (0, 1, 2))
+    agregador.registrar(_gravar_lote(d, [(t1, '100'), (t2, '110')]), {})
+    agregador.flush()
+    assert _consumo_dia(d) == 10.0
+    # lote atrasado do mesmo dia, gravado em Leitura e ainda não enviado aos agregados: 110 -> 130
+    agregador.registrar(_gravar_lote(d, [(t3, '130')]), {d: (t2, 110.0)})
+    assert agregador.stats()['pendingRows'] > 0
+
+    resumo = gerar_faturamento_mensal(date(2025, 1, 1), agregador=agregador)
+
+    assert agregador.stats()['pendingRows'] == 0
+    agregador.flush()  # próximo ciclo da agregação incremental
+    assert _consumo_dia(d) == 30.0
+    assert resumo['liters'] == 30.0
+    assert db.session.query(ConsumoMensal.litros_consumidos).scalar() == Decimal('30.00')
@@ -35,6 +35,9 @@ with app.app_context():
     except Exception as e:
       db.session.rollback(); print('[ENTRYPOINT] Falha ao criar admin:', e)
 PY
+  # Revisões idempotentes: completam bancos antigos e só registram a versão em bancos recém-criados
+  echo "[ENTRYPOINT] Aplicando migrações (flask db upgrade)."
+  flask --app run db upgrade -d /app/migrations
 fi
 
 echo "[ENTRYPOINT] Iniciando aplicação Flask (run.py)"
@@ -96,6 +96,18 @@ def run_migrations_online():
 
     connectable = get_engine()
 
+    # índices com .ddl_if(dialect=...) (ex.: Alerta) só existem nos bancos desses dialetos;
+    # o autogenerate não consulta ddl_if e os proporia nos demais
+    def include_object(obj, name, type_, reflected, compare_to):
+        ddl_if = getattr(obj, '_ddl_if', None)
+        if type_ == 'index' and not reflected and ddl_if is not None and ddl_if.dialect:
+            dialetos = (ddl_if.dialect,) if isinstance(ddl_if.dialect, str) else ddl_if.dialect
+            return connectable.dialect.name in dialetos
+        return True
+
+    if conf_args.get("include_object") is None:
+        conf_args["include_object"] = include_object
+
     with connectable.connect() as connection:
         context.configure(
             connection=connection,
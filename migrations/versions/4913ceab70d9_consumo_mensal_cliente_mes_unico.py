@@ -0,0 +1,51 @@
+"""chave única (cliente, mês) em ConsumoMensal
+
+Revision ID: 4913ceab70d9
+Revises: d785d69b2834
+Create Date: 2026-10-18 14:00:00.000000
+
+- ConsumoMensal (cliente_id, mes_referencia): chave única uq_consumo_mensal_cliente_mes, usada pelo
+  upsert do faturamento mensal. Antes de criá-la, as linhas duplicadas são removidas, mantendo a mais
+  recente (maior id_consumo) de cada cliente e mês.
+
+Idempotente: bancos criados por db.create_all() com os modelos atuais já têm a chave.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4913ceab70d9'
+down_revision = 'd785d69b2834'
+branch_labels = None
+depends_on = None
+
+_NOME = 'uq_consumo_mensal_cliente_mes'
+
+
+def _indices(tabela):
+    insp = sa.inspect(op.get_bind())
+    nomes = {i['name'] for i in insp.get_indexes(tabela)}
+    nomes |= {u['name'] for u in insp.get_unique_constraints(tabela)}
+    return nomes
+
+
+def _remover_consumos_duplicados():
+    consumo = sa.table('ConsumoMensal', sa.column('id_consumo'), sa.column('cliente_id'),
+                       sa.column('mes_referencia'))
+    # tabela derivada: o MySQL não aceita a própria tabela do DELETE numa subconsulta direta
+    manter = (sa.select(sa.func.max(consumo.c.id_consumo).label('id'))
+              .group_by(consumo.c.cliente_id, consumo.c.mes_referencia).subquery())
+    op.execute(consumo.delete().where(consumo.c.id_consumo.not_in(sa.select(manter.c.id))))
+
+
+def upgrade():
+    if _NOME in _indices('ConsumoMensal'):
+        return
+    _remover_consumos_duplicados()
+    op.create_index(_NOME, 'ConsumoMensal', ['cliente_id', 'mes_referencia'], unique=True)
+
+
+def downgrade():
+    # a chave é mantida: o faturamento depende dela (ON CONFLICT / INSERT IGNORE)
+    pass
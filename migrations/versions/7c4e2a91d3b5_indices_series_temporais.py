@@ -0,0 +1,86 @@
+"""índices de séries temporais em Leitura e Alerta
+
+Revision ID: 7c4e2a91d3b5
+Revises:
+Create Date: 2026-10-18 10:00:00.000000
+
+- Leitura (dispositivo_id, data_hora): chave única uq_leitura_dispositivo_data_hora, usada pela ingestão
+  idempotente e por todas as consultas por dispositivo (criada aqui se o banco ainda não a tem, após
+  remover leituras duplicadas); ix_leitura_data_hora para as consultas da frota por tempo.
+- Alerta: alertas abertos por data. Índice parcial (detected_at) WHERE resolved_at IS NULL no
+  PostgreSQL/SQLite; composto (resolved_at, detected_at) no MySQL. Substitui ix_Alerta_resolved_at.
+
+Idempotente: bancos criados por db.create_all() já têm parte destes índices. No PostgreSQL os índices
+são criados com CONCURRENTLY (sem bloquear a ingestão), exceto em Leitura particionada.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c4e2a91d3b5'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+_ABERTOS = sa.text('resolved_at IS NULL')
+
+
+def _indices(tabela):
+    insp = sa.inspect(op.get_bind())
+    nomes = {i['name'] for i in insp.get_indexes(tabela)}
+    nomes |= {u['name'] for u in insp.get_unique_constraints(tabela)}
+    return nomes
+
+
+def _dialeto():
+    return op.get_bind().dialect.name
+
+
+def _criar_indice(nome, tabela, colunas, unico=False, **kw):
+    if nome in _indices(tabela):
+        return
+    if _dialeto() == 'postgresql':
+        particionada = op.get_bind().execute(sa.text(
+            "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:t)"), {'t': f'"{tabela}"'}).scalar()
+        if not particionada:
+            # CONCURRENTLY não roda dentro de transação
+            with op.get_context().autocommit_block():
+                op.create_index(nome, tabela, colunas, unique=unico, postgresql_concurrently=True, **kw)
+            return
+    op.create_index(nome, tabela, colunas, unique=unico, **kw)
+
+
+def _remover_leituras_duplicadas():
+    leitura = sa.table('Leitura', sa.column('id_leitura'), sa.column('dispositivo_id'), sa.column('data_hora'))
+    # tabela derivada: o MySQL não aceita a própria tabela do DELETE numa subconsulta direta
+    manter = (sa.select(sa.func.min(leitura.c.id_leitura).label('id'))
+              .group_by(leitura.c.dispositivo_id, leitura.c.data_hora).subquery())
+    op.execute(leitura.delete().where(leitura.c.id_leitura.not_in(sa.select(manter.c.id))))
+
+
+def upgrade():
+    if 'uq_leitura_dispositivo_data_hora' not in _indices('Leitura'):
+        _remover_leituras_duplicadas()
+        _criar_indice('uq_leitura_dispositivo_data_hora', 'Leitura', ['dispositivo_id', 'data_hora'], unico=True)
+    _criar_indice('ix_leitura_data_hora', 'Leitura', ['data_hora'])
+
+    if _dialeto() in ('mysql', 'mariadb'):
+        _criar_indice('ix_alerta_resolved_detected_at', 'Alerta', ['resolved_at', 'detected_at'])
+    else:
+        _criar_indice('ix_alerta_abertos_detected_at', 'Alerta', ['detected_at'],
+                      postgresql_where=_ABERTOS, sqlite_where=_ABERTOS)
+    if 'ix_Alerta_resolved_at' in _indices('Alerta'):
+        op.drop_index('ix_Alerta_resolved_at', table_name='Alerta')
+
+
+def downgrade():
+    existentes = _indices('Alerta')
+    if 'ix_Alerta_resolved_at' not in existentes:
+        op.create_index('ix_Alerta_resolved_at', 'Alerta', ['resolved_at'])
+    for nome in ('ix_alerta_abertos_detected_at', 'ix_alerta_resolved_detected_at'):
+        if nome in existentes:
+            op.drop_index(nome, table_name='Alerta')
+    if 'ix_leitura_data_hora' in _indices('Leitura'):
+        op.drop_index('ix_leitura_data_hora', table_name='Leitura')
+    # uq_leitura_dispositivo_data_hora é mantida: a ingestão depende dela (ON CONFLICT / INSERT IGNORE)
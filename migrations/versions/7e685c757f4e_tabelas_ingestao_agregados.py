@@ -0,0 +1,133 @@
+"""tabelas da ingestão (última leitura, agregados, estado de detecção) e chaves únicas
+
+Revision ID: 7e685c757f4e
+Revises: 7f1f7e2576c9
+Create Date: 2026-10-18 15:00:00.000000
+
+- LeituraAtual: última leitura por dispositivo, preenchida aqui a partir de Leitura.
+- ConsumoMinuto, ConsumoHora, ConsumoDia: agregados de consumo por dispositivo e período
+  (refaça o histórico com `flask --app run agregados-recalcular`).
+- EstadoDeteccao: checkpoint do estado das regras de detecção por serial.
+- uq_leitura_dispositivo_data_hora e uq_consumo_mensal_cliente_mes passam de índice único a restrição
+  UNIQUE, como nos modelos: no PostgreSQL com ADD CONSTRAINT ... USING INDEX (sem reconstruir o índice;
+  Leitura particionada fica com o índice), no SQLite recriando a tabela. No MySQL o índice único já é a
+  restrição.
+
+Idempotente: o startup da aplicação já cria as tabelas que faltarem e bancos criados por
+db.create_all() com os modelos atuais já têm tudo.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision = '7e685c757f4e'
+down_revision = '7f1f7e2576c9'
+branch_labels = None
+depends_on = None
+
+_AGREGADOS = (('ConsumoMinuto', sa.DateTime), ('ConsumoHora', sa.DateTime), ('ConsumoDia', sa.Date))
+_CHAVES = (('Leitura', 'uq_leitura_dispositivo_data_hora', ['dispositivo_id', 'data_hora']),
+           ('ConsumoMensal', 'uq_consumo_mensal_cliente_mes', ['cliente_id', 'mes_referencia']))
+
+
+def _tabelas():
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def _dialeto():
+    return op.get_bind().dialect.name
+
+
+def _criar_leitura_atual():
+    op.create_table(
+        'LeituraAtual',
+        sa.Column('dispositivo_id', sa.Integer(), nullable=False),
+        sa.Column('data_hora', sa.DateTime().with_variant(mysql.DATETIME(fsp=3), 'mysql'), nullable=False),
+        sa.Column('consumo_litros', sa.Numeric(10, 2), nullable=True),
+        sa.Column('total_liters', sa.Numeric(12, 3), nullable=True),
+        sa.Column('flow_lmin', sa.Numeric(10, 3), nullable=True),
+        sa.ForeignKeyConstraint(['dispositivo_id'], ['Dispositivo.id_dispositivo']),
+        sa.PrimaryKeyConstraint('dispositivo_id'),
+    )
+    # carga inicial: a leitura mais recente de cada dispositivo (pela chave (dispositivo_id, data_hora))
+    colunas = ('dispositivo_id', 'data_hora', 'consumo_litros', 'total_liters', 'flow_lmin')
+    leitura = sa.table('Leitura', *(sa.column(c) for c in colunas))
+    ult = (sa.select(leitura.c.dispositivo_id, sa.func.max(leitura.c.data_hora).label('data_hora'))
+           .group_by(leitura.c.dispositivo_id).subquery())
+    ultimas = sa.select(*(leitura.c[c] for c in colunas)).join(
+        ult, sa.and_(leitura.c.dispositivo_id == ult.c.dispositivo_id, leitura.c.data_hora == ult.c.data_hora))
+    atual = sa.table('LeituraAtual', *(sa.column(c) for c in colunas))
+    op.execute(atual.insert().from_select(colunas, ultimas))
+
+
+def _criar_agregado(tabela, tipo_inicio):
+    op.create_table(
+        tabela,
+        sa.Column('dispositivo_id', sa.Integer(), nullable=False),
+        sa.Column('inicio', tipo_inicio(), nullable=False),
+        sa.Column('total_min', sa.Numeric(12, 3), nullable=False),
+        sa.Column('total_max', sa.Numeric(12, 3), nullable=False),
+        sa.Column('consumo_litros', sa.Numeric(12, 3), nullable=False),
+        sa.Column('flow_max', sa.Numeric(10, 3), nullable=False),
+        sa.Column('amostras', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['dispositivo_id'], ['Dispositivo.id_dispositivo']),
+        sa.PrimaryKeyConstraint('dispositivo_id', 'inicio'),
+    )
+
+
+def _criar_estado_deteccao():
+    op.create_table(
+        'EstadoDeteccao',
+        sa.Column('serial', sa.String(100), nullable=False),
+        sa.Column('estado', sa.Text(), nullable=False),
+        sa.Column('ultimo_ts', sa.BigInteger(), nullable=False),
+        sa.Column('atualizado_em', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('serial'),
+    )
+    op.create_index('ix_EstadoDeteccao_atualizado_em', 'EstadoDeteccao', ['atualizado_em'])
+
+
+def _indice_para_restricao(tabela, nome, colunas):
+    insp = sa.inspect(op.get_bind())
+    if nome in {u['name'] for u in insp.get_unique_constraints(tabela)}:
+        return
+    if nome not in {i['name'] for i in insp.get_indexes(tabela)}:
+        return
+    if _dialeto() == 'postgresql':
+        particionada = op.get_bind().execute(sa.text(
+            "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:t)"), {'t': f'"{tabela}"'}).scalar()
+        if not particionada:
+            op.execute(f'ALTER TABLE "{tabela}" ADD CONSTRAINT {nome} UNIQUE USING INDEX {nome}')
+    elif _dialeto() == 'sqlite':
+        # o SQLite não altera restrições: a tabela é recriada com a UNIQUE no lugar do índice
+        op.drop_index(nome, table_name=tabela)
+        with op.batch_alter_table(tabela, recreate='always') as batch:
+            batch.create_unique_constraint(nome, colunas)
+
+
+def upgrade():
+    existentes = _tabelas()
+    if 'LeituraAtual' not in existentes:
+        _criar_leitura_atual()
+    for tabela, tipo_inicio in _AGREGADOS:
+        if tabela not in existentes:
+            _criar_agregado(tabela, tipo_inicio)
+    if 'EstadoDeteccao' not in existentes:
+        _criar_estado_deteccao()
+    for tabela, nome, colunas in _CHAVES:
+        _indice_para_restricao(tabela, nome, colunas)
+
+
+def downgrade():
+    # as chaves únicas são mantidas: ingestão e faturamento dependem delas (ON CONFLICT / INSERT IGNORE)
+    existentes = _tabelas()
+    if 'EstadoDeteccao' in existentes:
+        op.drop_index('ix_EstadoDeteccao_atualizado_em', table_name='EstadoDeteccao')
+        op.drop_table('EstadoDeteccao')
+    for tabela, _ in reversed(_AGREGADOS):
+        if tabela in existentes:
+            op.drop_table(tabela)
+    if 'LeituraAtual' in existentes:
+        op.drop_table('LeituraAtual')
@@ -0,0 +1,47 @@
+"""faixas de consumo de tarifas escalonadas
+
+Revision ID: 7f1f7e2576c9
+Revises: 4913ceab70d9
+Create Date: 2026-10-18 14:30:00.000000
+
+- FaixaTarifa: faixas de uma tarifa escalonada (ordem, limite_m3 nulo = sem limite, valor_m3), com
+  índice ix_FaixaTarifa_tarifa_id para carregar as faixas junto das tarifas. Tarifas sem faixas
+  continuam cobrando Tarifa.valor_m3 sobre todo o consumo.
+
+Idempotente: bancos criados por db.create_all() com os modelos atuais já têm a tabela.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f1f7e2576c9'
+down_revision = '4913ceab70d9'
+branch_labels = None
+depends_on = None
+
+
+def _tabelas():
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def upgrade():
+    if 'FaixaTarifa' in _tabelas():
+        return
+    op.create_table(
+        'FaixaTarifa',
+        sa.Column('id_faixa', sa.Integer(), nullable=False),
+        sa.Column('tarifa_id', sa.Integer(), nullable=False),
+        sa.Column('ordem', sa.Integer(), nullable=False),
+        sa.Column('limite_m3', sa.Numeric(10, 3), nullable=True),
+        sa.Column('valor_m3', sa.Numeric(10, 4), nullable=False),
+        sa.ForeignKeyConstraint(['tarifa_id'], ['Tarifa.id_tarifa']),
+        sa.PrimaryKeyConstraint('id_faixa'),
+    )
+    op.create_index('ix_FaixaTarifa_tarifa_id', 'FaixaTarifa', ['tarifa_id'])
+
+
+def downgrade():
+    if 'FaixaTarifa' in _tabelas():
+        op.drop_index('ix_FaixaTarifa_tarifa_id', table_name='FaixaTarifa')
+        op.drop_table('FaixaTarifa')
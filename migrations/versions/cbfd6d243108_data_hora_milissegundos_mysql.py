@@ -0,0 +1,53 @@
+"""data_hora com milissegundos no MySQL (Leitura, LeituraAtual)
+
+Revision ID: cbfd6d243108
+Revises: 7e685c757f4e
+Create Date: 2026-10-18 16:00:00.000000
+
+- MySQL/MariaDB: Leitura.data_hora e LeituraAtual.data_hora passam de DATETIME (segundos) a DATETIME(3),
+  como nos modelos. Com DATETIME(0) o ts em ms do dispositivo é truncado e duas leituras reais no mesmo
+  segundo colidem em uq_leitura_dispositivo_data_hora (a segunda é descartada pelo INSERT IGNORE).
+  O ALTER reescreve a tabela: rode com a ingestão parada em bancos grandes.
+- Demais dialetos: nada a fazer (DATETIME do SQLite e TIMESTAMP do PostgreSQL já guardam frações).
+
+Idempotente: colunas que já têm fsp >= 3 não são alteradas.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision = 'cbfd6d243108'
+down_revision = '7e685c757f4e'
+branch_labels = None
+depends_on = None
+
+_TABELAS = ('Leitura', 'LeituraAtual')
+
+
+def _fsp(tabela):
+    """fsp atual de <tabela>.data_hora (None se a tabela não existe)."""
+    insp = sa.inspect(op.get_bind())
+    if not insp.has_table(tabela):
+        return None
+    for coluna in insp.get_columns(tabela):
+        if coluna['name'] == 'data_hora':
+            return getattr(coluna['type'], 'fsp', None) or 0
+    return None
+
+
+def upgrade():
+    if op.get_bind().dialect.name not in ('mysql', 'mariadb'):
+        return
+    for tabela in _TABELAS:
+        fsp = _fsp(tabela)
+        if fsp is not None and fsp < 3:
+            op.alter_column(tabela, 'data_hora', existing_type=mysql.DATETIME(fsp=fsp or None),
+                            type_=mysql.DATETIME(fsp=3), existing_nullable=False)
+
+
+def downgrade():
+    # DATETIME(3) é mantido: voltar a segundos truncaria os ms e faria leituras do mesmo segundo
+    # colidirem na chave única (dispositivo_id, data_hora)
+    pass
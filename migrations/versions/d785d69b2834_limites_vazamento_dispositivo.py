@@ -0,0 +1,45 @@
+"""limites de vazamento por tipo de dispositivo e por dispositivo
+
+Revision ID: d785d69b2834
+Revises: 7c4e2a91d3b5
+Create Date: 2026-10-18 12:00:00.000000
+
+- TipoDispositivo e Dispositivo: leak_flow_threshold (L/min) e leak_min_seconds, nulos = herda
+  (dispositivo -> tipo -> LEAK_FLOW_THRESHOLD / LEAK_MIN_SECONDS do config).
+
+Idempotente: bancos criados por db.create_all() com os modelos atuais já têm as colunas.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd785d69b2834'
+down_revision = '7c4e2a91d3b5'
+branch_labels = None
+depends_on = None
+
+_TABELAS = ('TipoDispositivo', 'Dispositivo')
+
+
+def _colunas(tabela):
+    return {c['name'] for c in sa.inspect(op.get_bind()).get_columns(tabela)}
+
+
+def upgrade():
+    for tabela in _TABELAS:
+        existentes = _colunas(tabela)
+        if 'leak_flow_threshold' not in existentes:
+            op.add_column(tabela, sa.Column('leak_flow_threshold', sa.Float(), nullable=True))
+        if 'leak_min_seconds' not in existentes:
+            op.add_column(tabela, sa.Column('leak_min_seconds', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    for tabela in _TABELAS:
+        existentes = _colunas(tabela)
+        # batch: o SQLite só remove colunas recriando a tabela
+        with op.batch_alter_table(tabela) as batch:
+            for coluna in ('leak_min_seconds', 'leak_flow_threshold'):
+                if coluna in existentes:
+                    batch.drop_column(coluna)
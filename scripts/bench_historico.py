@@ -0,0 +1,75 @@
+"""
+Mede o downsampling do histórico em memória: reduzir_serie (LTTB / minmax) isolado e
+GET /api/history?points=N com o buffer do serial cheio (HISTORY_LIMIT leituras).
+
+Sobe a aplicação real num SQLite temporário, sem ingestão nem broker (APP_ROLE=web).
+
+Uso:
+  python scripts/bench_historico.py [--capacidade 1000] [--n 300] [--pontos 100 500]
+"""
+import argparse
+import math
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_APP_DIR = Path(__file__).resolve().parent.parent / 'MVC_sistema_leitura_hidrometros'
+
+
+def _preparar_ambiente(capacidade):
+    os.environ['DB_ENGINE'] = 'sqlite'
+    os.environ['SQLITE_PATH'] = str(Path(tempfile.mkdtemp(prefix='bench-historico-')) / 'app.db')
+    os.environ['APP_ROLE'] = 'web'
+    os.environ['MQTT_URL'] = 'mqtt://127.0.0.1:1'
+    os.environ['LEITURA_MAINTENANCE_HOURS'] = '0'
+    os.environ['HISTORY_LIMIT'] = str(capacidade)
+    sys.path.insert(0, str(_APP_DIR))
+
+
+def _serie(n, serial='BENCH001', ts0=1760000000000):
+    # vazão com ruído e picos, para que LTTB e minmax escolham pontos diferentes
+    return [{'numero_serie': serial, 'ts': ts0 + i * 1000, 'totalLiters': i * 0.05,
+             'flowLmin': 3 + 2 * math.sin(i / 17) + (8 if i % 97 == 0 else 0)} for i in range(n)]
+
+
+def _medir(funcao, n):
+    funcao()  # aquecimento
+    inicio = time.perf_counter()
+    for _ in range(n):
+        funcao()
+    return (time.perf_counter() - inicio) / n * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--capacidade', type=int, default=1000, help='HISTORY_LIMIT (leituras no buffer do serial)')
+    ap.add_argument('--n', type=int, default=300, help='repetições por medida')
+    ap.add_argument('--pontos', type=int, nargs='+', default=[100, 500])
+    args = ap.parse_args()
+    _preparar_ambiente(args.capacidade)
+
+    from app import app, _historico
+    from app.services.historico_service import reduzir_serie
+
+    _historico.adicionar_varios(_serie(args.capacidade))
+    serial, ts, total, flow = _historico.consultar_colunas('BENCH001', limit=args.capacidade)
+    print(f'buffer: {len(ts)} leituras ({serial})')
+    for pontos in args.pontos:
+        for metodo in ('lttb', 'minmax'):
+            us = _medir(lambda: reduzir_serie(ts, total, flow, pontos, metodo), args.n)
+            print(f'reduzir_serie {metodo:6s} points={pontos:<5d} {us:9.1f} us  ({us * 1000 / len(ts):6.1f} ns/leitura)')
+
+    cliente = app.test_client()
+    base = f'/api/history?serial=BENCH001&limit={args.capacidade}'
+    urls = [('sem points', base)] + [(f'{m} points={p}', f'{base}&points={p}&method={m}')
+                                     for p in args.pontos for m in ('lttb', 'minmax')]
+    for nome, url in urls:
+        assert cliente.get(url).status_code == 200
+        us = _medir(lambda: cliente.get(url), args.n)
+        print(f'GET /api/history {nome:18s} {us / 1000:7.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+Tempo das consultas de séries temporais de Leitura e Alerta antes e depois dos índices da migração
+7c4e2a91d3b5 (uq_leitura_dispositivo_data_hora, ix_leitura_data_hora e alertas abertos por data).
+
+Não depende do Flask: cria tabelas próprias (mesmas colunas usadas pelas consultas) no banco de `--url`,
+carrega os dados sintéticos uma vez (reaproveitados com --reusar), mede cada consulta sem índices,
+cria os índices e mede de novo, mostrando o plano de execução final.
+
+Uso:
+  python scripts/bench_indices.py [--url sqlite:////tmp/bench_indices.db] [--leituras 10000000]
+      [--dispositivos 2000] [--alertas 200000] [--repeticoes 5] [--reusar]
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+import sqlalchemy as sa
+
+meta = sa.MetaData()
+leitura = sa.Table(
+    'bench_leitura', meta,
+    sa.Column('id_leitura', sa.Integer, primary_key=True),
+    sa.Column('dispositivo_id', sa.Integer, nullable=False),
+    sa.Column('data_hora', sa.DateTime, nullable=False),
+    sa.Column('consumo_litros', sa.Numeric(10, 2)),
+    sa.Column('total_liters', sa.Numeric(12, 3)),
+    sa.Column('flow_lmin', sa.Numeric(10, 3)),
+)
+alerta = sa.Table(
+    'bench_alerta', meta,
+    sa.Column('id_alerta', sa.Integer, primary_key=True),
+    sa.Column('serial', sa.String(100)),
+    sa.Column('tipo', sa.String(50)),
+    sa.Column('detected_at', sa.DateTime),
+    sa.Column('resolved_at', sa.DateTime),
+)
+_ABERTOS = sa.text('resolved_at IS NULL')
+INICIO = datetime(2026, 1, 1)
+
+
+def indices(dialeto):
+    """Os mesmos índices da migração, no dialeto do banco."""
+    lista = [
+        sa.Index('bench_uq_leitura_dispositivo_data_hora', leitura.c.dispositivo_id, leitura.c.data_hora, unique=True),
+        sa.Index('bench_ix_leitura_data_hora', leitura.c.data_hora),
+    ]
+    if dialeto in ('mysql', 'mariadb'):
+        lista.append(sa.Index('bench_ix_alerta_resolved_detected_at', alerta.c.resolved_at, alerta.c.detected_at))
+    else:
+        lista.append(sa.Index('bench_ix_alerta_abertos_detected_at', alerta.c.detected_at,
+                              postgresql_where=_ABERTOS, sqlite_where=_ABERTOS))
+    for indice in lista:
+        # desvincula da tabela: create_all cria as tabelas sem índices e eles são criados/removidos à parte
+        indice.table.indexes.discard(indice)
+    return lista
+
+
+def carregar(engine, n_leituras, n_dispositivos, n_alertas, lote=50000):
+    """Leituras a cada minuto por dispositivo, em ordem de chegada (intercaladas), e alertas ~1% abertos."""
+    meta.drop_all(engine)
+    meta.create_all(engine)
+    t0 = time.perf_counter()
+    linhas = []
+    with engine.begin() as conn:
+        for i in range(n_leituras):
+            minuto, disp = divmod(i, n_dispositivos)
+            total = minuto * 1.5
+            linhas.append({'dispositivo_id': disp + 1, 'data_hora': INICIO + timedelta(minutes=minuto),
+                           'consumo_litros': total, 'total_liters': total, 'flow_lmin': 1.5})
+            if len(linhas) >= lote:
+                conn.execute(leitura.insert(), linhas)
+                linhas = []
+                if i % 1000000 < lote:
+                    print(f'  {i + 1:>11,} leituras ({time.perf_counter() - t0:.0f}s)')
+        if linhas:
+            conn.execute(leitura.insert(), linhas)
+        rnd = random.Random(1)
+        span = max(1, n_leituras // n_dispositivos) * 60
+        alertas = []
+        for i in range(n_alertas):
+            detectado = INICIO + timedelta(seconds=rnd.randrange(span))
+            aberto = rnd.random() < 0.01
+            alertas.append({'serial': f'S{rnd.randrange(n_dispositivos)}', 'tipo': 'leak', 'detected_at': detectado,
+                            'resolved_at': None if aberto else detectado + timedelta(minutes=30)})
+            if len(alertas) >= lote:
+                conn.execute(alerta.insert(), alertas)
+                alertas = []
+        if alertas:
+            conn.execute(alerta.insert(), alertas)
+    print(f'  carga concluída em {time.perf_counter() - t0:.0f}s')
+
+
+def consultas(n_dispositivos, n_leituras):
+    """(nome, função(rnd) -> statement) com as formas de consulta usadas pela aplicação."""
+    minutos = max(1, n_leituras // n_dispositivos)
+    cols = (leitura.c.data_hora, leitura.c.total_liters, leitura.c.flow_lmin)
+
+    def disp(rnd):
+        return rnd.randint(1, n_dispositivos)
+
+    def intervalo(rnd):
+        ini = INICIO + timedelta(minutes=rnd.randrange(max(1, minutos - 60)))
+        return (sa.select(*cols)
+                .where(leitura.c.dispositivo_id == disp(rnd), leitura.c.data_hora >= ini,
+                       leitura.c.data_hora < ini + timedelta(hours=1))
+                .order_by(leitura.c.data_hora))
+
+    return [
+        ('histórico do dispositivo (200 mais recentes)',
+         lambda r: sa.select(*cols).where(leitura.c.dispositivo_id == disp(r))
+         .order_by(leitura.c.data_hora.desc()).limit(200)),
+        ('última leitura do dispositivo',
+         lambda r: sa.select(*cols).where(leitura.c.dispositivo_id == disp(r))
+         .order_by(leitura.c.data_hora.desc()).limit(1)),
+        ('intervalo de 1h do dispositivo', intervalo),
+        ('frota: 200 mais recentes',
+         lambda r: sa.select(leitura.c.dispositivo_id, *cols).order_by(leitura.c.data_hora.desc()).limit(200)),
+        ('alertas abertos (100 mais recentes)',
+         lambda r: sa.select(alerta.c.id_alerta, alerta.c.serial, alerta.c.detected_at)
+         .where(alerta.c.resolved_at.is_(None)).order_by(alerta.c.detected_at.desc()).limit(100)),
+    ]
+
+
+def medir(engine, lista, repeticoes):
+    tempos = []
+    with engine.connect() as conn:
+        for _, montar in lista:
+            rnd = random.Random(42)
+            amostras = []
+            for _ in range(repeticoes):
+                stmt = montar(rnd)
+                t0 = time.perf_counter()
+                conn.execute(stmt).fetchall()
+                amostras.append((time.perf_counter() - t0) * 1000.0)
+            tempos.append(statistics.median(amostras))
+    return tempos
+
+
+def plano(engine, stmt):
+    dialeto = engine.dialect.name
+    sql = str(stmt.compile(engine, compile_kwargs={'literal_binds': True}))
+    prefixo = 'EXPLAIN QUERY PLAN ' if dialeto == 'sqlite' else 'EXPLAIN '
+    with engine.connect() as conn:
+        linhas = conn.exec_driver_sql(prefixo + sql).fetchall()
+    if dialeto == 'sqlite':
+        return ' | '.join(str(l[-1]) for l in linhas)
+    if dialeto == 'postgresql':
+        return ' | '.join(l[0].strip() for l in linhas[:3])
+    return ' | '.join(f'{l._mapping.get("table")}: key={l._mapping.get("key")} {l._mapping.get("Extra") or ""}'
+                      for l in linhas)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--url', default='sqlite:////tmp/bench_indices.db')
+    ap.add_argument('--leituras', type=int, default=10_000_000)
+    ap.add_argument('--dispositivos', type=int, default=2000)
+    ap.add_argument('--alertas', type=int, default=200_000)
+    ap.add_argument('--repeticoes', type=int, default=5)
+    ap.add_argument('--reusar', action='store_true', help='Não recria os dados se as tabelas já existem')
+    args = ap.parse_args()
+    engine = sa.create_engine(args.url)
+    dialeto = engine.dialect.name
+    insp = sa.inspect(engine)
+    if not (args.reusar and insp.has_table(leitura.name)):
+        print(f'Carregando {args.leituras:,} leituras de {args.dispositivos} dispositivos e {args.alertas:,} alertas...')
+        carregar(engine, args.leituras, args.dispositivos, args.alertas)
+    with engine.begin() as conn:
+        for indice in indices(dialeto):
+            indice.drop(conn, checkfirst=True)
+    lista = consultas(args.dispositivos, args.leituras)
+
+    antes = medir(engine, lista, args.repeticoes)
+    t0 = time.perf_counter()
+    with engine.begin() as conn:
+        for indice in indices(dialeto):
+            indice.create(conn)
+        conn.exec_driver_sql('ANALYZE' if dialeto != 'mysql' else f'ANALYZE TABLE {leitura.name}, {alerta.name}')
+    print(f'Índices criados em {time.perf_counter() - t0:.1f}s')
+    depois = medir(engine, lista, args.repeticoes)
+
+    print(f'\n{"consulta":45s} {"sem índice":>12s} {"com índice":>12s} {"ganho":>9s}')
+    for (nome, montar), a, d in zip(lista, antes, depois):
+        print(f'{nome:45s} {a:10.2f}ms {d:10.3f}ms {a / max(d, 1e-6):8.0f}x')
+        print(f'    plano: {plano(engine, montar(random.Random(42)))}')
+
+
+if __name__ == '__main__':
+    main()
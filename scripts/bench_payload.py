@@ -0,0 +1,47 @@
+"""
+Compara custo de decodificação por mensagem: JSON (formato atual do firmware) x frame binário v1.
+
+Não depende do Flask: carrega app/services/payload_service.py diretamente.
+
+Uso:
+  python scripts/bench_payload.py [--n 200000]
+"""
+import argparse
+import importlib.util
+import json
+import time
+from pathlib import Path
+
+_MOD = Path(__file__).resolve().parent.parent / 'MVC_sistema_leitura_hidrometros' / 'app' / 'services' / 'payload_service.py'
+_spec = importlib.util.spec_from_file_location('payload_service', _MOD)
+payload_service = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(payload_service)
+
+
+def medir(nome, payload, topic, n):
+    decode = payload_service.decodificar_payload
+    inicio = time.perf_counter()
+    for _ in range(n):
+        decode(topic, payload)
+    dur = time.perf_counter() - inicio
+    print(f'{nome:22s} {len(payload):4d} bytes  {dur / n * 1e6:7.3f} us/msg')
+    return dur
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--n', type=int, default=200000)
+    args = ap.parse_args()
+    ts, total, flow, serial = 1760000000000, 12345.678, 3.25, 'SIMULADOR001'
+    js = json.dumps({'numeroSerie': serial, 'totalLiters': total, 'flowLmin': flow, 'ts': ts}).encode()
+    com_serial = payload_service.codificar_binario(ts, total, flow, serial)
+    sem_serial = payload_service.codificar_binario(ts, total, flow)
+    base = medir('json', js, 'hidrometro/leandro/dados', args.n)
+    for nome, p, topic in (('bin (serial no frame)', com_serial, 'hidrometro/leandro/dados'),
+                           ('bin (serial no topico)', sem_serial, f'hidrometro/leandro/bin/{serial}')):
+        dur = medir(nome, p, topic, args.n)
+        print(f'{"":22s} {len(js) / len(p):.1f}x menor, {base / dur:.1f}x mais rápido que JSON')
+
+
+if __name__ == '__main__':
+    main()
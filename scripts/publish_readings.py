@@ -0,0 +1,55 @@
+"""
+Publica leituras sintéticas no broker MQTT (ex: mosquitto local do docker-compose).
+
+Útil para validar a ingestão com várias réplicas (shared subscription): publique N
+leituras e confira que a tabela Leitura recebeu exatamente N linhas (sem duplicatas).
+
+Uso:
+  python scripts/publish_readings.py --host localhost --count 1000 --serials SIM001,SIM002
+"""
+import argparse
+import json
+import time
+
+import paho.mqtt.client as mqtt
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--host', default='localhost')
+    ap.add_argument('--port', type=int, default=1883)
+    ap.add_argument('--topic', default='hidrometro/leandro/dados')
+    ap.add_argument('--count', type=int, default=100, help='total de leituras publicadas')
+    ap.add_argument('--serials', default='SIMULADOR001', help='seriais separados por vírgula')
+    ap.add_argument('--rate', type=float, default=0, help='mensagens por segundo (0 = sem limite)')
+    ap.add_argument('--qos', type=int, default=1, choices=(0, 1, 2))
+    args = ap.parse_args()
+
+    serials = [s.strip() for s in args.serials.split(',') if s.strip()]
+    client = mqtt.Client()
+    client.connect(args.host, args.port, 60)
+    client.loop_start()
+    totals = {s: 0.0 for s in serials}
+    inicio = time.time()
+    base_ts = int(inicio * 1000)
+    for i in range(args.count):
+        serial = serials[i % len(serials)]
+        flow = 1.5
+        totals[serial] += flow / 12.0
+        payload = {
+            'numeroSerie': serial,
+            'totalLiters': round(totals[serial], 3),
+            'flowLmin': flow,
+            'ts': base_ts + i,
+        }
+        client.publish(args.topic, json.dumps(payload), qos=args.qos).wait_for_publish()
+        if args.rate > 0:
+            time.sleep(1.0 / args.rate)
+    client.loop_stop()
+    client.disconnect()
+    dur = time.time() - inicio
+    print(f'{args.count} leituras publicadas em {dur:.2f}s ({args.count / dur if dur else 0:.0f} msg/s) em {args.topic}')
+
+
+if __name__ == '__main__':
+    main()